@@ -0,0 +1,47 @@
+"""
+Benchmark of InfluxDBTimeSeries._create_bulk_request for 500 row chunks, compared with the original per-row
+implementation. The output of both is checked to be identical.
+Run from the repository root with:  python -m benchmarks.bulk_request_bench
+"""
+from datetime import datetime, timedelta
+import time
+
+from brewpi.datalog.beerlog import ts_columns
+from brewpi.datalog.influxdb.db import InfluxDBTimeSeries
+from brewpi.datalog.time import uts_datetime_to_millis
+
+__author__ = 'mat'
+
+
+def create_bulk_request_per_row(ts: InfluxDBTimeSeries, bulkdata: list) -> dict:
+    """ the original implementation: checks the time and converts each row separately """
+    bulk_request = ts._build_json_request()
+    for data in bulkdata:
+        if datetime.utcnow() < data[0]:
+            raise ValueError("cannot insert a time in the future")
+        values = [uts_datetime_to_millis(data[0])]
+        values.extend(data[1:])
+        ts._append_datapoint(bulk_request, values)
+    return bulk_request
+
+
+def main(chunks: int = 2000, chunk_size: int = 500):
+    ts = InfluxDBTimeSeries(None, 'bench', ts_columns)
+    start = datetime(2016, 1, 1)
+    chunk = [[start + timedelta(seconds=5 * i), 20.5, 20, None, 18.25, 18, None, 1, 22.0] for i in range(chunk_size)]
+    assert ts._create_bulk_request(chunk) == create_bulk_request_per_row(ts, chunk)
+    rows = chunks * chunk_size
+    results = []
+    for name, f in (('per row', lambda: create_bulk_request_per_row(ts, chunk)),
+                    ('bulk', lambda: ts._create_bulk_request(chunk))):
+        t = time.perf_counter()
+        for _ in range(chunks):
+            f()
+        elapsed = time.perf_counter() - t
+        results.append(elapsed)
+        print('%-8s %10.0f rows/s' % (name, rows / elapsed))
+    print('speedup %.1fx' % (results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Generates synthetic BrewPi json logs for benchmarks and tests. The output is deterministic for a given seed, so
+results can be compared between commits.
+Each brew is a directory of log files, named and laid out as the BrewPi web interface writes them. The rows follow
+a fermentation profile: the beer setting steps through a schedule, the beer temperature tracks it, the fridge
+cycles around it and the room drifts. Values may be missing, annotations are added when the setting changes and at
+random, and the local times may jump an hour forward or back for daylight saving.
+Run from the repository root with:  python -m benchmarks.generate_logs <directory>
+"""
+from datetime import datetime, timedelta
+import argparse
+import math
+import os
+import random
+
+import simplejson as json
+
+from brewpi.datalog.beerlog import v021_columns
+from brewpi.datalog.beerlog_json import compressions
+
+__author__ = 'mat'
+
+column_types = {'time': 'datetime', 'beerAnn': 'string', 'fridgeAnn': 'string'}
+column_labels = {'time': 'Time', 'beerTemp': 'Beer temperature', 'beerSet': 'Beer setting',
+                 'beerAnn': 'Beer Annotate', 'fridgeTemp': 'Fridge temperature', 'fridgeSet': 'Fridge setting',
+                 'fridgeAnn': 'Fridge Annotate', 'state': 'State', 'roomTemp': 'Room temp.'}
+profile = [18.0, 19.0, 20.0, 21.0, 4.0]
+annotations = ['Beer temp set to %.1f in web interface', 'Fridge constant mode', 'Door opened',
+               'Heating', 'Cooling', 'Idle']
+
+
+def date_string(t: datetime) -> str:
+    """ the javascript date notation used in the logs, with a 0-based month.
+    >>> date_string(datetime(2016, 1, 31, 8, 5, 0))
+    'Date(2016,0,31,8,5,0)'
+    """
+    return 'Date(%d,%d,%d,%d,%d,%d)' % (t.year, t.month - 1, t.day, t.hour, t.minute, t.second)
+
+
+def generate_rows(count: int, start: datetime = datetime(2016, 1, 1), interval: timedelta = timedelta(minutes=1),
+                  nulls: float = 0.01, annotated: float = 0.001, dst_jumps: int = 0, seed: int = 0):
+    """ generates rows of v0.2.1 log values, with the time in local time.
+    :param count:   the number of rows
+    :param start:   the time of the first row
+    :param interval:    the time between rows
+    :param nulls:   the probability of each value being missing
+    :param annotated:   the probability of a row having a beer annotation, besides those when the setting changes
+    :param dst_jumps:   the number of daylight saving changes, spread evenly through the rows. They alternate between
+        the clocks going forward an hour and going back an hour, so times repeat after a change back.
+    :param seed:    the seed of the random values
+    >>> rows = list(generate_rows(3, seed=1))
+    >>> [r[0] for r in rows] == [datetime(2016, 1, 1, 0, i) for i in range(3)], len(rows[0])
+    (True, 9)
+    >>> rows == list(generate_rows(3, seed=1))
+    True
+    >>> [r[0].hour for r in generate_rows(4, interval=timedelta(hours=2), dst_jumps=1)]
+    [0, 2, 5, 7]
+    """
+    rnd = random.Random(seed)
+    jumps = {count * (j + 1) // (dst_jumps + 1): 1 if j % 2 == 0 else -1 for j in range(dst_jumps)}
+    offset = timedelta(0)
+    step = max(count // len(profile), 1)
+    beer = room = profile[0]
+    setting = None
+    fridge = beer - 2
+    for i in range(count):
+        offset += timedelta(hours=jumps.get(i, 0))
+        beer_ann = None
+        if profile[min(i // step, len(profile) - 1)] != setting:
+            setting = profile[min(i // step, len(profile) - 1)]
+            beer_ann = annotations[0] % setting
+        elif rnd.random() < annotated:
+            beer_ann = rnd.choice(annotations[1:])
+        beer += (setting - beer) * 0.01 + rnd.gauss(0, 0.02)
+        fridge_set = setting + max(min((setting - beer) * 5, 10), -10)
+        fridge += (fridge_set - fridge) * 0.1 + rnd.gauss(0, 0.1)
+        room = 19 + 2 * math.sin(i * interval.total_seconds() / 43200 * math.pi) + rnd.gauss(0, 0.05)
+        state = 1 if fridge > fridge_set + 0.5 else 2 if fridge < fridge_set - 0.5 else 0
+        values = [round(beer, 2), setting, beer_ann, round(fridge, 2), round(fridge_set, 2), None, state,
+                  round(room, 2)]
+        values = [None if v is not None and rnd.random() < nulls else v for v in values]
+        yield [start + i * interval + offset] + values
+
+
+def write_log(f, rows, columns: list = v021_columns):
+    """ writes rows as a BrewPi json log file. The rows are written one at a time, so any number may be written. """
+    cols = [{'type': column_types.get(c, 'number'), 'id': c, 'label': column_labels.get(c, c)} for c in columns]
+    f.write('{"cols":%s,"rows":[' % json.dumps(cols))
+    separator = ''
+    for r in rows:
+        cells = [{'v': date_string(r[0])}] + [None if v is None else {'v': v} for v in r[1:]]
+        f.write(separator + json.dumps({'c': cells}))
+        separator = ',\n'
+    f.write(']}')
+
+
+def generate_brew(directory: str, name: str, rows: int, files: int = 1, compression: str = None, **kwargs) -> list:
+    """ writes the log files of a brew to a subdirectory of the given directory.
+    :param rows:    the number of rows in the brew, shared between the files in order
+    :param files:   the number of log files
+    :param compression: when given, the files are compressed, and this extension, such as '.gz', is added to their
+        names
+    :param kwargs:  passed to generate_rows
+    :return: the paths of the files written
+    """
+    brew = os.path.join(directory, name)
+    os.makedirs(brew, exist_ok=True)
+    it = generate_rows(rows, **kwargs)
+    paths = []
+    for i in range(files):
+        path = os.path.join(brew, '%s-%03d.json%s' % (name, i + 1, compression or ''))
+        n = rows * (i + 1) // files - rows * i // files
+        with (compressions[compression](path, 'wt') if compression else open(path, 'w')) as f:
+            write_log(f, (next(it) for _ in range(n)))
+        paths.append(path)
+    return paths
+
+
+def generate_repo(directory: str, brews: int, rows: int, files: int = 1, seed: int = 0, **kwargs) -> list:
+    """ writes the logs of several brews, each with a different seed and starting after the one before.
+    :return: the names of the brews
+    """
+    names = []
+    for b in range(brews):
+        name = 'brew%02d' % (b + 1)
+        generate_brew(directory, name, rows, files, seed=seed + b, start=datetime(2016, 1, 1) + b * timedelta(30),
+                      **kwargs)
+        names.append(name)
+    return names
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """ adds the options describing the generated logs """
+    parser.add_argument('--brews', type=int, default=2, help='the number of brews')
+    parser.add_argument('--rows', type=int, default=100000, help='the number of rows in each brew')
+    parser.add_argument('--files', type=int, default=10, help='the number of log files in each brew')
+    parser.add_argument('--nulls', type=float, default=0.01, help='the probability of a value being missing')
+    parser.add_argument('--annotated', type=float, default=0.001,
+                        help='the probability of a row having an annotation')
+    parser.add_argument('--dst-jumps', type=int, default=0,
+                        help='the number of daylight saving changes in each brew. Changes back repeat times, '
+                             'which series that must be in time order reject.')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the random values')
+    parser.add_argument('--compression', choices=sorted(compressions), help='compresses the log files')
+
+
+def log_options(args) -> dict:
+    return {'brews': args.brews, 'rows': args.rows, 'files': args.files, 'nulls': args.nulls,
+            'annotated': args.annotated, 'dst_jumps': args.dst_jumps, 'seed': args.seed,
+            'compression': args.compression}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='generates synthetic BrewPi json logs')
+    parser.add_argument('directory', help='the directory the brews are written to')
+    add_arguments(parser)
+    args = parser.parse_args(args)
+    names = generate_repo(args.directory, **log_options(args))
+    print('wrote %d rows in each of %s' % (args.rows, ', '.join(names)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of parsing a brew's log files in worker processes. The original protocol read each file in the parent,
+sent the text to a worker and received the full list of rows back. Now the workers open the files by path and
+return packed columns. Reports rows/s and the CPU time spent in the parent process, which is the serial part.
+Run from the repository root with:  python -m benchmarks.parallel_parse_bench
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from fs.opener import fsopendir
+
+from benchmarks.generate_logs import generate_brew
+from brewpi.datalog.beerlog_json import BeerlogJson, BeerlogJsonRepo, beerlog_source
+
+__author__ = 'mat'
+
+
+def parse_text_rows(text: str) -> list:
+    """ the original worker task: parses the text of a file to a list of rows """
+    return list(BeerlogJson(partial(io.StringIO, text)).rows())
+
+
+def text_protocol(series, workers: int) -> int:
+    with ProcessPoolExecutor(workers) as executor:
+        texts = (beerlog_source(s).read_text() for s in series.serieses)
+        return sum(len(rows) for rows in executor.map(parse_text_rows, texts))
+
+
+def timed(name, f):
+    wall, cpu = time.perf_counter(), time.process_time()
+    count = f()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print('%-24s %10.0f rows/s   parent cpu %6.2fs' % (name, count / wall, cpu))
+
+
+def main(rows: int = 200000, files: int = 20, workers: int = None):
+    workers = workers or os.cpu_count()
+    directory = tempfile.mkdtemp()
+    try:
+        for compression in (None, '.gz'):
+            generate_brew(directory, 'brew', rows, files, compression)
+            repo = BeerlogJsonRepo(fsopendir(directory))
+            parallel = BeerlogJsonRepo(fsopendir(directory), workers=workers)
+            print('%d rows in %d %s files, %d workers' % (rows, files, compression or '.json', workers))
+            timed('serial', lambda: sum(1 for _ in repo.fetch('brew').rows()))
+            timed('text to rows', lambda: text_protocol(repo.fetch('brew'), workers))
+            timed('path to packed columns', lambda: sum(1 for _ in parallel.fetch('brew').rows()))
+            shutil.rmtree(os.path.join(directory, 'brew'))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Micro-benchmark comparing the general brewpi log date parser with the cached fast path.
+Run from the repository root with:  python -m benchmarks.parse_datetime_bench
+"""
+import timeit
+
+from brewpi.datalog.beerlog_json import parse_datetime_general, DateParser
+
+__author__ = 'mat'
+
+
+def log_dates(count: int) -> list:
+    """ dates as they appear in a log, one row every 5 seconds """
+    return ['Date(2016,2,%d,%d,%d,%d)' % (1 + i // 17280, (i // 720) % 24, (i // 12) % 60, (i % 12) * 5)
+            for i in range(count)]
+
+
+def main(count: int = 100000, repeat: int = 5):
+    dates = log_dates(count)
+    parsers = [('general', parse_datetime_general),
+               ('fast datetime', DateParser()),
+               ('fast millis', DateParser(millis=True))]
+    baseline = None
+    for name, parser in parsers:
+        best = min(timeit.repeat(lambda: [parser(d) for d in dates], number=1, repeat=repeat))
+        baseline = baseline or best
+        print('%-14s %8.0f rows/s  %5.2fx' % (name, count / best, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
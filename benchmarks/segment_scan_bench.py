@@ -0,0 +1,55 @@
+"""
+Benchmark of scanning a log stored in the binary segment store, compared with parsing the same rows from a json
+log file. Reports the scan rate in MB/s of the stored data and in rows/s.
+Run from the repository root with:  python -m benchmarks.segment_scan_bench
+"""
+from datetime import datetime, timedelta
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from brewpi.datalog.beerlog import ts_columns
+from brewpi.datalog.beerlog_json import BeerlogJson
+from brewpi.datalog.segment_store import SegmentTimeSeriesRepo
+from brewpi.datalog.tests.beerlog_json_test import build_json_file
+
+__author__ = 'mat'
+
+
+def timed(name, size, count, f):
+    start = time.perf_counter()
+    f()
+    elapsed = time.perf_counter() - start
+    print('%-28s %8.1f MB/s %12.0f rows/s' % (name, size / elapsed / 1e6, count / elapsed))
+
+
+def main(count: int = 500000):
+    start = datetime(2016, 1, 1)
+    rows = [[start + timedelta(seconds=i), 20 + i % 7, 20, 'pitched' if i == 0 else None, 4, 5, None, 1, 21.5]
+            for i in range(count)]
+    directory = tempfile.mkdtemp()
+    try:
+        repo = SegmentTimeSeriesRepo(directory)
+        ts = repo.create('bench', ts_columns)
+        ts.append_bulk(rows)
+        size = sum(os.path.getsize(os.path.join(ts.directory, f)) for f in os.listdir(ts.directory))
+        text = build_json_file(ts_columns, rows)
+        print('%d rows: %.1f MB in segments, %.1f MB as json' % (count, size / 1e6, len(text) / 1e6))
+
+        timed('json parse', len(text), count, lambda: sum(1 for _ in BeerlogJson(lambda: io.StringIO(text)).rows()))
+        timed('segment rows', size, count, lambda: sum(1 for _ in ts.rows()))
+        timed('segment column mean', size, count,
+              lambda: [np.nanmean(s.column('beerTemp')) for s in ts.segments()])
+        begin = time.perf_counter()
+        ts.range()
+        print('%-28s %8.0f us' % ('segment range', (time.perf_counter() - begin) * 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
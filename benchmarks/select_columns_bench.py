@@ -0,0 +1,43 @@
+"""
+Benchmark of column selection over a 1M row log, comparing the original per-row dictionary lookup with a
+projection compiled once for the column spec.
+Run from the repository root with:  python -m benchmarks.select_columns_bench
+"""
+import time
+
+from brewpi.datalog.beerlog import compile_projection, select_columns, ts_columns, v010_columns
+
+__author__ = 'mat'
+
+
+def select_columns_dict(data, columns, columns_wanted):
+    """ the original implementation, building a dictionary for each row """
+    if len(data) != len(columns):
+        raise ValueError("data and column lists not the same length: %d!=%d" % (len(data), len(columns)))
+    d = {str(k).lower(): v for k, v in zip(columns, data)}
+    return [d.get(k.lower(), None) for k in columns_wanted]
+
+
+def timed(name, count, f):
+    start = time.perf_counter()
+    f()
+    elapsed = time.perf_counter() - start
+    print('%-26s %10.0f rows/s' % (name, count / elapsed))
+    return elapsed
+
+
+def main(count: int = 1000000):
+    for label, colspec in (('v0.2.1', ts_columns), ('v0.1.0', v010_columns)):
+        colspec = [c.upper() for c in colspec]
+        row = list(range(len(colspec)))
+        rows = [row] * count
+        print('%s log, %d rows' % (label, count))
+        base = timed('dict per row', count, lambda: [select_columns_dict(r, colspec, ts_columns) for r in rows])
+        timed('select_columns (cached)', count, lambda: [select_columns(r, colspec, ts_columns) for r in rows])
+        project = compile_projection(colspec, ts_columns)
+        fast = timed('compiled projection', count, lambda: [project(r) for r in rows])
+        print('speedup %.1fx\n' % (base / fast))
+
+
+if __name__ == '__main__':
+    main()
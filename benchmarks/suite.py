@@ -0,0 +1,262 @@
+"""
+The datalog benchmark suite. Generates a synthetic log repo (see generate_logs), then times each stage of reading
+and converting logs in a separate process, so the peak memory of each benchmark is measured on its own.
+The results, in rows/s and peak resident set size, are written as json so they can be compared between commits:
+
+    python -m benchmarks.suite --output before.json
+    git checkout other-commit
+    python -m benchmarks.suite --compare before.json
+
+Run from the repository root with:  python -m benchmarks.suite
+"""
+from functools import partial
+import argparse
+import atexit
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fs.memoryfs
+import simplejson as json
+from fs.opener import fsopendir
+
+from benchmarks.generate_logs import add_arguments, generate_repo, log_options
+from brewpi.datalog.beerlog import compile_projection, select_columns, ts_columns
+from brewpi.datalog.beerlog_json import BeerlogJson, BeerlogJsonRepo, LogOpener, brewpi_log_rows, compressions, \
+    extract_value, parse_colspec, parse_datetime, uncompressed_name
+from brewpi.datalog.convert import ConvertState, convert_series, import_stream
+from brewpi.datalog.influxdb.db import InfluxDBTimeSeries
+from brewpi.datalog.pipeline import chunker
+from brewpi.datalog.segment_store import SegmentTimeSeriesRepo
+from brewpi.datalog.sqlite.db import SqliteTimeSeriesRepo
+
+__author__ = 'mat'
+
+
+def log_paths(directory: str, names: list) -> list:
+    return [os.path.join(directory, name, f)
+            for name in names for f in sorted(os.listdir(os.path.join(directory, name)))]
+
+
+def load_logs(directory: str, names: list) -> list:
+    """ parses the log files, decompressing them as the library does """
+    paths = log_paths(directory, names)
+    result = []
+    for path in paths:
+        with LogOpener(None, path)() as f:
+            result.append(json.load(f))
+    return result
+
+
+# Each benchmark takes the data directory and brew names, prepares its input, and returns a function to time.
+# The function returns the number of rows it processed.
+
+def bench_json_rows(directory: str, names: list, stream: bool = False):
+    logs = [BeerlogJson(LogOpener(None, path), stream) for path in log_paths(directory, names)]
+    return lambda: sum(sum(1 for _ in log.rows()) for log in logs)
+
+
+def bench_composite_rows(directory: str, names: list):
+    repo = BeerlogJsonRepo(fsopendir(directory))
+    return lambda: sum(sum(1 for _ in repo.fetch(name).rows()) for name in names)
+
+
+def bench_compressed_rows(directory: str, names: list, compression: str):
+    """ reads the brews after compressing their log files, or recompressing them when they are already compressed """
+    work = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, work, True)
+    for name in names:
+        os.mkdir(os.path.join(work, name))
+        for f in os.listdir(os.path.join(directory, name)):
+            with LogOpener(None, os.path.join(directory, name, f))() as src, \
+                    compressions[compression](os.path.join(work, name, uncompressed_name(f) + compression), 'wt',
+                                              encoding='utf-8') as dst:
+                shutil.copyfileobj(src, dst)
+    return bench_composite_rows(work, names)
+
+
+def bench_import_stream(directory: str, names: list):
+    paths = log_paths(directory, names)
+
+    def run():
+        count = 0
+        for path in paths:
+            with LogOpener(None, path)() as f:
+                count += import_stream(None, f, dry_run=True)
+        return count
+    return run
+
+
+def bench_select_columns(directory: str, names: list):
+    data = [(parse_colspec(log), list(brewpi_log_rows(log))) for log in load_logs(directory, names)]
+    colspecs = [[c.upper() for c in colspec] for colspec, _ in data]
+
+    def run():
+        count = 0
+        for colspec, (_, rows) in zip(colspecs, data):
+            for r in rows:
+                select_columns(r, colspec, ts_columns)
+            count += len(rows)
+        return count
+    return run
+
+
+def bench_parse_datetime(directory: str, names: list):
+    dates = [extract_value(row['c'][0]) for log in load_logs(directory, names) for row in log['rows']]
+
+    def run():
+        for d in dates:
+            parse_datetime(d)
+        return len(dates)
+    return run
+
+
+def bench_create_bulk_request(directory: str, names: list, chunk_size: int = 500):
+    chunks = []
+    for log in load_logs(directory, names):
+        project = compile_projection(parse_colspec(log), ts_columns)
+        chunks.extend(chunker((project(r) for r in brewpi_log_rows(log)), chunk_size))
+    ts = InfluxDBTimeSeries(None, 'bench', ts_columns)
+
+    def run():
+        for chunk in chunks:
+            ts._create_bulk_request(chunk)
+        return sum(len(chunk) for chunk in chunks)
+    return run
+
+
+def bench_convert(directory: str, names: list, sink: str):
+    work = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, work, True)
+
+    def run():
+        dst = SqliteTimeSeriesRepo(os.path.join(work, 'bench.db')) if sink == 'sqlite' \
+            else SegmentTimeSeriesRepo(os.path.join(work, 'segments'))
+        try:
+            src = BeerlogJsonRepo(fsopendir(directory))
+            return sum(convert_series(src, dst, name, ConvertState(fs.memoryfs.MemoryFS())) for name in names)
+        finally:
+            if sink == 'sqlite':
+                dst.close()
+            shutil.rmtree(work)
+            os.mkdir(work)
+    return run
+
+
+benchmarks = {
+    'json_rows': bench_json_rows,
+    'json_rows_stream': partial(bench_json_rows, stream=True),
+    'composite_rows': bench_composite_rows,
+    'composite_rows_gz': partial(bench_compressed_rows, compression='.gz'),
+    'composite_rows_xz': partial(bench_compressed_rows, compression='.xz'),
+    'import_stream_dry_run': bench_import_stream,
+    'select_columns': bench_select_columns,
+    'parse_datetime': bench_parse_datetime,
+    'create_bulk_request': bench_create_bulk_request,
+    'convert_sqlite': partial(bench_convert, sink='sqlite'),
+    'convert_segments': partial(bench_convert, sink='segments'),
+}
+
+# the benchmarks that require the rows of each brew in ascending time, so can't read logs with daylight saving jumps
+ascending_benchmarks = ('composite_rows', 'composite_rows_gz', 'composite_rows_xz', 'convert_segments')
+
+
+def peak_rss_kb() -> int:
+    """ the peak resident set size of this process. Linux reports kilobytes and macOS bytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_benchmark(name: str, directory: str, names: list, repeat: int) -> dict:
+    """ runs a benchmark in this process, taking the fastest of the repeats """
+    f = benchmarks[name](directory, names)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'rows': rows, 'seconds': best, 'rows_per_s': rows / best, 'peak_rss_kb': peak_rss_kb()}
+
+
+def run_isolated(name: str, directory: str, names: list, repeat: int) -> dict:
+    """ runs a benchmark in a new interpreter, so its peak memory is not affected by the others """
+    out = subprocess.check_output([sys.executable, '-m', 'benchmarks.suite', '--run', name, '--data', directory,
+                                   '--repeat', str(repeat)] + names)
+    return json.loads(out.decode('utf-8'))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """ describes the change in speed and memory of each benchmark from the baseline results """
+    lines = []
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if b:
+            lines.append('%-20s %6.2fx rows/s  %6.2fx peak rss'
+                         % (name, r['rows_per_s'] / b['rows_per_s'], r['peak_rss_kb'] / b['peak_rss_kb']))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='runs the datalog benchmarks and reports the results as json')
+    parser.add_argument('names', nargs='*', help='with --run, the brews in the data directory')
+    parser.add_argument('--only', nargs='+', choices=sorted(benchmarks), default=list(benchmarks),
+                        help='the benchmarks to run')
+    parser.add_argument('--data', help='an existing log repo to use rather than generating one')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of times each benchmark is run')
+    parser.add_argument('--output', help='the file the json results are written to, rather than stdout')
+    parser.add_argument('--compare', help='a json results file to compare the results with')
+    parser.add_argument('--run', choices=sorted(benchmarks), help=argparse.SUPPRESS)
+    add_arguments(parser)
+    args = parser.parse_args(args)
+
+    if args.run:
+        print(json.dumps(run_benchmark(args.run, args.data, args.names, args.repeat)))
+        return
+    ascending = [name for name in args.only if name in ascending_benchmarks]
+    if args.dst_jumps and not args.data and ascending:
+        parser.error('--dst-jumps repeats times, which the %s benchmarks reject as out of order. Choose other '
+                     'benchmarks with --only.' % ', '.join(ascending))
+
+    directory = args.data or tempfile.mkdtemp()
+    try:
+        if args.data:
+            names = sorted(BeerlogJsonRepo(fsopendir(directory)).names())
+        else:
+            names = generate_repo(directory, **log_options(args))
+        results = {}
+        for name in args.only:
+            results[name] = run_isolated(name, directory, names, args.repeat)
+            print('%-20s %12.0f rows/s %8d KB' % (name, results[name]['rows_per_s'], results[name]['peak_rss_kb']),
+                  file=sys.stderr)
+    finally:
+        if not args.data:
+            shutil.rmtree(directory)
+
+    report = {'commit': git_commit(), 'python': platform.python_version(),
+              'logs': None if args.data else log_options(args), 'repeat': args.repeat, 'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
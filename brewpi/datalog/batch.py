@@ -0,0 +1,156 @@
+"""
+Batches writes on a background thread, so that callers producing one item at a time don't block on a round trip
+per item.
+"""
+from queue import Queue, Full, Empty
+from threading import Thread, Lock, Event
+import time
+
+__author__ = 'mat'
+
+# returned in place of an item when the oldest item in the batch has expired
+_expired = object()
+
+
+class _Flush:
+    """ a marker placed in the queue to have the writer thread write its pending batch """
+
+    def __init__(self, stop: bool = False):
+        self.done = Event()
+        self.stop = stop
+
+
+class BatchWriter:
+    """
+    Collects items on a bounded queue and writes them in batches from a background thread.
+    A batch is written when it reaches max_batch items, or when its oldest item is max_age seconds old.
+    Items may be given a weight, such as the number of points they contain, in which case the batch size and the
+    counters are measured in weight rather than items.
+    When the queue is full, put() blocks, which applies backpressure to the producer. If put_timeout is given and
+    the queue is still full after that time, the item is dropped.
+    A batch that fails to write is dropped. The first write error is kept and raised by the next flush() or close().
+
+    >>> batches = []
+    >>> w = BatchWriter(batches.append, max_batch=2)
+    >>> all(w.put(i) for i in range(5))
+    True
+    >>> w.close()
+    >>> batches, w.written, w.queued, w.dropped
+    ([[0, 1], [2, 3], [4]], 5, 0, 0)
+    """
+
+    def __init__(self, write: callable, max_batch: int = 500, max_age: float = 1.0, max_queue: int = 10000,
+                 put_timeout: float = None, weigh: callable = None):
+        """
+        :param write:   called with a list of items to write. It is called on the writer thread.
+        :param max_batch:   the maximum number of items written in one call
+        :param max_age:     the maximum time in seconds an item waits before its batch is written
+        :param max_queue:   the maximum number of items waiting to be batched
+        :param put_timeout: how long put() waits for space in the queue before dropping the item. None waits forever.
+        :param weigh:   returns the weight of an item. By default each item weighs 1.
+        """
+        self.write = write
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.put_timeout = put_timeout
+        self.weigh = weigh or (lambda item: 1)
+        self.queue = Queue(max_queue)
+        self.lock = Lock()
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.closed = False
+        self.thread = Thread(target=self._run, name='BatchWriter', daemon=True)
+        self.thread.start()
+
+    def _count(self, queued: int = 0, written: int = 0, dropped: int = 0):
+        with self.lock:
+            self.queued += queued
+            self.written += written
+            self.dropped += dropped
+
+    def stats(self) -> dict:
+        """ the number of items currently queued, and the total number written and dropped. """
+        with self.lock:
+            return {'queued': self.queued, 'written': self.written, 'dropped': self.dropped}
+
+    def put(self, item) -> bool:
+        """ queues an item for writing.
+        :return: True if the item was queued, False if it was dropped because the queue stayed full
+        """
+        if self.closed:
+            raise ValueError('writer is closed')
+        weight = self.weigh(item)
+        self._count(queued=weight)
+        try:
+            self.queue.put(item, timeout=self.put_timeout)
+            return True
+        except Full:
+            self._count(queued=-weight, dropped=weight)
+            return False
+
+    def flush(self):
+        """ waits until all items queued before this call have been written (or dropped due to a write error).
+        :raises: the first error writing a batch since the last flush
+        """
+        if self.closed:
+            raise ValueError('writer is closed')
+        self._signal(_Flush())
+        self._raise_error()
+
+    def close(self):
+        """ writes all queued items and stops the writer thread. Closing a closed writer does nothing.
+        :raises: the first error writing a batch since the last flush
+        """
+        if not self.closed:
+            self.closed = True
+            self._signal(_Flush(stop=True))
+            self.thread.join()
+            self._raise_error()
+
+    def _signal(self, marker: _Flush):
+        self.queue.put(marker)
+        marker.done.wait()
+
+    def _raise_error(self):
+        with self.lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _write(self, batch: list, weight: int):
+        try:
+            self.write(batch)
+            self._count(queued=-weight, written=weight)
+        except Exception as e:
+            with self.lock:
+                self.error = self.error or e
+            self._count(queued=-weight, dropped=weight)
+
+    def _run(self):
+        batch = []
+        weight = 0
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = _expired
+            if isinstance(item, _Flush):
+                if batch:
+                    self._write(batch, weight)
+                    batch, weight = [], 0
+                item.done.set()
+                if item.stop:
+                    return
+                continue
+            if item is not _expired:
+                if not batch:
+                    deadline = time.monotonic() + self.max_age
+                batch.append(item)
+                weight += self.weigh(item)
+            if batch and (weight >= self.max_batch or time.monotonic() >= deadline):
+                self._write(batch, weight)
+                batch, weight = [], 0
@@ -1,5 +1,10 @@
 from abc import abstractmethod
-from datetime import datetime
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+from threading import Event
+import heapq
 
 __author__ = 'mat'
 
@@ -23,9 +28,11 @@ class TimeSeriesRepo:
         raise NotImplementedError
 
     @abstractmethod
-    def create(self, name):
+    def create(self, name, columns: list = None):
         """
         creates a new empty time series. if a time series already exists with the same name, it is returned.
+        :param columns: the column names of the rows appended to the series, the first being the time.
+            Defaults to ts_columns.
         """
         raise NotImplementedError
 
@@ -42,8 +49,42 @@ class TimeSeries:
         :return: the start and end range for this time series. If the series is empty returns None.
         :rtype: tuple or None
         """
-        r = [x for x in self.rows()]
-        return None if not r else (min(x[0] for x in r), max(x[0] for x in r))
+        start = end = None
+        for r in self.rows():
+            t = r[0]
+            if start is None:
+                start = end = t
+            elif t < start:
+                start = t
+            elif t > end:
+                end = t
+        return None if start is None else (start, end)
+
+    def count(self) -> int:
+        """
+        :return: the number of rows in this time series.
+        """
+        return sum(1 for _ in self.rows())
+
+    def range_is_indexed(self) -> bool:
+        """
+        :return: True if range() can be answered without reading all the rows.
+        """
+        return False
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        """
+        returns an iterator over the rows with start <= time < end. Either bound may be None for an open range.
+        The rows are expected to be in ascending time order, so no further rows are read once the end is passed.
+        >>> list(ListTimeSeries([[1], [3], [5], [7]]).rows_between(3, 7))
+        [[3], [5]]
+        """
+        for r in self.rows():
+            t = r[0]
+            if end is not None and t >= end:
+                return
+            if start is None or t >= start:
+                yield r
 
     @abstractmethod
     def rows(self):
@@ -54,6 +95,13 @@ class TimeSeries:
         """
         raise NotImplementedError
 
+    def resample(self, interval: timedelta, aggregations: dict, columns: list = None):
+        """
+        aggregates the rows into fixed intervals. See ResampledTimeSeries.
+        :param columns: the column names of the rows in this series. Defaults to ts_columns.
+        """
+        return ResampledTimeSeries(self, interval, aggregations, columns or ts_columns)
+
     @abstractmethod
     def append(self, row: list):
         """
@@ -88,28 +136,99 @@ class TimeSeries:
 
 class CompositeTimeSeries(TimeSeries):
     """
-    Joins several time series together
+    Joins several time series together.
+    By default the series are read one after the other and each row must not be earlier than the one before.
+    In merge mode, the series may overlap in time: their rows are merged into a single ascending stream, holding
+    just one pending row per series. Each series must itself be in ascending order.
     """
+    duplicate_policies = ('keep', 'first', 'last', 'error')
 
-    def __init__(self, name, serieses: list):
+    def __init__(self, name, serieses: list, merge: bool = False, duplicates: str = 'keep', added: callable = None,
+                 batch: callable = None):
         """
         :param serieses:    multiple series (gollum)
+        :param merge:   when True, the rows of the series are merged into ascending time order.
+        :param duplicates:  in merge mode, what to do with rows having the same time: 'keep' all of them,
+            keep only the 'first' or 'last' in series order, or raise a ValueError ('error').
+        :param added:   a callable returning the series that have been added since it was last called, in order,
+            such as new log files. Used by follow().
+        :param batch:   a callable returning a context manager that range() and count() query the series in,
+            such as RangeIndex.batch, so that the index is saved once rather than for each series.
 
         >>> l = [None]; c = CompositeTimeSeries("abc", l)
         >>> c.name
         'abc'
         >>> c.serieses is l
         True
+        >>> CompositeTimeSeries("abc", l, True, 'second')
+        Traceback (most recent call last):
+        ...
+        ValueError: unknown duplicate policy 'second'
         """
+        if duplicates not in self.duplicate_policies:
+            raise ValueError('unknown duplicate policy %r' % duplicates)
         self.serieses = serieses
         self.name = name
+        self.merge = merge
+        self.duplicates = duplicates
+        self.added = added
+        self.batch = batch
 
     def rows(self):
+        if self.merge:
+            return self.merge_rows(s.rows() for s in self.serieses)
+        return self.ordered_rows()
+
+    def merge_rows(self, iterables):
+        """ merges several iterators of ascending rows, applying the duplicate policy.
+        >>> c = CompositeTimeSeries("abc", [], True, 'last')
+        >>> list(c.merge_rows([[[1, 'a'], [3, 'a']], [[2, 'b'], [3, 'b']], [[3, 'c']]]))
+        [[1, 'a'], [2, 'b'], [3, 'c']]
+        >>> c.duplicates = 'first'
+        >>> list(c.merge_rows([[[1, 'a'], [3, 'a']], [[2, 'b'], [3, 'b']], [[3, 'c']]]))
+        [[1, 'a'], [2, 'b'], [3, 'a']]
+        >>> list(c.merge_rows([[[1, 'a'], [3, 'a']], [[4, 'b'], [2, 'b']]]))
+        Traceback (most recent call last):
+        ...
+        ValueError: series abc: time is not ascending in series 1 at row 1: previous time was 4, next time is 2
+        """
+        # the rows are decorated with their series index and position, so rows with the same time come out in
+        # series order and the rows themselves are never compared
+        merged = (d[3] for d in heapq.merge(*(self._decorated(i, rows) for i, rows in enumerate(iterables))))
+        if self.duplicates == 'keep':
+            yield from merged
+            return
+        pending = None
+        for r in merged:
+            if pending is not None and pending[0] == r[0]:
+                if self.duplicates == 'error':
+                    raise ValueError('series %s: duplicate time %s' % (self.name, r[0]))
+                if self.duplicates == 'last':
+                    pending = r
+                continue
+            if pending is not None:
+                yield pending
+            pending = r
+        if pending is not None:
+            yield pending
+
+    def _decorated(self, index: int, rows):
+        """ generates (time, index, position, row) for each row of a series, checking that the times ascend """
+        last = None
+        for i, r in enumerate(rows):
+            t = r[0]
+            if last is not None and t < last:
+                raise ValueError('series %s: time is not ascending in series %d at row %d: '
+                                 'previous time was %s, next time is %s' % (self.name, index, i, last, t))
+            last = t
+            yield t, index, i, r
+
+    def ordered_rows(self):
         last_time = None
         last_series = None
         row_count = 0
-        for s in self.serieses:     # each series
-            for i, r in enumerate(s.rows()):      # each row
+        for s, rows in self.series_rows():     # each series
+            for i, r in enumerate(rows):      # each row
                 t = r[0]
                 row_count += 1
                 if last_time is None or last_time <= t:
@@ -122,10 +241,115 @@ class CompositeTimeSeries(TimeSeries):
                                      % (self.name, row_count, last_time, last_series, i, t, s))
                 yield r
 
+    def follow(self, interval: float = 0.5, stop: Event = None):
+        """ generates the rows of the series, then the rows appended to the last series as they are written, until
+        stop is set. The last series must provide new_rows(), as BeerlogJson does, or have it as its source.
+        When no new rows have been written, the series returned by added are followed in turn, after the remaining
+        rows of the series before are read.
+        The series are read one after the other in this process, since only the last can grow, so a parallel reader
+        is not used. Merging overlapping series isn't supported: a ValueError is raised in merge mode.
+        :param interval:    the time in seconds between checks for new rows
+        :param stop:    an event that ends the generator when set
+        >>> class Growing(ListTimeSeries):
+        ...     def new_rows(self):
+        ...         yield from self.data
+        ...         self.data = []
+        >>> stop = Event()
+        >>> rows = CompositeTimeSeries('abc', [ListTimeSeries([[1]]), Growing([[2]])], added=lambda: []).follow(0, stop)
+        >>> next(rows), next(rows)
+        ([1], [2])
+        >>> stop.set(); list(rows)
+        []
+        >>> CompositeTimeSeries('abc', [Growing([[2]])], merge=True).follow(0, stop)
+        Traceback (most recent call last):
+        ...
+        ValueError: series abc: can't follow series in merge mode
+        """
+        if self.merge:
+            raise ValueError("series %s: can't follow series in merge mode" % self.name)
+        return self._follow(interval, stop or Event())
+
+    def _follow(self, interval: float, stop: Event):
+        current = None
+        pending = list(self.serieses)
+        while True:
+            if pending:
+                if current is not None:
+                    yield from current.new_rows()     # the last rows of the series before
+                for s in pending[:-1]:
+                    yield from s.rows()
+                current = following(pending[-1])
+            if current is not None:
+                yield from current.new_rows()
+            pending = self.added() if self.added else []
+            if not pending and stop.wait(interval):
+                return
+
+    def range(self) -> (datetime, datetime):
+        """ combines the ranges of each series, so a series that can compute its range without reading its rows
+        avoids reading all rows of the composite.
+        >>> CompositeTimeSeries("abc", [ListTimeSeries([[5], [7]]), ListTimeSeries([]), \
+                ListTimeSeries([[8], [9]])]).range()
+        (5, 9)
+        """
+        with self.batch() if self.batch else ExitStack():
+            ranges = [r for r in (s.range() for s in self.serieses) if r is not None]
+        return None if not ranges else (min(r[0] for r in ranges), max(r[1] for r in ranges))
+
+    def count(self) -> int:
+        """
+        >>> CompositeTimeSeries("abc", [ListTimeSeries([[5], [7]]), ListTimeSeries([[8]])]).count()
+        3
+        """
+        if self.merge and self.duplicates != 'keep':
+            return super().count()
+        with self.batch() if self.batch else ExitStack():
+            return sum(s.count() for s in self.serieses)
+
+    def range_is_indexed(self) -> bool:
+        return all(s.range_is_indexed() for s in self.serieses)
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        """
+        Series whose range is indexed and falls outside the window are skipped without reading them.
+        Since the series are in ascending order, no further series are read once a row past the end is found.
+        >>> c = CompositeTimeSeries("abc", [ListTimeSeries([[1], [3]]), ListTimeSeries([[5], [7]]), None])
+        >>> list(c.rows_between(2, 6))
+        [[3], [5]]
+        """
+        if self.merge:
+            return self.merge_rows(s.rows_between(start, end) for s in self.serieses)
+        return self._ordered_rows_between(start, end)
+
+    def _ordered_rows_between(self, start, end):
+        for s in self.serieses:
+            if s.range_is_indexed():
+                r = s.range()
+                if r is None or (start is not None and r[1] < start) or (end is not None and r[0] >= end):
+                    continue
+            for r in s.rows_between(start, None):
+                if end is not None and r[0] >= end:
+                    return
+                yield r
+
+    def series_rows(self):
+        """ generates a tuple of (series, rows) for each series in turn. Subclasses may override this to change
+        how the rows of each series are produced.
+        """
+        for s in self.serieses:
+            yield s, s.rows()
+
     def append(self, data: iter):
         self.serieses[-1].append(data)
 
 
+def following(series: TimeSeries) -> TimeSeries:
+    """ finds the series providing new_rows() for a series, looking through wrapping series. """
+    while not hasattr(series, 'new_rows'):
+        series = series.source
+    return series
+
+
 class ListTimeSeries(TimeSeries):
     """ a simple time series implementation based on a list of rows
     """
@@ -137,7 +361,7 @@ class ListTimeSeries(TimeSeries):
         return self.data
 
     def append(self, data: iter):
-        super.validate(data)
+        self.validate(data)
         self.data.append(data)
 
     def range(self) -> (datetime, datetime):
@@ -149,14 +373,165 @@ class ListTimeSeries(TimeSeries):
         """
         return super().range()
 
+    def count(self) -> int:
+        return len(self.data)
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        """ finds the window by bisecting the rows, which must be in ascending time order.
+        >>> ts = ListTimeSeries([[1], [3], [3], [5], [7]])
+        >>> ts.rows_between(3, 6), ts.rows_between(None, 3), ts.rows_between(8)
+        ([[3], [3], [5]], [[1]], [])
+        """
+        lo = 0 if start is None else bisect_time(self.data, start)
+        hi = len(self.data) if end is None else bisect_time(self.data, end, lo)
+        return self.data[lo:hi]
+
+
+class ResampledTimeSeries(TimeSeries):
+    """
+    Aggregates the rows of another time series into fixed intervals, computed in a single pass over the source rows
+    with constant memory. The source rows must be in ascending time order.
+    Intervals are aligned to the epoch, and each output row holds the start of the interval followed by one value
+    per aggregation. Missing (None) values are ignored, an aggregation with no values is None, and intervals with no
+    rows are not output.
+
+    >>> t = datetime(2016, 1, 1, 12, 0)
+    >>> ts = ListTimeSeries([[t, 20, None], [t + timedelta(seconds=30), 21, 4], [t + timedelta(minutes=2), None, 5]])
+    >>> r = ts.resample(timedelta(minutes=1), {'beerTemp': ('mean', 'max'), 'fridgeTemp': 'min'},
+    ...                 ['time', 'beerTemp', 'fridgeTemp'])
+    >>> r.columns
+    ['time', 'beerTemp_mean', 'beerTemp_max', 'fridgeTemp_min']
+    >>> for row in r.rows(): print(row)
+    [datetime.datetime(2016, 1, 1, 12, 0), 20.5, 21, 4]
+    [datetime.datetime(2016, 1, 1, 12, 2), None, None, 5]
+    """
+    functions = ('count', 'sum', 'mean', 'min', 'max', 'first', 'last')
+    epoch = datetime(1970, 1, 1)
+
+    def __init__(self, source: TimeSeries, interval: timedelta, aggregations: dict, columns: list = None):
+        """
+        :param source:  the series to resample
+        :param interval:    the length of each interval
+        :param aggregations:    a dict mapping a column name to the name of an aggregation function, or a sequence
+            of names. The functions are count, sum, mean, min, max, first and last.
+        :param columns: the column names of the rows in the source series. Defaults to ts_columns.
+        """
+        if interval <= timedelta(0):
+            raise ValueError('interval must be positive: %s' % interval)
+        columns = columns or ts_columns
+        positions = {str(c).lower(): i for i, c in enumerate(columns)}
+        self.source = source
+        self.interval = interval
+        self.aggregations = []
+        for column, functions in aggregations.items():
+            if column.lower() not in positions:
+                raise ValueError('unknown column %s' % column)
+            for f in (functions,) if isinstance(functions, str) else functions:
+                if f not in self.functions:
+                    raise ValueError('unknown aggregation %s' % f)
+                self.aggregations.append((column, positions[column.lower()], f))
+        self.positions = sorted(set(p for _, p, _ in self.aggregations))
+        self.columns = [columns[0]] + ['%s_%s' % (c, f) for c, _, f in self.aggregations]
+
+    def interval_start(self, t: datetime) -> datetime:
+        """
+        >>> ResampledTimeSeries(None, timedelta(minutes=15), {}).interval_start(datetime(2016, 1, 1, 12, 44, 59))
+        datetime.datetime(2016, 1, 1, 12, 30)
+        """
+        return t - (t - self.epoch) % self.interval
+
+    def rows(self):
+        return self._resample(self.source.rows())
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        """ resamples the intervals overlapping the window, reading only the source rows in those intervals.
+        >>> t = datetime(2016, 1, 1, 12, 0)
+        >>> ts = ListTimeSeries([[t + timedelta(seconds=s), s] for s in range(0, 300, 20)])
+        >>> r = ts.resample(timedelta(minutes=1), {'beerTemp': 'count'}, ['time', 'beerTemp'])
+        >>> [row[1] for row in r.rows_between(t + timedelta(seconds=90), t + timedelta(seconds=150))]
+        [3, 3]
+        """
+        if start is not None:
+            start = self.interval_start(start)
+        if end is not None:
+            aligned = self.interval_start(end)
+            end = aligned if aligned == end else aligned + self.interval
+        return self._resample(self.source.rows_between(start, end))
+
+    def _resample(self, rows):
+        start = end = None
+        state = None
+        for r in rows:
+            t = r[0]
+            if end is None or not start <= t < end:
+                if state is not None:
+                    yield self._aggregate(start, state)
+                start = self.interval_start(t)
+                end = start + self.interval
+                # per column: count, sum, min, max, first, last
+                state = {p: [0, 0, None, None, None, None] for p in self.positions}
+            for p in self.positions:
+                v = r[p]
+                if v is None:
+                    continue
+                st = state[p]
+                if st[0]:
+                    st[1] += v
+                    if v < st[2]:
+                        st[2] = v
+                    if v > st[3]:
+                        st[3] = v
+                else:
+                    st[1] = st[2] = st[3] = st[4] = v
+                st[0] += 1
+                st[5] = v
+        if state is not None:
+            yield self._aggregate(start, state)
+
+    def _aggregate(self, start: datetime, state: dict) -> list:
+        row = [start]
+        for _, p, f in self.aggregations:
+            count, total, lo, hi, first, last = state[p]
+            if f == 'count':
+                row.append(count)
+            elif not count:
+                row.append(None)
+            elif f == 'mean':
+                row.append(total / count)
+            else:
+                row.append({'sum': total, 'min': lo, 'max': hi, 'first': first, 'last': last}[f])
+        return row
+
+    def append(self, row: list):
+        raise NotImplementedError
+
+
+def bisect_time(rows: list, t, lo: int = 0) -> int:
+    """ finds the index of the first row with a time not earlier than t, in a list of rows in ascending time order.
+    >>> bisect_time([[1], [3], [5]], 3), bisect_time([[1], [3], [5]], 4), bisect_time([[1], [3], [5]], 6)
+    (1, 2, 3)
+    """
+    hi = len(rows)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if rows[mid][0] < t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
 
 def select_columns(data, columns, columns_wanted):
     """ selects from the list only those columns mentioned in cols_wanted, and returns them in the same order.
     Column names are case insensitive.
+    This compiles (and caches) a projection for the columns on each call. Callers that select from many rows with
+    the same columns should use compile_projection() directly.
     >>> select_columns([1,2], ['a', 'B'], ['b'])
     [2]
     >>> select_columns([1,2,3], ['a','b','c'], ['B','A','D'])
     [2, 1, None]
+    >>> select_columns((1, 2), ['a', 'b'], ['b', 'c'])
+    [2, None]
     >>> select_columns([1], [1], [])
     []
     >>> select_columns([], ['a'], [])
@@ -164,11 +539,55 @@ def select_columns(data, columns, columns_wanted):
     ...
     ValueError: data and column lists not the same length: 0!=1
     """
-    if len(data) != len(columns):
-        raise ValueError("data and column lists not the same length: %d!=%d" % (
-            len(data), len(columns)))
-    d = {str(k).lower(): v for k, v in zip(columns, data)}
-    return [d.get(k.lower(), None) for k in columns_wanted]
+    return _cached_projection(tuple(columns), tuple(columns_wanted))(data)
+
+
+def compile_projection(columns, columns_wanted) -> callable:
+    """ builds a function that selects from a row only those columns mentioned in cols_wanted, and returns them
+    in the same order, or None for columns that are not present. Column names are case insensitive.
+    The column positions are resolved once, so applying the function to a row just indexes the row with an
+    itemgetter and builds the output list, inserting None for the columns that are missing.
+    >>> p = compile_projection(['a', 'B', 'c'], ['b', 'd', 'A'])
+    >>> p([1, 2, 3]), p((4, 5, 6))
+    ([2, None, 1], [5, None, 4])
+    >>> p([1, 2])
+    Traceback (most recent call last):
+    ...
+    ValueError: data and column lists not the same length: 2!=3
+    >>> compile_projection(['a'], ['A'])([1]), compile_projection(['a'], ['b'])([1])
+    ([1], [None])
+    """
+    positions = {}
+    for i, c in enumerate(columns):
+        positions[str(c).lower()] = i
+    n = len(columns)
+    wanted = [str(c).lower() for c in columns_wanted]
+    indexes = [positions[c] for c in wanted if c in positions]
+    missing = [i for i, c in enumerate(wanted) if c not in positions]      # ascending, so each None lands in place
+    message = "data and column lists not the same length: %d!=" + str(n)
+    if len(indexes) > 1:
+        get = itemgetter(*indexes)
+    else:   # itemgetter needs an index, and with just one returns the value rather than a tuple
+        def get(row):
+            return [row[i] for i in indexes]
+
+    if not missing:
+        def project(row):
+            if len(row) != n:
+                raise ValueError(message % len(row))
+            return list(get(row))
+    else:
+        def project(row):
+            if len(row) != n:
+                raise ValueError(message % len(row))
+            result = list(get(row))
+            for i in missing:
+                result.insert(i, None)
+            return result
+    return project
+
+
+_cached_projection = lru_cache(maxsize=64)(compile_projection)
 
 
 v010_columns = 'time beerTemp beerSet beerAnn fridgeTemp fridgeSet fridgeAnn'.split()
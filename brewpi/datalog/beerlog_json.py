@@ -1,8 +1,29 @@
 from fs.wrapfs.subfs import SubFS
-from datetime import datetime
-from brewpi.datalog.beerlog import TimeSeries, TimeSeriesRepo, CompositeTimeSeries, select_columns, ts_columns
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+import re
+from brewpi.datalog.beerlog import TimeSeries, TimeSeriesRepo, CompositeTimeSeries, compile_projection, ts_columns
+from brewpi.datalog.columnar import millis_to_datetimes
+from brewpi.datalog.json_stream import JsonStream, default_chunk_size
+from brewpi.datalog.range_index import RangeIndex, IndexedTimeSeries
+from brewpi.datalog.sidecar import SidecarCache
+from brewpi.datalog.time import datetime_to_millis
+import numpy as np
 import simplejson as json
 from fs.base import FS
+from threading import Event
+
+log_extension = '.json'
+# the decompressing openers of compressed log files, by the extension following .json
+compressions = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+log_extensions = (log_extension,) + tuple(log_extension + c for c in compressions)
 
 
 class BeerlogJsonRepo(TimeSeriesRepo):
@@ -19,27 +40,277 @@ class BeerlogJsonRepo(TimeSeriesRepo):
         """
         return name not in ('.', '..')
 
-    def __init__(self, dir: FS):
+    def __init__(self, dir: FS, stream: bool = False, workers: int = 0, read_ahead: int = None,
+                 cache: SidecarCache = None, index: RangeIndex = None, merge: bool = False,
+                 duplicates: str = 'keep'):
+        """
+        :param dir:     the directory containing a subdirectory of json log files for each brew
+        :param stream:  when True, log files are parsed incrementally rather than loaded whole. See BeerlogJson.
+        :param workers: when non-zero, log files are parsed ahead of the consumer in a pool of this many processes.
+        :param read_ahead:  the maximum number of files parsed ahead of the consumer when workers is non-zero.
+            Defaults to twice the number of workers.
+        :param cache:   when given, parsed log files are stored in and read back from this cache.
+            Cached files are read directly, so workers is not used when a cache is given.
+        :param index:   when given, the range and row count of each log file are taken from this index.
+        :param merge:   when True, the rows of overlapping log files are merged into time order rather than raising
+            a ValueError. In this mode files are not parsed ahead by the workers. See CompositeTimeSeries.
+        :param duplicates:  the policy for rows with the same time when merging. See CompositeTimeSeries.
+        """
         self.dir = dir
+        self.stream = stream
+        self.workers = workers
+        self.read_ahead = read_ahead
+        self.cache = cache
+        self.index = index
+        self.merge = merge
+        self.duplicates = duplicates
 
     def names(self) -> list:
         """ the names are the subdirectories under the repo directory """
         names = [f for f in self.dir.listdir('/', dirs_only=True) if self.is_valid_name(f)]
         return names
 
-    def create(self, name):
+    def create(self, name, columns: list = None):
         raise NotImplementedError()
 
+    def file_keys(self, name) -> list:
+        """ callables fetching the key of each log file of a series, in the order of the series fetched for the name.
+        Each key is a list of the file path relative to the repo, its size and its modification time.
+        """
+        basedir = self.dir.opendir(name)
+        return [delay_file_key(basedir, f, '%s/%s' % (name, f)) for f in log_files(basedir)]
+
     def fetch(self, name):
         basedir = self.dir.opendir(name)
         files = log_files(basedir)
-        return CompositeTimeSeries(name, [BeerlogJson(delay_open(basedir, f)) for f in files])
+        logs = self._logs(basedir, name, files)
+        added = partial(self._added, basedir, name, {uncompressed_name(f) for f in files})
+        batch = self.index.batch if self.index else None
+        if self.workers and not self.cache and not self.merge:
+            return ParallelCompositeTimeSeries(name, logs, self.workers, self.read_ahead, added, batch)
+        return CompositeTimeSeries(name, logs, self.merge, self.duplicates, added, batch)
+
+    def _logs(self, basedir: FS, name: str, files: list) -> list:
+        logs = [BeerlogJson(delay_open(basedir, f), self.stream, delay_file_key(basedir, f)) for f in files]
+        if self.cache:
+            logs = [self.cache.series(delay_file_key(basedir, f), log) for f, log in zip(files, logs)]
+        if self.index:
+            logs = [IndexedTimeSeries(self.index, delay_file_key(basedir, f, '%s/%s' % (name, f)), log)
+                    for f, log in zip(files, logs)]
+        return logs
+
+    def _added(self, basedir: FS, name: str, seen: set) -> list:
+        """ the series of the log files not in seen, in log order. A log that has been compressed since it was seen
+        is not new. The new files are added to seen.
+        """
+        files = [f for f in log_files(basedir) if uncompressed_name(f) not in seen]
+        seen.update(uncompressed_name(f) for f in files)
+        return self._logs(basedir, name, files)
+
+
+class ParallelCompositeTimeSeries(CompositeTimeSeries):
+    """
+    Joins several BeerlogJson series together, parsing the files in a process pool ahead of the consumer.
+    The series may also be wrappers, such as IndexedTimeSeries, whose rows come from a BeerlogJson source.
+    Files with a system path are read, decompressed and parsed by the workers, which return the rows packed by
+    pack_rows. Other files, such as those in a memory file system, are read in this process and sent as text.
+    The rows are produced in the order of the series, and at most read_ahead files are parsed and held in memory
+    ahead of the file currently being consumed.
+    """
+
+    def __init__(self, name, serieses: list, workers: int, read_ahead: int = None, added: callable = None,
+                 batch: callable = None):
+        super().__init__(name, serieses, added=added, batch=batch)
+        self.workers = workers
+        self.read_ahead = read_ahead or 2 * workers
+
+    def series_rows(self):
+        for s, packed in parallel_logs(self.serieses, self.workers, self.read_ahead, parse_log):
+            yield s, unpack_rows(packed)
+
+
+def parallel_logs(serieses: list, workers: int, read_ahead: int, task: callable, *args):
+    """ applies a task to the log file of each series in a pool of worker processes, generating each series with
+    the result of its task, in series order.
+    The task is called with the worker source of the log (see worker_source) followed by args, and runs in a worker
+    process, so it must be a module level function. At most read_ahead files are pending ahead of the one whose
+    result is being consumed. Errors are raised as an ImportError naming the file.
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        remaining = iter(serieses)
+        try:
+            while True:
+                while len(pending) <= read_ahead:
+                    s = next(remaining, None)
+                    if s is None:
+                        break
+                    log = beerlog_source(s)
+                    try:
+                        source = worker_source(log)
+                    except Exception as e:
+                        raise ImportError('error decoding "%s"' % log.file_callable) from e
+                    pending.append((s, log, executor.submit(task, source, *args)))
+                if not pending:
+                    return
+                s, log, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    raise ImportError('error decoding "%s"' % log.file_callable) from e
+                yield s, result
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+def worker_source(log) -> object:
+    """ what is sent to a worker process to read a log: an opener of the file's system path when it has one, so
+    that the worker reads and decompresses the file itself, otherwise the text of the file, read in this process.
+    """
+    opener = log.file_callable
+    portable = opener.portable() if isinstance(opener, LogOpener) else None
+    return portable or log.read_text()
+
+
+def source_opener(source) -> callable:
+    """ the opener for a worker source """
+    return source if callable(source) else partial(io.StringIO, source)
+
+
+def beerlog_source(series: TimeSeries):
+    """ finds the BeerlogJson that provides the rows of a series, looking through wrapping series. """
+    while not isinstance(series, BeerlogJson):
+        series = series.source
+    return series
+
+
+def parse_log(source) -> tuple:
+    """ parses a beerlog json file to rows packed by pack_rows. This is run in the worker processes.
+    :param source:  an opener for the file, or its text. See worker_source.
+    >>> unpack_rows(parse_log('{"cols": [{"id": "time"}], "rows": [{"c": [{"v": "Date(2000,0,1,2,3,4)"}]}]}'))[0][0]
+    datetime.datetime(2000, 1, 1, 2, 3, 4)
+    """
+    return pack_rows(BeerlogJson(source_opener(source)).rows())
+
+
+def pack_rows(rows) -> tuple:
+    """ packs rows compactly for sending between processes: the times as an array of millis since the epoch, and
+    each remaining column as a tuple of its values. Values are unchanged, so the rows unpack exactly. This is
+    smaller and quicker to pickle and unpickle than the rows themselves.
+    >>> t = datetime(2016, 1, 1, 12)
+    >>> unpack_rows(pack_rows([[t, 1, None], [t, 2.5, 'a']]))
+    [[datetime.datetime(2016, 1, 1, 12, 0), 1, None], [datetime.datetime(2016, 1, 1, 12, 0), 2.5, 'a']]
+    """
+    columns = list(zip(*rows))
+    if not columns:
+        return np.empty(0, np.int64), []
+    return np.array([datetime_to_millis(t) for t in columns[0]], np.int64), columns[1:]
+
 
+def unpack_rows(packed: tuple) -> list:
+    millis, columns = packed
+    return list(map(list, zip(millis_to_datetimes(millis), *columns)))
+
+
+class DecompressedFile(io.TextIOWrapper):
+    """
+    The text of a compressed file, decompressed as it is read. Closing this closes the compressed file too.
+    >>> raw = io.BytesIO(gzip.compress(b'{"rows": []}'))
+    >>> with DecompressedFile(raw, gzip.open) as f:
+    ...     f.read()
+    '{"rows": []}'
+    >>> raw.closed
+    True
+    """
+
+    def __init__(self, raw, decompress: callable):
+        """
+        :param raw: the binary file of compressed data
+        :param decompress:  opens a decompressing binary file on the raw file, such as gzip.open
+        """
+        super().__init__(decompress(raw, 'rb'), encoding='utf-8')
+        self.raw_file = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.raw_file.close()
+
+
+def uncompressed_name(name: str) -> str:
+    """
+    >>> uncompressed_name('brew-1.json.gz'), uncompressed_name('brew-1.json')
+    ('brew-1.json', 'brew-1.json')
+    """
+    return name.rsplit('.', 1)[0] if decompressor(name) else name
+
+
+def decompressor(name: str) -> callable:
+    """ the decompressing opener for a file, or None when the file is not compressed.
+    >>> decompressor('brew-1.json.gz') is gzip.open, decompressor('brew-1.json')
+    (True, None)
+    """
+    for ext, decompress in compressions.items():
+        if name.endswith(ext):
+            return decompress
+    return None
+
+
+class LogOpener:
+    """
+    A callable that opens a log file for reading as text. Compressed files are decompressed as they are read, so
+    they are parsed without writing the decompressed data anywhere.
+    """
+
+    def __init__(self, fs: FS, name: str):
+        """
+        :param fs:  the file system holding the file, or None when the name is a system path
+        :param name:    the name of the file
+        """
+        self.fs = fs
+        self.name = name
+
+    def __repr__(self):
+        return self.name if self.fs is None else '%s in %s' % (self.name, self.fs)
+
+    def __call__(self):
+        decompress = decompressor(self.name)
+        if decompress is None:
+            return io.open(self.name, encoding='utf-8') if self.fs is None else self.fs.open(self.name)
+        raw = io.open(self.name, 'rb') if self.fs is None else self.fs.open(self.name, 'rb')
+        try:
+            return DecompressedFile(raw, decompress)
+        except Exception:
+            raw.close()
+            raise
+
+    def portable(self):
+        """ an opener of the system path of the file, that can be sent to another process, or None when the file has
+        no system path.
+        """
+        if self.fs is None:
+            return self
+        path = self.fs.getsyspath(self.name, allow_none=True)
+        return None if path is None else LogOpener(None, path)
 
-def delay_open(fs: FS, name: str):
-    def do_open():
-        return fs.open(name)
-    return do_open
+
+def delay_open(fs: FS, name: str) -> LogOpener:
+    """ creates a callable that opens a log file for reading as text. See LogOpener. """
+    return LogOpener(fs, name)
+
+
+def delay_file_key(fs: FS, name: str, path: str = None):
+    """ creates a callable that fetches the current cache key for a file, comprising its path, size and
+     modification time.
+    :param path:    the path recorded in the key. Defaults to the system path of the file.
+    """
+    def key():
+        info = fs.getinfo(name)
+        key_path = path or fs.getsyspath(name, allow_none=True) or '%s/%s' % (fs, name)
+        return [key_path, info.get('size'), str(info.get('modified_time'))]
+    return key
 
 
 def parse_colspec(data):
@@ -50,35 +321,222 @@ def parse_colspec(data):
     return [x['id'] for x in data['cols']]
 
 
+def file_size(f) -> int:
+    """ the size of an open file, found by seeking to its end. A file that can't seek from its end, as compressed files
+    can't before Python 3.5, reports an unknown size, which is larger than any offset.
+    >>> file_size(io.BytesIO(b'abc'))
+    3
+    """
+    try:
+        f.seek(0, io.SEEK_END)
+        return f.tell()
+    except (ValueError, OSError):
+        return float('inf')
+
+
 class BeerlogJson(TimeSeries):
     """
     Encapsulates reading beer log data from a single json file.
-        :param file a file like object to read from
+        :param file a callable returning a file like object to read from
+        :param stream   when True, the rows array is tokenized incrementally and each row is yielded as soon as it
+            is parsed, so memory is bounded by a single row rather than the whole file.
     """
 
-    def __init__(self, file: callable):
+    def __init__(self, file: callable, stream: bool = False, key: callable = None):
+        """
+        :param key: when given, a callable fetching the key of the file, such as from delay_file_key. The file is
+            only read for new rows when its key, which includes the size and modification time, has changed.
+        """
         self.file_callable = file
+        self.stream = stream
+        self.key = key
+        self.offset = None      # the position in the file following the last row generated by new_rows()
+        self.project = None
+        self.seen_key = None
+        self.head = None        # the start of the file, up to the end of its first row once that has been read
+        self.rows_start = None
 
     def __str__(self):
         with self.file_callable() as f:
             return '%s on file %s' % (self.__class__, f)
 
+    def read_text(self) -> str:
+        """ reads the raw content of the file """
+        with self.file_callable() as f:
+            return f.read()
+
     def rows(self):
         try:
-            with self.file_callable() as f:
-                data = json.load(f)
-            colspec = parse_colspec(data)
-            rows = brewpi_log_rows(data)
+            rows = self._stream_rows() if self.stream else self._load_rows()
             for r in rows:
-                yield select_columns(r, colspec, ts_columns)
+                yield r
         except Exception as e:
             raise ImportError('error decoding "%s"' %
                               self.file_callable) from e
 
+    def _load_rows(self):
+        with self.file_callable() as f:
+            data = json.load(f)
+        project = compile_projection(parse_colspec(data), ts_columns)
+        rows = brewpi_log_rows(data)
+        for r in rows:
+            yield project(r)
+
+    def _stream_rows(self):
+        """ parses the file incrementally. The column spec is needed to interpret the rows, so in the unusual case
+         that the rows precede the column spec in the file, the rows are skipped and the file is read a second time.
+        """
+        colspec = None
+        skipped_rows = False
+        with self.file_callable() as f:
+            stream = JsonStream(f)
+            for key in stream.object_keys():
+                if key == 'cols':
+                    colspec = parse_colspec({'cols': stream.value()})
+                elif key == 'rows' and colspec is not None:
+                    yield from self._stream_log_rows(stream, colspec)
+                else:
+                    skipped_rows = skipped_rows or key == 'rows'
+                    stream.skip_value()
+        if skipped_rows:
+            if colspec is None:
+                raise ValueError("log file has no column spec")
+            with self.file_callable() as f:
+                stream = JsonStream(f)
+                for key in stream.object_keys():
+                    if key == 'rows':
+                        yield from self._stream_log_rows(stream, colspec)
+                    else:
+                        stream.skip_value()
+
+    @staticmethod
+    def _stream_log_rows(stream: JsonStream, colspec: list):
+        project = compile_projection(colspec, ts_columns)
+        for row in stream.array_items():
+            yield project(brewpi_log_row(row))
+
+    def new_rows(self):
+        """ generates the rows appended to the file since the last call, or all of its rows on the first call.
+        Parsing resumes from the offset following the last row generated, so each row is parsed once. A row that is
+        still being written is left for a later call.
+        The start of the file, up to the end of its first row, is kept. When the file no longer starts with it, or has
+        become shorter than the offset, it has been truncated or replaced, so it is read again from its column spec.
+        """
+        key = None if self.key is None else self.key()
+        if key is not None and key == self.seen_key:
+            return
+        with self.file_callable() as f:
+            f = getattr(f, 'buffer', f)     # offsets are in bytes, unless the file only provides text
+            if self.offset is not None and (file_size(f) < self.offset or not self._same_head(f)):
+                self.offset = self.project = None
+            if self.offset is None:
+                f.seek(0)
+                colspec, self.offset = log_rows_start(f)
+                self.project = compile_projection(colspec, ts_columns)
+                self.rows_start = self.offset
+                f.seek(0)
+                self.head = f.read(self.offset)
+            f.seek(self.offset)
+            data = f.read()
+        if isinstance(data, bytes):
+            text = codecs.getincrementaldecoder('utf-8')().decode(data)     # holds back a partly written character
+            width = utf8_length
+        else:
+            text, width = data, len
+        decoder = json.JSONDecoder()
+        pos = 0
+        while True:
+            start = _row_separator.match(text, pos).end()
+            if text[start:start + 1] != '{':
+                break       # the end of the rows written so far
+            try:
+                row, end = decoder.raw_decode(text, start)
+            except ValueError:
+                break       # partly written
+            if len(self.head) == self.rows_start:     # the first row of the file
+                self.head += data[:width(text[:end])]
+            self.offset += width(text[pos:end])
+            pos = end
+            yield self.project(brewpi_log_row(row))
+        # set once all the rows are generated, so rows left by a consumer that stopped early are read next time
+        self.seen_key = key
+
+    def _same_head(self, f) -> bool:
+        f.seek(0)
+        return f.read(len(self.head)) == self.head
+
+    def follow(self, interval: float = 0.5, stop: Event = None):
+        """ generates the rows of the file, then the rows appended to it as they are written, until stop is set.
+        :param interval:    the time in seconds between checks for new rows
+        :param stop:    an event that ends the generator when set
+        """
+        stop = stop or Event()
+        yield from self.new_rows()
+        while not stop.wait(interval):
+            yield from self.new_rows()
+
     def append(self, data: iter):
         raise NotImplementedError
 
 
+_row_separator = re.compile(r'[\s,]*')
+_whitespace = re.compile(r'\s*')
+
+
+def utf8_length(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def log_rows_start(f) -> (list, int):
+    """ reads the start of a log file up to the rows, returning the column spec and the offset of the first row.
+    The file may be binary, when the offset is in bytes, or text. The column spec must precede the rows.
+    >>> log_rows_start(io.StringIO('{"cols": [{"id": "time"}], "rows": [{"c": []}]}'))
+    (['time'], 36)
+    """
+    data = f.read(0)
+    width = utf8_length if isinstance(data, bytes) else len
+    while True:
+        chunk = f.read(default_chunk_size)
+        data += chunk
+        text = data.decode('utf-8', 'ignore') if isinstance(data, bytes) else data
+        start = _parse_rows_start(text)
+        if start is not None:
+            colspec, pos = start
+            if colspec is None:
+                raise ValueError("log file has no column spec before the rows")
+            return colspec, width(text[:pos])
+        if not chunk:
+            raise ValueError("log file has no rows")
+
+
+def _parse_rows_start(text: str):
+    """ parses the log object up to the rows array, returning the column spec and the position after the start of
+    the array, or None when the text does not yet reach the rows.
+    """
+    decoder = json.JSONDecoder()
+    colspec = None
+    try:
+        pos = _whitespace.match(text).end()
+        if text[pos] != '{':
+            raise ValueError("log file is not a json object")
+        pos += 1
+        while True:
+            pos = _whitespace.match(text, pos).end()
+            key, pos = decoder.raw_decode(text, pos)
+            pos = _whitespace.match(text, pos).end()
+            pos = _whitespace.match(text, pos + 1).end()    # after the colon
+            if key == 'rows':
+                if text[pos] != '[':
+                    raise ValueError("log rows are not an array")
+                return colspec, pos + 1
+            value, pos = decoder.raw_decode(text, pos)
+            if key == 'cols':
+                colspec = parse_colspec({'cols': value})
+            pos = _whitespace.match(text, pos).end() + 1    # after the comma
+    except (ValueError, IndexError):
+        return None
+
+
 def extract_value(value) -> (any):
     """
     Extracts a value. The value is either None or value of attribute 'v'.
@@ -113,26 +571,49 @@ def brewpi_log_rows(log):
     rows = log['rows']
     # todo - handle older format without roomTemp or state
     for row in rows:
-        c = row['c']
-        dt = parse_datetime(extract_value(c[0]))
-        # the time is in local time (but without any DST info) - convert to UTF
-        # we could look for jumps backwards or forwards within the same file to
-        # determine a DST change
-        data = [dt]
-        data.extend([extract_value(x) for x in c[1:]])
-        yield data
+        yield brewpi_log_row(row)
+
+
+def brewpi_log_row(row) -> list:
+    """
+    converts a single decoded row from a brewpi log to a list of raw values.
+
+    >>> brewpi_log_row({'c':[{'v':'Date(2000,1,2,3,4,5)'}, None, {'v':'abc'}]})
+    [datetime.datetime(2000, 2, 2, 3, 4, 5), None, 'abc']
+    """
+    c = row['c']
+    dt = parse_datetime(extract_value(c[0]))
+    # the time is in local time (but without any DST info) - convert to UTF
+    # we could look for jumps backwards or forwards within the same file to
+    # determine a DST change
+    data = [dt]
+    data.extend([extract_value(x) for x in c[1:]])
+    return data
 
 
-def parse_datetime(s) -> datetime:
+def parse_datetime(s, millis: bool = False) -> datetime:
     """
     Parses the brewpi json log datetime format. Note that months are 0-based (wtf?)
     :param s: the time to parse
     :type s: string
+    :param millis: when True, the time is returned as millis since the epoch rather than a datetime
     :return: the parsed datetime
     :rtype: datetime.datetime
 
     >>> parse_datetime('Date(2013,11,18,15,41,31)')
     datetime.datetime(2013, 12, 18, 15, 41, 31)
+    >>> parse_datetime('Date(1970,0,2,0,0,1)', millis=True)
+    86401000
+    """
+    return (parse_millis_fast if millis else parse_datetime_fast)(s)
+
+
+def parse_datetime_general(s) -> datetime:
+    """
+    Parses the brewpi json log datetime format, accepting any number of date fields.
+
+    >>> parse_datetime_general('Date(2013,11,18)')
+    datetime.datetime(2013, 12, 18, 0, 0)
     """
     # this doesn't work - won't accept month 0
     # d = datetime.strptime(s, 'Date(%Y,%m,%d,%H,%M,%S)')
@@ -146,18 +627,92 @@ def parse_datetime(s) -> datetime:
     raise ValueError('invalid date format: %s ' % (s))
 
 
+class DateParser:
+    """
+    A fast parser for the usual Date(y,m,d,h,m,s) format. Consecutive log rows almost always share the same
+    year, month, day and hour, so the time at the start of the hour is cached, keyed on that prefix of the string.
+    Each row then only parses the minutes and seconds and adds a precomputed offset to the cached hour.
+    Other formats and invalid values fall back to parse_datetime_general().
+
+    >>> p = DateParser()
+    >>> p('Date(2013,11,18,15,41,31)'), p('Date(2013,11,18,15,42,0)')
+    (datetime.datetime(2013, 12, 18, 15, 41, 31), datetime.datetime(2013, 12, 18, 15, 42))
+    >>> DateParser(millis=True)('Date(1970,0,1,1,0,2)')
+    3602000
+    >>> DateParser(millis=True)('Date(1970,0,1,1,60,2)')
+    Traceback (most recent call last):
+    ...
+    ValueError: minute must be in 0..59
+    """
+    def __init__(self, millis: bool = False, cache_size: int = 64):
+        """
+        :param millis:  when True, times are returned as millis since the epoch, and no datetimes are created
+        :param cache_size:  the maximum number of hours cached
+        """
+        self.millis = millis
+        self.cache_size = cache_size
+        self.cache = {}
+        # the offset from the start of the hour for each minute and second
+        self.offsets = [s * 1000 if millis else timedelta(seconds=s) for s in range(3600)]
+
+    def _general(self, s):
+        dt = parse_datetime_general(s)
+        return datetime_to_millis(dt) if self.millis else dt
+
+    def _hour(self, prefix: str):
+        """ parses and caches the start of the hour from the 'Date(y,m,d,h' prefix, or None if not in that form """
+        if not prefix.startswith('Date('):
+            return None
+        values = [int(x) for x in prefix[5:].split(',')]
+        if len(values) != 4:
+            return None
+        y, m, d, h = values
+        hour = datetime(y, m + 1, d, h)
+        if self.millis:
+            hour = datetime_to_millis(hour)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[prefix] = hour
+        return hour
+
+    def __call__(self, s: str):
+        try:
+            j = s.rindex(',')
+            i = s.rindex(',', 0, j)
+            minute = int(s[i + 1:j])
+            second = int(s[j + 1:-1])
+        except ValueError:
+            return self._general(s)
+        if s[-1] != ')' or not (0 <= minute < 60 and 0 <= second < 60):
+            return self._general(s)
+        prefix = s[:i]
+        hour = self.cache.get(prefix)
+        if hour is None:
+            hour = self._hour(prefix)
+            if hour is None:
+                return self._general(s)
+        return hour + self.offsets[minute * 60 + second]
+
+
+parse_datetime_fast = DateParser()
+parse_millis_fast = DateParser(millis=True)
+
+
 def log_files(dir: SubFS) -> list:
     """
     Given a directory, produces a list of json files in ascending chronological order.
+    The files may be compressed, with any of the log_extensions. A compressed file is ignored when the same log is
+    also present uncompressed.
     :param dir:
     :type dir:
     :return:
     :rtype:
     """
     name = dir.sub_dir[1:]      # remove /
-    ext = '.json'
     files = [f for f in dir.listdir() if dir.isfile(f)]
-    return sort_and_filter_log_files(files, name, ext)
+    present = set(files)
+    files = [f for f in files if uncompressed_name(f) == f or uncompressed_name(f) not in present]
+    return sort_and_filter_log_files(files, name, log_extensions)
 
 
 def sort_and_filter_log_files(files, name, ext):
@@ -168,8 +723,9 @@ def sort_and_filter_log_files(files, name, ext):
     :type files:    list(str)
     :param name:    the common prefix for log files - files not having this prefix are ignored
     :type name:     str
-    :param ext:     the extension for log files - files not having this extension are ignored
-    :type ext:      str
+    :param ext:     the extension for log files - files not having this extension are ignored. May also be a
+                    tuple of extensions, any of which is accepted.
+    :type ext:      str or tuple(str)
     :return:        a new list of files, sorted and filtered
     :rtype:         list(str)
     """
@@ -218,14 +774,30 @@ def strip_int_list(prefix, suffix, s) -> tuple:
     return tuple(values)
 
 
-def log_file_key_factory(prefix: str, suffix: str):
+def extension_tuple(ext) -> tuple:
+    """ the extensions, each starting with a dot, longest first.
+    >>> extension_tuple('json'), extension_tuple(('.json', '.json.gz'))
+    (('.json',), ('.json.gz', '.json'))
+    """
+    exts = (ext,) if isinstance(ext, str) else ext
+    return tuple(sorted((e if e.startswith('.') else '.' + e for e in exts), key=len, reverse=True))
+
+
+def log_file_key_factory(prefix: str, suffix):
     """
     strips off the prefix and suffix, and treats the remainder as a tuple of hyphen-delimited integers.
+    The suffix may be a tuple of suffixes, in which case the longest that the name ends with is stripped.
     >>> log_file_key_factory('abc', '.def')('abc-1-2-3.def')
     (1, 2, 3)
+    >>> log_file_key_factory('abc', ('.def', '.def.gz'))('abc-1-2-3.def.gz')
+    (1, 2, 3)
     """
+    if isinstance(suffix, str):
+        return partial(strip_int_list, prefix, suffix)
+    suffixes = extension_tuple(suffix)
+
     def key(s: str):
-        return strip_int_list(prefix, suffix, s)
+        return strip_int_list(prefix, next((x for x in suffixes if s.endswith(x)), suffixes[0]), s)
     return key
 
 
@@ -244,11 +816,12 @@ def log_file_filter_factory(prefix: str, ext: str) -> callable(bool):
     True
     >>> log_file_filter_factory('abc','def')('abc123.456.def')
     True
+    >>> log_file_filter_factory('abc', ('.def', '.def.gz'))('abc-1.def.gz')
+    True
     """
-    if not ext.startswith('.'):
-        ext = '.' + ext
+    exts = extension_tuple(ext)
 
     def filter(file: str):
-        return file.startswith(prefix) and file.endswith(ext) and len(ext) + len(prefix) <= len(file)
+        return file.startswith(prefix) and any(file.endswith(e) and len(e) + len(prefix) <= len(file) for e in exts)
 
     return filter
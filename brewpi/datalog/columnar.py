@@ -0,0 +1,308 @@
+"""
+A column oriented, numpy backed time series. Rather than a list of rows of boxed python values, the times are held
+in a single int64 array of milliseconds since the epoch, and each numeric column in a float64 array with NaN marking
+missing values. This keeps large logs compact and lets aggregates run vectorized.
+"""
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from brewpi.datalog.beerlog import TimeSeries, ts_columns
+from brewpi.datalog.time import datetime_to_millis
+
+__author__ = 'mat'
+
+# columns holding free text rather than numbers
+annotation_columns = ('beerAnn', 'fridgeAnn')
+
+
+def millis_to_datetimes(millis: np.ndarray) -> list:
+    """ converts an array of millis since the epoch to a list of datetimes.
+    >>> millis_to_datetimes(np.array([86400750], dtype=np.int64))
+    [datetime.datetime(1970, 1, 2, 0, 0, 0, 750000)]
+    """
+    return millis.astype('datetime64[ms]').tolist()
+
+
+def _to_float(v) -> float:
+    return np.nan if v is None else float(v)
+
+
+def object_array(values: list) -> np.ndarray:
+    """ a one dimensional array of python objects, whatever the values are
+    >>> object_array(['ab', 1]).tolist()
+    ['ab', 1]
+    """
+    result = np.empty(len(values), object)
+    result[:] = values
+    return result
+
+
+def _slice_sparse(sparse: dict, start: int, stop: int) -> dict:
+    """ the entries of sparse columns, each a tuple of (row index array, value array), within a range of rows """
+    result = {}
+    for c, (index, values) in sparse.items():
+        lo, hi = np.searchsorted(index, [start, stop])
+        result[c] = (index[lo:hi] - start, values[lo:hi])
+    return result
+
+
+def _reorder_sparse(sparse: dict, inverse: np.ndarray) -> dict:
+    """ moves the entries of sparse columns to the new positions of their rows, given by inverse """
+    result = {}
+    for c, (index, values) in sparse.items():
+        index = inverse[index]
+        by_row = np.argsort(index, kind='stable')
+        result[c] = (index[by_row], values[by_row])
+    return result
+
+
+class ColumnarTimeSeries(TimeSeries):
+    """
+    A time series stored column by column.
+    The times are kept in ascending order. Numeric columns are float64 arrays, so integer values such as 'state'
+    are returned as floats, and missing values (None) are stored as NaN. Annotation columns are sparse: only the rows
+    that have an annotation are stored, as an array of row indices and a parallel array of strings.
+    When built with exact=True, rows() returns each value with the type it was given in: the columns whose values
+    are mostly ints are returned as ints, and the values of any other type, such as strings, are kept sparsely
+    alongside the floats, in the same way as annotations.
+
+    >>> ts = ColumnarTimeSeries.from_rows([[datetime(2000, 1, 1), 20, None, 'pitched'],
+    ...                                    [datetime(2000, 1, 2), 22, 18, None]], ['time', 'beerTemp', 'beerSet',
+    ...                                    'beerAnn'])
+    >>> len(ts), ts.mean('beerTemp'), ts.max('beerSet')
+    (2, 21.0, 18.0)
+    >>> for r in ts.rows(): print(r)
+    [datetime.datetime(2000, 1, 1, 0, 0), 20.0, None, 'pitched']
+    [datetime.datetime(2000, 1, 2, 0, 0), 22.0, 18.0, None]
+    >>> ts = ColumnarTimeSeries.from_rows([[0, 20, '1'], [1, 20.5, 2], [2, None, 3]], ['time', 'beerTemp', 'state'],
+    ...                                   exact=True)
+    >>> [r[1:] for r in ts.rows()], ts.mean('state')
+    ([[20, '1'], [20.5, 2], [None, 3]], 2.0)
+    """
+
+    def __init__(self, time: np.ndarray, values: dict, annotations: dict = None, columns: list = ts_columns,
+                 exact: bool = False, int_columns: set = (), exceptions: dict = None):
+        """
+        :param time:    int64 array of millis since the epoch, in ascending order
+        :param values:  a dict of column name to float64 array, one for each numeric column
+        :param annotations: a dict of column name to a tuple of (row index array, string array)
+        :param columns: the column names, in row order. The first column is the time.
+        :param exact:   when True, the numeric values are returned with their original types, as given by
+            int_columns and exceptions
+        :param int_columns: the numeric columns whose values are returned as ints
+        :param exceptions:  a dict of numeric column name to a tuple of (row index array, value array), giving the
+            values returned in place of those in the float64 array
+        """
+        self.columns = list(columns)
+        self.time = time
+        self.values = values
+        self.annotations = annotations or {}
+        self.exact = exact
+        self.int_columns = set(int_columns)
+        self.exceptions = exceptions or {}
+        for c in self.columns[1:]:
+            if c in annotation_columns:
+                self.annotations.setdefault(c, (np.empty(0, np.int64), np.empty(0, object)))
+            elif c not in self.values:
+                self.values[c] = np.full(len(time), np.nan)
+
+    @classmethod
+    def from_rows(cls, rows, columns: list = ts_columns, sort: bool = True, exact: bool = False):
+        """ builds a columnar series from an iterable of rows, such as that produced by TimeSeries.rows().
+        The rows are accumulated in compact arrays so the boxed rows do not need to be held in memory.
+        :param sort:    when True, rows that are not in time order are sorted, otherwise a ValueError is raised.
+        :param exact:   when True, the type of each numeric value is recorded, so rows() returns the values given
+
+        >>> ColumnarTimeSeries.from_rows([[2], [1]], ['time'], sort=False)
+        Traceback (most recent call last):
+        ...
+        ValueError: rows are not in time order
+        """
+        columns = list(columns)
+        time = array('q')
+        values = [(i, c, array('d')) for i, c in enumerate(columns) if i and c not in annotation_columns]
+        annotations = [(i, c, array('q'), []) for i, c in enumerate(columns) if c in annotation_columns]
+        ints = {c: array('q') for _, c, _ in values}      # the rows holding ints, when exact
+        others = {c: ([], []) for _, c, _ in values}       # the rows and values neither float nor int
+        for n, row in enumerate(rows):
+            time.append(datetime_to_millis(row[0]))
+            for i, c, a in values:
+                v = row[i]
+                a.append(_to_float(v))
+                if exact and v is not None and type(v) is not float:
+                    if type(v) is int:
+                        ints[c].append(n)
+                    else:
+                        others[c][0].append(n)
+                        others[c][1].append(v)
+            for i, _, index, text in annotations:
+                if row[i] is not None:
+                    index.append(n)
+                    text.append(row[i])
+        values = {c: np.frombuffer(a, np.float64) if a else np.empty(0) for _, c, a in values}
+        int_columns, exceptions = set(), {}
+        for c, v in values.items() if exact else ():
+            int_rows = np.array(ints[c], np.int64)
+            other_rows, other_values = others[c]
+            floats = ~np.isnan(v)
+            floats[int_rows] = False
+            floats[other_rows] = False
+            float_rows = np.flatnonzero(floats)
+            if len(int_rows) > len(float_rows):     # the fewer kind is stored sparsely
+                int_columns.add(c)
+                index = np.concatenate((float_rows, other_rows)).astype(np.int64)
+                exact_values = v[float_rows].tolist() + other_values
+            else:
+                index = np.concatenate((int_rows, other_rows)).astype(np.int64)
+                exact_values = [int(x) for x in v[int_rows].tolist()] + other_values
+            if len(index):
+                by_row = np.argsort(index, kind='stable')
+                exceptions[c] = (index[by_row], object_array(exact_values)[by_row])
+        result = cls(np.frombuffer(time, np.int64) if time else np.empty(0, np.int64), values,
+                     {c: (np.array(index, np.int64), np.array(text, object)) for _, c, index, text in annotations},
+                     columns, exact, int_columns, exceptions)
+        return result._sorted(sort)
+
+    @classmethod
+    def from_series(cls, series: TimeSeries, columns: list = ts_columns):
+        """ converts any time series to a columnar series """
+        return cls.from_rows(series.rows(), columns)
+
+    def _sorted(self, sort: bool = True):
+        if len(self.time) < 2 or not (np.diff(self.time) < 0).any():
+            return self
+        if not sort:
+            raise ValueError('rows are not in time order')
+        order = np.argsort(self.time, kind='stable')
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return ColumnarTimeSeries(self.time[order], {c: v[order] for c, v in self.values.items()},
+                                  _reorder_sparse(self.annotations, inverse), self.columns, self.exact,
+                                  self.int_columns, _reorder_sparse(self.exceptions, inverse))
+
+    def __len__(self):
+        return len(self.time)
+
+    def column(self, name: str) -> np.ndarray:
+        """ the array of values for a numeric column, or of millis for the time column """
+        return self.time if name == self.columns[0] else self.values[name]
+
+    def rows(self):
+        """ converts the columns back to rows of python values, in the same format as the source rows. """
+        n = len(self.time)
+        columns = []
+        for c in self.columns[1:]:
+            if c in annotation_columns:
+                col = [None] * n
+                index, text = self.annotations[c]
+                for i, t in zip(index.tolist(), text.tolist()):
+                    col[i] = t
+            else:
+                v = self.values[c]
+                missing = np.isnan(v)
+                if c in self.int_columns:
+                    col = np.where(missing, 0, v).astype(np.int64).astype(object)
+                    col[missing] = None
+                    col = col.tolist()
+                else:
+                    col = np.where(missing, None, v).tolist()
+                if c in self.exceptions:
+                    index, exact = self.exceptions[c]
+                    for i, x in zip(index.tolist(), exact.tolist()):
+                        col[i] = x
+            columns.append(col)
+        for row in zip(millis_to_datetimes(self.time), *columns):
+            yield list(row)
+
+    def range(self) -> (datetime, datetime):
+        """
+        >>> ColumnarTimeSeries.from_rows([[datetime(2000, 1, 2)], [datetime(2000, 1, 1)]], ['time']).range()
+        (datetime.datetime(2000, 1, 1, 0, 0), datetime.datetime(2000, 1, 2, 0, 0))
+        >>> ColumnarTimeSeries.from_rows([], ['time']).range() is None
+        True
+        """
+        if not len(self.time):
+            return None
+        start, end = millis_to_datetimes(self.time[[0, -1]])
+        return start, end
+
+    def _aggregate(self, f, name):
+        v = self.values[name]
+        if np.isnan(v).all():
+            return None
+        return float(f(v))
+
+    def min(self, name: str):
+        """ the smallest value in a numeric column, ignoring missing values, or None if there are no values """
+        return self._aggregate(np.nanmin, name)
+
+    def max(self, name: str):
+        """ the largest value in a numeric column, ignoring missing values, or None if there are no values """
+        return self._aggregate(np.nanmax, name)
+
+    def mean(self, name: str):
+        """ the mean of a numeric column, ignoring missing values, or None if there are no values """
+        return self._aggregate(np.nanmean, name)
+
+    def __getitem__(self, s: slice):
+        """ slices the series by row position.
+        >>> ts = ColumnarTimeSeries.from_rows([[0, 'a'], [1, None], [2, 'c']], ['time', 'beerAnn'])
+        >>> [r[1] for r in ts[1:].rows()]
+        [None, 'c']
+        """
+        if not isinstance(s, slice) or s.step not in (None, 1):
+            raise TypeError('only contiguous slices are supported')
+        start, stop, _ = s.indices(len(self.time))
+        stop = max(start, stop)
+        return ColumnarTimeSeries(self.time[start:stop], {c: v[start:stop] for c, v in self.values.items()},
+                                  _slice_sparse(self.annotations, start, stop), self.columns, self.exact,
+                                  self.int_columns, _slice_sparse(self.exceptions, start, stop))
+
+    def slice(self, start=None, end=None):
+        """ the rows with start <= time < end. Either bound may be None, and may be a datetime or epoch millis.
+        >>> ts = ColumnarTimeSeries.from_rows([[0, 1], [10, 2], [20, 3]], ['time', 'beerTemp'])
+        >>> ts.slice(5, 20).column('beerTemp')
+        array([2.])
+        """
+        lo = 0 if start is None else np.searchsorted(self.time, datetime_to_millis(start), 'left')
+        hi = len(self.time) if end is None else np.searchsorted(self.time, datetime_to_millis(end), 'left')
+        return self[int(lo):int(hi)]
+
+    def range_is_indexed(self) -> bool:
+        return True
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        return self.slice(start, end).rows()
+
+    def append(self, row: list):
+        self.append_bulk([row])
+
+    def append_bulk(self, rows: list):
+        """
+        Appends rows to the end of the series. The times must not be earlier than the last time in the series.
+        Rows can't be appended to an exact series, since the types of its values are not recorded column by column.
+        >>> ts = ColumnarTimeSeries.from_rows([[10, 1]], ['time', 'beerTemp'])
+        >>> ts.append([20, 2]); ts.column('beerTemp')
+        array([1., 2.])
+        >>> ts.append([15, 3])
+        Traceback (most recent call last):
+        ...
+        ValueError: time is not ascending: 15 is before 20
+        """
+        if self.exact:
+            raise ValueError("rows can't be appended to an exact series")
+        other = ColumnarTimeSeries.from_rows(rows, self.columns)
+        if not len(other):
+            return
+        first = int(other.time[0])
+        if len(self.time) and first < self.time[-1]:
+            raise ValueError('time is not ascending: %d is before %d' % (first, self.time[-1]))
+        offset = len(self.time)
+        self.time = np.concatenate((self.time, other.time))
+        self.values = {c: np.concatenate((v, other.values[c])) for c, v in self.values.items()}
+        for c, (index, text) in self.annotations.items():
+            other_index, other_text = other.annotations[c]
+            self.annotations[c] = (np.concatenate((index, other_index + offset)),
+                                   np.concatenate((text, other_text)))
@@ -1,72 +1,450 @@
 """
-Eventually this will simply convert from one log format to another using providers. For now, it's hard-coded to use
-the json log format as input and the influxdb as output.
+Converts time series from one repo to another, e.g. from json log files to influxdb. The source and sink repos are
+chosen by type from the sources and sinks tables, and the rows may be transformed on the way by the stages in
+brewpi.datalog.pipeline.
 """
 
 from brewpi.datalog.influxdb.db import InfluxDBTimeSeriesRepo
-import itertools
+import argparse
+import logging
 import sys
-from os.path import abspath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from os.path import abspath, basename, dirname, isdir, join
+from urllib.parse import urlsplit
+from threading import Event, Lock, Thread
 
 import simplejson as json
-from brewpi.datalog.beerlog_json import brewpi_log_rows, BeerlogJsonRepo
+from brewpi.datalog.beerlog import TimeSeries, TimeSeriesRepo, ts_columns
+from brewpi.datalog.beerlog_json import BeerlogJson, BeerlogJsonRepo
+from brewpi.datalog.columnar import annotation_columns
+from brewpi.datalog.pipeline import Dedup, Project, Resample, ToUtc, apply_stages, background_reader, chunker, \
+    exhausted
+from brewpi.datalog.range_index import RangeIndex
+from brewpi.datalog.segment_store import SegmentTimeSeriesRepo
+from brewpi.datalog.sqlite.db import SqliteTimeSeriesRepo
+from brewpi.datalog.stats import SeriesStats, series_stats
+from brewpi.datalog.time import datetime_to_millis, millis_to_datetime
+from fs.base import FS
 from fs.opener import fsopendir
 
+logger = logging.getLogger(__name__)
+
 brewpi_test_influxdb_config = (
     'sandbox.influxdb.org', 9061, 'brewpi', 'fermentor', 'brewpi_test')
 
+default_state_file = '.convert-state.json'
+state_version = 1
+
+
+def stats(repo, name, workers: int = 0, **kwargs) -> SeriesStats:
+    """ computes and prints the statistics of a series in a single pass over its rows. See series_stats.
+    :param workers: when non-zero, the log files of the series are processed in parallel by this many processes
+    """
+    result = series_stats(repo.fetch(name), workers=workers, **kwargs)
+    print('series "%s"' % name)
+    print(result.report())
+    return result
+
+
+class ConvertState:
+    """
+    Records how far each series has been converted, so that a later run only imports new rows.
+    For each series, the state holds the high-water mark - the time of the last row imported, as millis - and the
+    key (size and modification time) of each source file that has been completely imported.
+    The state is persisted as a json file, usually in the root of the source repo. Series may be recorded from
+    several threads at once.
+    """
+
+    def __init__(self, dir: FS, path: str = default_state_file):
+        self.dir = dir
+        self.path = path
+        self.lock = Lock()
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        """ reads the state file. A file that can't be read is treated as no state, so all rows are converted. """
+        if not self.dir.exists(self.path):
+            return {}
+        try:
+            data = json.loads(self.dir.getcontents(self.path, 'rb').decode('utf-8'))
+            return data['series'] if data.get('version') == state_version else {}
+        except (ValueError, KeyError, AttributeError) as e:
+            logger.warning('ignoring the unreadable convert state %s: %s', self.path, e)
+            return {}
+
+    def save(self):
+        """ writes the state to a temporary file and moves it into place, so an interrupted save leaves the previous
+        state intact """
+        with self.lock:
+            data = json.dumps({'version': state_version, 'series': self.entries}, sort_keys=True)
+            temp = self.path + '.tmp'
+            self.dir.setcontents(temp, data.encode('utf-8'))
+            self.dir.move(temp, self.path, overwrite=True)
+
+    def series(self, name: str) -> dict:
+        """ fetches the state of a series. Use record() to modify it. """
+        with self.lock:
+            return self.entries.setdefault(name, {'high_water': None, 'files': {}})
+
+    def record(self, name: str, high_water: datetime = None, files: list = (), clear_files: bool = False):
+        """ updates the state of a series and saves it.
+        :param high_water:  the time of the last row imported
+        :param files:   the (path, key) of each source file that has been completely imported
+        :param clear_files: forgets the files imported, so that they are read again
+        """
+        entry = self.series(name)
+        with self.lock:
+            if clear_files:
+                entry['files'] = {}
+            if high_water is not None:
+                entry['high_water'] = datetime_to_millis(high_water)
+            for path, key in files:
+                entry['files'][path] = key
+        self.save()
+
+
+class ConvertStats:
+    """
+    Counts the rows and source bytes converted and the time spent reading and writing, from any number of threads.
+    The stage times are summed over all threads, so they may exceed the elapsed time.
+
+    >>> clock = iter([0, 4]).__next__
+    >>> stats = ConvertStats(clock)
+    >>> stats.add(rows=1000, bytes=2 * 1024 * 1024, read=1.5, write=2)
+    >>> stats.report()
+    '1000 rows (250 rows/s), 2.0 MB (0.5 MB/s) in 4.0s; read 1.5s, write 2.0s'
+    """
+
+    stages = ('read', 'write')
+
+    def __init__(self, clock: callable = time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.lock = Lock()
+        self.rows = 0
+        self.bytes = 0
+        self.times = dict.fromkeys(self.stages, 0.0)
+
+    def add(self, rows: int = 0, bytes: int = 0, **times):
+        """ adds to the counts. The keyword arguments give the time in seconds spent in each stage. """
+        with self.lock:
+            self.rows += rows
+            self.bytes += bytes
+            for stage, t in times.items():
+                self.times[stage] += t
+
+    def report(self) -> str:
+        with self.lock:
+            elapsed = max(self.clock() - self.start, 1e-9)
+            mb = self.bytes / (1024 * 1024)
+            return '%d rows (%d rows/s), %.1f MB (%.1f MB/s) in %.1fs; %s' % (
+                self.rows, self.rows / elapsed, mb, mb / elapsed, elapsed,
+                ', '.join('%s %.1fs' % (stage, self.times[stage]) for stage in self.stages))
+
+
+def report_progress(stats: ConvertStats, interval: float, stop: Event, out=sys.stderr):
+    """ prints the stats every interval seconds until stop is set """
+    while not stop.wait(interval):
+        print(stats.report(), file=out, flush=True)
+
+
+def pipelined(iterable, depth: int, stats: ConvertStats = None):
+    """ produces the items of an iterable on a background thread, holding at most depth items ahead of the consumer.
+    The time taken to produce the items is added to the 'read' stage of the stats.
+    Exceptions raised by the iterable are raised to the consumer.
+    >>> list(pipelined(range(5), 2))
+    [0, 1, 2, 3, 4]
+    """
+    timing = None if stats is None else (lambda t: stats.add(read=t))
+    with background_reader(iterable, depth, 'pipelined', timing) as get:
+        item = get()
+        while item is not exhausted:
+            yield item
+            item = get()
+
 
-def import_stream(db, name, stream):
+@contextmanager
+def unclosed(stream):
+    """ a context manager giving a stream, which is left open on exit """
+    yield stream
+
+
+def import_stream(dst: TimeSeries, stream, chunk_size: int = 500, max_delay: float = None, dry_run: bool = False,
+                  stats: ConvertStats = None) -> int:
+    """
+    imports a brewpi json log from a stream, appending its rows to a series in batches.
+    The log is parsed incrementally, so memory is bounded by the batch size and the stream may be a pipe that is
+    still being written. The column spec must precede the rows, as brewpi writes it.
+
+    :param dst:     the series the rows are appended to. May be None for a dry run.
+    :param stream:  a file like object to read the log from. It is not closed.
+    :param chunk_size:  the most rows appended at once
+    :param max_delay:   when given, a batch is also appended once this many seconds have passed since its first row
+        was read. See chunker.
+    :param dry_run: when True, the rows are parsed and batched but not appended, to measure the parsing alone
+    :param stats:   when given, the rows and the time spent reading and writing are added to it
+    :return: the number of rows imported, or that would have been imported in a dry run
+    """
+    stats = stats or ConvertStats()
+    rows = BeerlogJson(partial(unclosed, stream), stream=True).rows()
+    chunks = chunker(rows, chunk_size, max_delay)
+    count = 0
+    while True:
+        begin = time.monotonic()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return count
+        read = time.monotonic()
+        if not dry_run:
+            dst.append_bulk(chunk)
+        stats.add(rows=len(chunk), read=read - begin, write=time.monotonic() - read)
+        count += len(chunk)
+
+
+def resume_time(dst_ts: TimeSeries, state: ConvertState, name: str, query_destination: bool = True) -> datetime:
+    """ determines the time after which rows are imported into the destination.
+    The last time in the destination is used when it can be queried, since it reflects what was actually written.
+    The high-water mark from the state is used when it can't, or when query_destination is False because the
+    destination times are transformed from the source times. When the destination holds less than the state
+    records, e.g. because it was cleared, the record of imported files is discarded so that they are read again.
     """
-    imports a stream to the database.
+    recorded = state.series(name)['high_water']
+    recorded = None if recorded is None else millis_to_datetime(recorded)
+    if not query_destination:
+        return recorded
+    try:
+        r = dst_ts.range()
+    except NotImplementedError:
+        return recorded
+    last = None if r is None else r[1]
+    if recorded is not None and (last is None or last < recorded):
+        state.record(name, clear_files=True)
+    return last
 
-    :param stream:  the stream to import
-    :type stream:
+
+def source_rows(src: TimeSeriesRepo, name: str, src_ts: TimeSeries, files: dict, since: datetime,
+                imported: list, stats: ConvertStats):
+    """ generates the source rows later than since.
+    When the source is made of log files, as with BeerlogJsonRepo, files recorded in the state with the same key
+    are not read, and each file read is appended to imported as a tuple of its path, its key and the latest time
+    read up to the end of the file.
     """
-    ts = db.timeSeries(name)
-    log = json.load(stream)
-    for data in brewpi_log_rows(log):
-        ts.insert_row(data)
+    if not hasattr(src, 'file_keys'):
+        yield from (src_ts.rows() if since is None else (r for r in src_ts.rows_between(since) if r[0] > since))
+        return
+    last = None
+    batch = getattr(src_ts, 'batch', None)
+    with batch() if batch else ExitStack():     # the range index is saved once, rather than after each file
+        for file_key, ts in zip(src.file_keys(name), src_ts.serieses):
+            path, *key = file_key()
+            if files.get(path) == key:
+                continue
+            if since is not None and ts.range_is_indexed():
+                r = ts.range()
+                if r is None or r[1] <= since:
+                    imported.append((path, key, last))
+                    continue
+            for r in (ts.rows() if since is None else (r for r in ts.rows_between(since) if r[0] > since)):
+                if last is None or r[0] > last:
+                    last = r[0]
+                yield r
+            stats.add(bytes=key[0] or 0)
+            imported.append((path, key, last))
+
 
+def convert_series(src: TimeSeriesRepo, dst: TimeSeriesRepo, name: str, state: ConvertState, chunk_size: int = 500,
+                   stats: ConvertStats = None, depth: int = 4, stages: list = (),
+                   query_destination: bool = True) -> int:
+    """ imports the rows of a series that are newer than the destination's high-water mark, passing them through
+    the stages.
+    Source files that were completely imported by an earlier run and have not changed since are not read. Without
+    stages, the high-water mark is saved after each chunk so that an interrupted conversion resumes where it
+    stopped; with stages, it is saved when the series is complete.
+    When resampling, the last interval is held back until a later run, since more rows may be added to it. The
+    high-water mark is then the last source row of the intervals written, so the next run reads the rows of the
+    held back interval again rather than writing a second, partial row for it.
+    The source is read and transformed on a separate thread, at most depth chunks ahead of the writes to the
+    destination.
+    :param stats:   when given, the rows, bytes and time taken are added to it
+    :param query_destination:   when False, the destination is not queried for its last time, and the rows are
+        imported after the high-water mark in the state. See resume_time.
+    :return: the number of rows imported
+    """
+    stats = stats or ConvertStats()
+    src_ts = src.fetch(name)
+    stages = [copy(s) for s in stages]
+    resample = max((i for i, s in enumerate(stages) if isinstance(s, Resample)), default=None)
+    if resample is not None:
+        stages[resample].hold_last = True
+    _, columns = apply_stages(iter(()), ts_columns, stages, chunk_size)
+    dst_ts = dst.create(name, columns)
+    since = resume_time(dst_ts, state, name, query_destination and not stages)
+    imported = []
+    read = [since]
 
-def stats(repo, name):
-    series = repo.fetch(name)
-    print('series "%s"\n' % name)
-    print('range %s\n' % (series.range(),))
-    print('datapoints %s\n' % len(list(series.rows())))
-    pass
+    def rows():
+        for r in source_rows(src, name, src_ts, state.series(name)['files'], since, imported, stats):
+            if read[0] is None or r[0] > read[0]:
+                read[0] = r[0]
+            yield r
+    chunks, _ = apply_stages(chunker(rows(), chunk_size), ts_columns, stages, chunk_size)
+    count = 0
+    written = since
+    for chunk in pipelined(chunks, depth, stats) if depth else chunks:
+        begin = time.monotonic()
+        dst_ts.append_bulk(chunk)
+        stats.add(rows=len(chunk), write=time.monotonic() - begin)
+        count += len(chunk)
+        last = max(r[0] for r in chunk)
+        if not stages and (written is None or last > written):
+            written = last
+            state.record(name, high_water=written)
+    high_water = read[0]
+    if resample is not None:
+        high_water = stages[resample].resume_time
+        for s in reversed(stages[:resample]):
+            high_water = None if high_water is None else s.input_time(high_water)
+        high_water = high_water or since
+    files = [(path, key) for path, key, last in imported
+             if last is None or (high_water is not None and last <= high_water)]
+    state.record(name, high_water=None if high_water == since else high_water, files=files)
+    return count
 
 
-def chunker(iterable, size):
+def convert(src: TimeSeriesRepo, dst: TimeSeriesRepo, names: list, state: ConvertState, workers: int = 1,
+            stats: ConvertStats = None, **kwargs):
+    """ converts several series, running up to workers series at once.
+    The rows of each series are written in time order by a single thread.
+    :return: a generator of (name, rows imported) pairs in the order of names, as each series completes
     """
-    >>> [x for x in chunker([1,2,3,4,5,6,7], 3)]
-    [[1, 2, 3], [4, 5, 6], [7]]
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+        futures = [executor.submit(convert_series, src, dst, name, state, stats=stats, **kwargs) for name in names]
+        for name, future in zip(names, futures):
+            yield name, future.result()
+
+
+def open_json_repo(location: str) -> BeerlogJsonRepo:
+    dir = fsopendir(abspath(location))
+    return BeerlogJsonRepo(dir, index=RangeIndex(dir))
+
+
+def open_influxdb_repo(location: str) -> InfluxDBTimeSeriesRepo:
+    """ opens an influxdb repo from a location of the form user:password@host:port/database.
+    The test database is used when no location is given.
     """
-    it = iter(iterable)
-    item = list(itertools.islice(it, size))
-    while item:
-        yield item
-        item = list(itertools.islice(it, size))
-
-
-def main():
-    if (len(sys.argv)) > 0:
-        dst = InfluxDBTimeSeriesRepo(*brewpi_test_influxdb_config)
-        dir = fsopendir(abspath(sys.argv[1]))
-        src = BeerlogJsonRepo(dir)
-
-        for name in sorted(src.names()):
-            print('converting %s ...' % name)
-            src_ts = src.fetch(name)
-            dst_ts = dst.fetch(name)
-
-            for i, row in enumerate(chunker(src_ts.rows(), 500)):
-                dst_ts.append_bulk(row)
-                if (i > 10):
-                    break
-
-            print('converting %s complete. Inserted %d rows into series %s. ' %
-                  (name, i, dst_ts.name))
+    if not location:
+        return InfluxDBTimeSeriesRepo(*brewpi_test_influxdb_config)
+    url = urlsplit('//' + location)
+    return InfluxDBTimeSeriesRepo(url.hostname, url.port or 8086, url.username, url.password, url.path.strip('/'))
+
+
+# callables opening a repo from a location, by repo type
+sources = {'json': open_json_repo, 'sqlite': SqliteTimeSeriesRepo, 'segments': SegmentTimeSeriesRepo}
+sinks = {'influxdb': open_influxdb_repo, 'sqlite': SqliteTimeSeriesRepo, 'segments': SegmentTimeSeriesRepo}
+# repo types whose location is a file or directory that must be given. An empty sqlite location is a temporary
+# database, so rows written to it would be silently lost.
+path_repo_types = ('sqlite', 'segments')
+
+
+def check_locations(parser: argparse.ArgumentParser, args):
+    """ fails with a usage error when the source or sink location of a repo type that needs a path is empty """
+    if args.source_type in path_repo_types and not args.source:
+        parser.error('a source location is required with --source-type %s' % args.source_type)
+    sink_type = getattr(args, 'sink_type', None)
+    if sink_type in path_repo_types and not args.sink:
+        parser.error('--sink is required with --sink-type %s' % sink_type)
+
+
+def parse_stages(args) -> list:
+    stages = []
+    if args.columns:
+        stages.append(Project(args.columns.split(',')))
+    if args.utc_offset is not None:
+        stages.append(ToUtc(timezone(timedelta(minutes=args.utc_offset))))
+    if args.dedup:
+        stages.append(Dedup(args.dedup))
+    if args.resample:
+        columns = args.columns.split(',') if args.columns else \
+            [c for c in ts_columns[1:] if c not in annotation_columns]
+        stages.append(Resample(timedelta(seconds=args.resample), {c: args.aggregate for c in columns}))
+    return stages
+
+
+def stats_main(args=None):
+    parser = argparse.ArgumentParser(prog='convert.py stats',
+                                     description='prints the statistics of each series, computed in a single pass.')
+    parser.add_argument('source', help='the location of the repo')
+    parser.add_argument('--source-type', choices=sorted(sources), default='json')
+    parser.add_argument('--series', action='append', help='the name of a series. Defaults to all series.')
+    parser.add_argument('--workers', type=int, default=0, help='the number of log files processed at once')
+    parser.add_argument('--gap', type=float, default=300, help='the interval in seconds counted as a gap')
+    parser.add_argument('--json', action='store_true', help='prints the statistics as json')
+    args = parser.parse_args(args)
+    check_locations(parser, args)
+
+    src = sources[args.source_type](args.source)
+    for name in args.series or sorted(src.names()):
+        if args.json:
+            result = series_stats(src.fetch(name), gap=timedelta(seconds=args.gap), workers=args.workers)
+            print(json.dumps({'series': name, 'stats': result.to_dict()}))
+        else:
+            stats(src, name, args.workers, gap=timedelta(seconds=args.gap))
+
+
+def main(args=None):
+    """ converts between repos, or with 'stats' as the first argument, prints the statistics of each series. """
+    args = sys.argv[1:] if args is None else args
+    if args[:1] == ['stats']:
+        return stats_main(args[1:])
+    parser = argparse.ArgumentParser(description='converts brewpi logs from one repo to another. Only rows newer '
+                                                 'than those already converted are sent.')
+    parser.add_argument('source', help='the location of the source repo. For json, the directory holding a '
+                                       'subdirectory of logs for each brew.')
+    parser.add_argument('--source-type', choices=sorted(sources), default='json')
+    parser.add_argument('--sink', default='', help='the location of the sink repo. Required for sqlite and segments '
+                                                   'sinks; defaults to the test database for influxdb.')
+    parser.add_argument('--sink-type', choices=sorted(sinks), default='influxdb')
+    parser.add_argument('--state', help='the file recording the progress of each series. Defaults to %s in the '
+                                        'source directory.' % default_state_file)
+    parser.add_argument('--full', action='store_true',
+                        help='imports all rows, ignoring the recorded progress and the rows already in the sink')
+    parser.add_argument('--workers', type=int, default=1, help='the number of series converted at once')
+    parser.add_argument('--report-interval', type=float, default=10,
+                        help='the interval in seconds between progress reports')
+    parser.add_argument('--columns', help='a comma separated list of the columns to keep')
+    parser.add_argument('--utc-offset', type=int, help='converts local times with this offset in minutes to UTC')
+    parser.add_argument('--dedup', choices=('first', 'last'), help='keeps one of the rows with the same time')
+    parser.add_argument('--resample', type=float, help='aggregates the rows into intervals of this many seconds')
+    parser.add_argument('--aggregate', default='mean', help='the aggregation used when resampling')
+    args = parser.parse_args(args)
+    check_locations(parser, args)
+
+    src = sources[args.source_type](args.source)
+    dst = sinks[args.sink_type](args.sink)
+    state_path = args.state or join(args.source if isdir(args.source) else dirname(args.source), default_state_file)
+    state = ConvertState(fsopendir(dirname(abspath(state_path))), basename(state_path))
+    if args.full:
+        state.entries = {}
+
+    stats = ConvertStats()
+    stop = Event()
+    Thread(target=report_progress, args=(stats, args.report_interval, stop), daemon=True).start()
+    try:
+        for name, count in convert(src, dst, sorted(src.names()), state, args.workers, stats,
+                                   stages=parse_stages(args), query_destination=not args.full):
+            print('converting %s complete. Inserted %d rows.' % (name, count))
+    finally:
+        stop.set()
+        close = getattr(dst, 'close', None)
+        if close:
+            close()
+    print('converted %s' % stats.report())
+
 
 if __name__ == '__main__':
     main()
@@ -1,23 +1,55 @@
 from brewpi.datalog.beerlog import ts_columns
 
 import influxdb as influxdb
+from influxdb.exceptions import InfluxDBClientError
+from influxdb.influxdb08.client import InfluxDBClientError as InfluxDB08ClientError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from brewpi.datalog.beerlog import TimeSeriesRepo, TimeSeries, select_columns
-from brewpi.datalog.time import uts_datetime_to_millis
+from itertools import takewhile
+from brewpi.datalog.beerlog import TimeSeriesRepo, TimeSeries, compile_projection
+from brewpi.datalog.time import uts_datetime_to_millis, datetime_to_millis
+from brewpi.datalog.batch import BatchWriter
+from brewpi.datalog.spool import Spool
 
 
 class InfluxDBTimeSeriesRepo:
     pass
 
 
+def is_missing_series(e: Exception) -> bool:
+    """ determines if an error from a query is the database reporting that the series does not exist yet.
+    >>> is_missing_series(InfluxDB08ClientError(b"Couldn't find series: abc", 400))
+    True
+    >>> is_missing_series(InfluxDB08ClientError(b"Error at 1: syntax error", 400))
+    False
+    """
+    return isinstance(e, (InfluxDBClientError, InfluxDB08ClientError)) and "Couldn't find series" in str(e)
+
+
+def check_not_future(millis: int):
+    """ raises ValueError if a time, in millis since the epoch, is later than the current time.
+    >>> check_not_future(0)
+    >>> check_not_future(datetime_to_millis(datetime(2100, 1, 1)))
+    Traceback (most recent call last):
+    ...
+    ValueError: cannot insert a time in the future
+    """
+    if millis > datetime_to_millis(datetime.utcnow()):
+        raise ValueError("cannot insert a time in the future")
+
+
 class InfluxDBTimeSeries(TimeSeries):
 
-    def __init__(self, repo: InfluxDBTimeSeriesRepo, name: str, cols: list):
+    def __init__(self, repo: InfluxDBTimeSeriesRepo, name: str, cols: list, page_size: int = 10000,
+                 read_ahead: bool = True):
         """
         Creates a local representation for a time series.
         :param repo:    the time series repo this is part of
         :param name:    the name of this series. Unique in the database.
         :param cols:    a list of column names for points in this series
+        :param page_size:   the number of points fetched by each query when reading rows
+        :param read_ahead:  when True, the next page is fetched in the background while the current page is consumed
 
         >>> ts = InfluxDBTimeSeries('db', 'abc', ['time', 'c1', 'c2'])
         >>> ts.repo
@@ -40,38 +72,103 @@ class InfluxDBTimeSeries(TimeSeries):
         self.name = name
         self.cols = cols
         self.select_cols = ','.join(cols[1:])
+        self.page_size = page_size
+        self.read_ahead = read_ahead
+        self.writer = None
 
     def range(self) -> (datetime, datetime):
-        return time_of(self.first_datapoint()), time_of(self.latest_datapoint())
+        first = self.first_datapoint()
+        return None if first is None else (first[0], self.latest_datapoint()[0])
 
     def _query_to_rows(self, qr):
         """ Converts a query result to rows
         """
-        columns = qr['columns']
+        project = compile_projection(qr['columns'], self.cols)
         datapoints = self._datapoints(qr)
         for dp in datapoints:
-            dp = select_columns(dp, columns, self.cols)
-            row = datapoint_to_row(dp)
+            row = datapoint_to_row(project(dp))
             yield row
 
     def rows(self):
-        qr = self._query(
-            "select %(select_cols)s from %(name)s where time < now()+24h order asc")
-        yield from self._query_to_rows(qr[0])
+        return self.rows_between()
 
-    def _create_bulk_request(self, bulkdata: list)->dict:
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        """ pages through the rows in the window in time order, so only one page (plus the page being read ahead)
+         is held in memory regardless of the length of the series.
+        """
+        start = None if start is None else uts_datetime_to_millis(start)
+        end = None if end is None else uts_datetime_to_millis(end)
+        for qr in self._pages(start, end):
+            yield from self._query_to_rows(qr)
+
+    def _page_query(self, cursor: int, end: int, limit: int) -> str:
+        """ builds the query for a page of points with cursor <= time < end. Times are in millis.
+        >>> InfluxDBTimeSeries(None, 'abc', ['time', 'c1'])._page_query(1000, None, 10)
+        'select c1 from abc where time >= 1000000u and time < now()+24h order asc limit 10'
+        """
+        where = [] if cursor is None else ['time >= %du' % (cursor * 1000)]
+        where.append('time < now()+24h' if end is None else 'time < %du' % (end * 1000))
+        return self._prepare_query('select %(select_cols)s from %(name)s') + \
+            ' where %s order asc limit %d' % (' and '.join(where), limit)
+
+    def _pages(self, start: int, end: int):
+        """ generates query results for successive pages of points.
+        Each page starts at the time of the last point of the previous page, so that points sharing that time are
+        not lost, and the points already returned at that time are skipped.
+        """
+        executor = ThreadPoolExecutor(1) if self.read_ahead else None
+
+        def fetch(cursor, limit):
+            q = self._page_query(cursor, end, limit)
+            return executor.submit(self.repo.query, q) if executor else _Done(self.repo.query(q))
+
+        try:
+            cursor, skip, limit = start, 0, self.page_size
+            page = fetch(cursor, limit)
+            while page is not None:
+                result = page.result()
+                if not result:
+                    return
+                qr = result[0]
+                points = self._datapoints(qr)
+                page, seen = None, skip
+                if len(points) >= limit:
+                    ti = qr['columns'].index('time')
+                    last = points[-1][ti]
+                    if last == cursor:
+                        limit *= 2      # the whole page was at one time - fetch a larger page to make progress
+                    cursor = last
+                    skip = sum(1 for _ in takewhile(lambda p: p[ti] == last, reversed(points)))
+                    page = fetch(cursor, limit)
+                qr['points'] = points[seen:]
+                yield qr
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
+    def _create_bulk_request(self, bulkdata: list) -> dict:
         """ Converts a list of rows into a json request containing multiple datapoints.
+        The time of each row may be a datetime or millis since the epoch. The times are converted in one pass,
+        and checked against the current time once for the whole batch.
         >>> d = InfluxDBTimeSeries(None,"abc", ['time','col1','col2']). \
-            _create_bulk_request([ [datetime(1970,1,2,0,0,0), 1, 2] ])
+            _create_bulk_request([ [datetime(1970,1,2,0,0,0), 1, 2], [86400001, 3, 4] ])
         >>> list(sorted(d.items()))       # ensure order doesn't change
-        [('columns', ['time', 'col1', 'col2']), ('name', 'abc'), ('points', [[86400000, 1, 2]])]
+        [('columns', ['time', 'col1', 'col2']), ('name', 'abc'), ('points', [[86400000, 1, 2], [86400001, 3, 4]])]
+        >>> InfluxDBTimeSeries(None,"abc", ['time'])._create_bulk_request([[datetime(2100, 1, 1)]])
+        Traceback (most recent call last):
+        ...
+        ValueError: cannot insert a time in the future
         """
         bulk_request = self._build_json_request()
-        for data in bulkdata:
-            if datetime.utcnow() < data[0]:
-                raise ValueError("cannot insert a time in the future")
-            dp = self._row_to_datapoint(data)
-            self._append_datapoint(bulk_request, dp)
+        if not bulkdata:
+            return bulk_request
+        millis = [datetime_to_millis(data[0]) for data in bulkdata]
+        check_not_future(max(millis))
+        points = self._datapoints(bulk_request)
+        for time_millis, data in zip(millis, bulkdata):
+            dp = list(data)
+            dp[0] = time_millis
+            points.append(dp)
         return bulk_request
 
     def _row_to_datapoint(self, data):
@@ -79,29 +176,67 @@ class InfluxDBTimeSeries(TimeSeries):
         >>> InfluxDBTimeSeries(None,"", ["time"])._row_to_datapoint([datetime(1970,1,2,0,0,0), 1, 2])
         [86400000, 1, 2]
         """
-        time_millis = uts_datetime_to_millis(data[0])
-        values = [time_millis]
-        values.extend(data[1:])
-        return values
+        dp = list(data)
+        dp[0] = datetime_to_millis(data[0])
+        return dp
 
     def append(self, data: list):
-        self.append_bulk([data])
+        """ appends a row. When a writer has been started, the row is queued and written in the background.
+        >>> ts = InfluxDBTimeSeries(None, 'abc', ['time', 'c1'])
+        >>> ts.append([datetime(2100, 1, 1), 1])
+        Traceback (most recent call last):
+        ...
+        ValueError: cannot insert a time in the future
+        """
+        if self.writer is None:
+            self.append_bulk([data])
+        else:
+            check_not_future(datetime_to_millis(data[0]))
+            self.writer.put(data)
+
+    def start_writer(self, **kwargs) -> BatchWriter:
+        """ starts writing appended rows asynchronously. Rows are queued, and written in batches by a background
+        thread. The keyword arguments are passed to BatchWriter, which controls the batch size and age, and the
+        queue size. The writer's stats() gives the number of rows queued, written and dropped.
+        """
+        if self.writer is None:
+            self.writer = BatchWriter(self.append_bulk, **kwargs)
+        return self.writer
+
+    def flush(self):
+        """ waits until all appended rows have been written """
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """ writes all appended rows and stops the background writer, if one was started """
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            finally:
+                self.writer = None
 
     def append_bulk(self, bulkdata: list):
         bulk_request = self._create_bulk_request(bulkdata)
         self.repo.insert(bulk_request)
 
     def latest_datapoint(self):
-        """fetches the time of the latest datapoint"""
+        """fetches the latest datapoint as a row, or None if the series is empty"""
         return self.as_row(self._query('select time from %(name)s limit 1'))
 
     def first_datapoint(self):
-        """fetches the time of the first datapoint"""
+        """fetches the first datapoint as a row, or None if the series is empty"""
         return self.as_row(self._query('select time from %(name)s order asc limit 1'))
 
-    def as_row(self, qr):
-        """extracts the first row from the query result"""
-        return self.extract_row(qr, 0)
+    def as_row(self, result):
+        """extracts the first row from the query result, or None if there are no points
+        >>> ts = InfluxDBTimeSeries(None, 'abc', ['time'])
+        >>> ts.as_row([{'columns': ['time'], 'points': [[86400000]]}]), ts.as_row([])
+        ([datetime.datetime(1970, 1, 2, 0, 0)], None)
+        """
+        if not result or not self._datapoints(result[0]):
+            return None
+        return self.extract_row(result[0], 0)
 
     def extract_row(self, qr, index):
         datapoint = self._datapoints(qr)[index]
@@ -137,8 +272,14 @@ class InfluxDBTimeSeries(TimeSeries):
         return q % self.__dict__  # noqa: H501
 
     def _query(self, q):
+        """ runs a query on this series. A series that does not exist yet has no points. """
         qy = self._prepare_query(q)
-        return self.repo.query(qy)
+        try:
+            return self.repo.query(qy)
+        except (InfluxDBClientError, InfluxDB08ClientError) as e:
+            if is_missing_series(e):
+                return []
+            raise
 
 
 class InfluxDBTimeSeriesRepo(TimeSeriesRepo):
@@ -148,6 +289,8 @@ class InfluxDBTimeSeriesRepo(TimeSeriesRepo):
 
     def __init__(self, host, port, user, pwd, dbname):
         self.db = influxdb.InfluxDBClient(host, port, user, pwd, dbname)
+        self.writer = None
+        self.spool = None
 
     def fetch(self, name) -> InfluxDBTimeSeries:
         """
@@ -156,8 +299,10 @@ class InfluxDBTimeSeriesRepo(TimeSeriesRepo):
         name = sanitize(name)
         return InfluxDBTimeSeries(self, name, ts_columns)
 
-    def create(self, name) -> InfluxDBTimeSeries:
-        return self.fetch(name)
+    def create(self, name, columns: list = None) -> InfluxDBTimeSeries:
+        if columns is None:
+            return self.fetch(name)
+        return InfluxDBTimeSeries(self, sanitize(name), columns)
 
     def names(self) -> list:
         """
@@ -171,12 +316,99 @@ class InfluxDBTimeSeriesRepo(TimeSeriesRepo):
         return self.db.query(q, 'm', chunked=False)
 
     def insert(self, request):
-        self.db.write_points_with_precision([request], 'm')
+        """ writes a request for a single series. When a spool has been started, the request is journaled to disk
+        and written in the background. Otherwise, when a writer has been started, the request is buffered and
+        written together with requests for other series.
+        """
+        if self.spool is not None:
+            self.spool.append(request)
+        elif self.writer is None:
+            self.db.write_points_with_precision([request], 'm')
+        else:
+            self.writer.put(request)
+
+    def start_writer(self, max_points: int = 5000, max_age: float = 1.0, **kwargs) -> BatchWriter:
+        """ starts buffering inserts from all series in this repo, so that pending points for many series are
+        written in a single request.
+        :param max_points:  the number of buffered points that triggers a write
+        :param max_age: the maximum time in seconds a point is buffered before being written
+        The remaining keyword arguments are passed to BatchWriter.
+        """
+        if self.writer is None:
+            self.writer = BatchWriter(self._write_requests, max_points, max_age,
+                                      weigh=lambda r: len(r['points']), **kwargs)
+        return self.writer
+
+    def start_spool(self, directory: str, **kwargs) -> Spool:
+        """ starts journaling inserts to a spool on disk before writing them, so that inserts made while the
+        database is unreachable are kept and written once it is available again. Inserts left in the spool
+        by a previous run are written too.
+        :param directory:   the directory holding the spool segments
+        The remaining keyword arguments are passed to Spool.
+        """
+        if self.spool is None:
+            self.spool = Spool(directory, self._write_requests, **kwargs)
+        return self.spool
+
+    def flush(self, timeout: float = None):
+        """ waits until all buffered and spooled inserts have been written """
+        if self.writer is not None:
+            self.writer.flush()
+        if self.spool is not None:
+            self.spool.flush(timeout)
+
+    def close(self, timeout: float = None):
+        """ writes all buffered inserts and stops the writer and spool, if they were started.
+        :param timeout: the maximum time to wait for spooled inserts to be written. Those not written remain in the
+            spool for the next run.
+        """
+        try:
+            if self.writer is not None:
+                try:
+                    self.writer.close()
+                finally:
+                    self.writer = None
+        finally:
+            if self.spool is not None:
+                self.spool.close(timeout)
+                self.spool = None
+
+    def _write_requests(self, requests: list):
+        self.db.write_points_with_precision(merge_requests(requests), 'm')
 
     def delete(self, name):
         self.db.delete_points(name)
 
 
+def merge_requests(requests: list) -> list:
+    """ combines requests for the same series and columns into one, keeping the points in order.
+    >>> m = merge_requests([{'name': 'a', 'columns': ['time'], 'points': [[1]]},
+    ...                     {'name': 'b', 'columns': ['time'], 'points': [[2]]},
+    ...                     {'name': 'a', 'columns': ['time'], 'points': [[3]]}])
+    >>> [(r['name'], r['points']) for r in m]
+    [('a', [[1], [3]]), ('b', [[2]])]
+    """
+    merged = OrderedDict()
+    for r in requests:
+        key = (r['name'], tuple(r['columns']))
+        m = merged.get(key)
+        if m is None:
+            merged[key] = {'name': r['name'], 'columns': r['columns'], 'points': list(r['points'])}
+        else:
+            m['points'].extend(r['points'])
+    return list(merged.values())
+
+
+class _Done:
+    """ an already completed result, used in place of a future when not reading ahead """
+
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+
 def datapoint_to_row(datapoint: list):
     """  Converts a datapoint retrieved from the database to a row, as expected by TimeSeries callers.
     >>> datapoint_to_row([86400000, 'abc', 'def'])
@@ -1,7 +1,17 @@
 import os
+import re
+import shutil
+import tempfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
 from unittest.mock import Mock
 
-from brewpi.datalog.influxdb.db import InfluxDBTimeSeriesRepo
+import influxdb.influxdb08
+import simplejson as json
+
+from brewpi.datalog.influxdb.db import InfluxDBTimeSeriesRepo, InfluxDBTimeSeries
+from brewpi.datalog.beerlog import ts_columns
+from brewpi.datalog.time import datetime_to_millis
 
 import unittest
 
@@ -76,5 +86,197 @@ class InfluxDBTimeSeriesRepoTest(unittest.TestCase):
         return test_repo.create(name)
 
 
+class FakePagedRepo:
+    """ answers the paged queries made by InfluxDBTimeSeries from a list of points in time order """
+
+    def __init__(self, points):
+        self.points = points
+        self.queries = []
+
+    def query(self, q):
+        self.queries.append(q)
+        start = re.search(r'time >= (\d+)u', q)
+        start = int(start.group(1)) // 1000 if start else 0
+        limit = int(re.search(r'limit (\d+)', q).group(1))
+        points = [list(p) for p in self.points if p[0] >= start][:limit]
+        return [{'name': 'abc', 'columns': ['time', 'sequence_number', 'c1'], 'points': points}]
+
+
+class InfluxDBTimeSeriesPagingTest(unittest.TestCase):
+
+    def rows(self, points, page_size, read_ahead=True):
+        repo = FakePagedRepo(points)
+        ts = InfluxDBTimeSeries(repo, 'abc', ['time', 'c1'], page_size, read_ahead)
+        return [[int((r[0] - datetime(1970, 1, 1)).total_seconds() * 1000), r[1]] for r in ts.rows()], repo
+
+    def test_rows_are_paged(self):
+        points = [[i * 1000, i, 'v%d' % i] for i in range(10)]
+        for read_ahead in (True, False):
+            rows, repo = self.rows(points, 3, read_ahead)
+            assert_that(rows, is_(equal_to([[p[0], p[2]] for p in points])))
+            # each page after the first starts with the last point of the previous page
+            assert_that(len(repo.queries), is_(5))
+
+    def test_points_with_same_time_span_pages(self):
+        points = [[1000, 1, 'a'], [2000, 2, 'b'], [2000, 3, 'c'], [2000, 4, 'd'], [2000, 5, 'e'], [3000, 6, 'f']]
+        rows, _ = self.rows(points, 2)
+        assert_that([r[1] for r in rows], is_(equal_to(list('abcdef'))))
+
+    def test_empty_series(self):
+        rows, _ = self.rows([], 3)
+        assert_that(rows, is_(equal_to([])))
+
+
+class InfluxDBTimeSeriesMissingTest(unittest.TestCase):
+    """ verifies that a series the database doesn't know yet is empty, using a mock repo """
+
+    def test_missing_series_has_no_range(self):
+        repo = Mock()
+        repo.query.side_effect = influxdb.influxdb08.client.InfluxDBClientError(b"Couldn't find series: abc", 400)
+        assert_that(InfluxDBTimeSeries(repo, 'abc', ts_columns).range(), is_(None))
+
+    def test_other_query_errors_raised(self):
+        repo = Mock()
+        repo.query.side_effect = influxdb.influxdb08.client.InfluxDBClientError(b"Invalid database name", 400)
+        with self.assertRaises(influxdb.influxdb08.client.InfluxDBClientError):
+            InfluxDBTimeSeries(repo, 'abc', ts_columns).range()
+
+
+class InfluxDBTimeSeriesWriterTest(unittest.TestCase):
+    """ verifies the background writer using a mock repo, so no database is needed """
+
+    def test_appends_are_batched(self):
+        repo = Mock()
+        ts = InfluxDBTimeSeries(repo, 'abc', ts_columns)
+        writer = ts.start_writer(max_batch=2, max_age=60)
+        for d in (d1, d2, d1):
+            ts.append(d)
+        ts.flush()
+        assert_that(repo.insert.mock_calls, has_length(2))
+        assert_that(repo.insert.mock_calls[0][1][0]['points'], has_length(2))
+        ts.close()
+        assert_that(writer.stats(), is_(equal_to({'queued': 0, 'written': 3, 'dropped': 0})))
+        assert_that(ts.writer, is_(None))
+
+    def test_rows_timed_in_millis_appended(self):
+        repo = Mock()
+        ts = InfluxDBTimeSeries(repo, 'abc', ['time', 'c1'])
+        ts.start_writer(max_batch=2, max_age=60)
+        ts.append([86400000, 1])
+        ts.append([datetime(1970, 1, 2, 0, 0, 1), 2])
+        ts.flush()
+        assert_that(repo.insert.mock_calls[0][1][0]['points'], is_(equal_to([[86400000, 1], [86401000, 2]])))
+        self.assertRaises(ValueError, ts.append, [datetime_to_millis(datetime(2100, 1, 1)), 3])
+        ts.close()
+
+
+class InfluxDBTimeSeriesRepoWriterTest(unittest.TestCase):
+    """ verifies the repo level write buffer using a mock client """
+
+    def test_points_for_many_series_written_together(self):
+        repo = InfluxDBTimeSeriesRepo(*brewpi.datalog.convert.brewpi_test_influxdb_config)
+        repo.db = Mock()
+        writer = repo.start_writer(max_points=100, max_age=60)
+        serieses = [repo.fetch('chamber %d' % i) for i in range(5)]
+        for s in serieses:
+            s.append_bulk([d1, d2])
+        serieses[0].append(d2)
+        repo.close()
+        assert_that(repo.db.write_points_with_precision.mock_calls, has_length(1))
+        payload = repo.db.write_points_with_precision.mock_calls[0][1][0]
+        assert_that([r['name'] for r in payload], is_(equal_to([s.name for s in serieses])))
+        assert_that(payload[0]['points'], has_length(3))
+        assert_that(writer.stats(), is_(equal_to({'queued': 0, 'written': 11, 'dropped': 0})))
+
+    def test_write_when_max_points_reached(self):
+        repo = InfluxDBTimeSeriesRepo(*brewpi.datalog.convert.brewpi_test_influxdb_config)
+        repo.db = Mock()
+        repo.start_writer(max_points=4, max_age=60)
+        for i in range(4):
+            repo.fetch('chamber %d' % i).append_bulk([d1, d2])
+        repo.close()
+        assert_that(repo.db.write_points_with_precision.mock_calls, has_length(2))
+
+
+class FakeInfluxDBServer(HTTPServer):
+    """ a local http server accepting 0.8 style writes, which can be taken offline """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeInfluxDBHandler)
+        self.online = True
+        self.requests = []
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeInfluxDBHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.online:
+            self.server.requests.append(json.loads(body.decode('utf-8')))
+        self.send_response(200 if self.server.online else 500)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class InfluxDBTimeSeriesRepoSpoolTest(unittest.TestCase):
+    """ verifies the repo spool against a local fake server """
+
+    def setUp(self):
+        self.server = FakeInfluxDBServer()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def repo(self):
+        repo = InfluxDBTimeSeriesRepo(*brewpi.datalog.convert.brewpi_test_influxdb_config)
+        repo.db = influxdb.influxdb08.InfluxDBClient('127.0.0.1', self.server.server_port, 'u', 'p', 'db')
+        repo.start_spool(self.dir, retry_interval=0.01)
+        return repo
+
+    def written_points(self):
+        return [p for r in self.server.requests for s in r for p in s['points']]
+
+    def test_inserts_written_through_spool(self):
+        repo = self.repo()
+        repo.fetch('chamber').append_bulk([d1, d2])
+        repo.close(5)
+        assert_that(self.written_points(), has_length(2))
+
+    def test_inserts_during_outage_written_when_online(self):
+        self.server.online = False
+        repo = self.repo()
+        ts = repo.fetch('chamber')
+        ts.append_bulk([d1])
+        ts.append_bulk([d2])
+        repo.flush(0.2)
+        assert_that(self.server.requests, is_(equal_to([])))
+        self.server.online = True
+        repo.flush(5)
+        assert_that([p[0] for p in self.written_points()], is_(equal_to([
+            ts._row_to_datapoint(d1)[0], ts._row_to_datapoint(d2)[0]])))
+        repo.close()
+
+    def test_spooled_inserts_written_after_restart(self):
+        self.server.online = False
+        repo = self.repo()
+        repo.fetch('chamber').append_bulk([d1, d2])
+        repo.close(0)
+        self.server.online = True
+        repo = self.repo()
+        repo.close(5)
+        assert_that(self.written_points(), has_length(2))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,174 @@
+"""
+An incremental reader for large json documents. Rather than decoding the whole document in one go, values are decoded
+one at a time as the document is read in chunks, so memory use is bounded by the size of the largest single value
+rather than the size of the document.
+"""
+import codecs
+import simplejson as json
+
+__author__ = 'mat'
+
+default_chunk_size = 64 * 1024
+default_max_value_size = 64 * 1024 * 1024
+
+
+class JsonStream:
+    """
+    Tokenizes a json document read from a file-like object.
+    Containers can be walked item by item with object_keys() and array_items(), while leaf values (or whole
+    sub-documents) are decoded with value().
+
+    >>> import io
+    >>> s = JsonStream(io.StringIO('{"a": [1, 2, {"b": null}], "c": "d"}'), 4)
+    >>> for k in s.object_keys():
+    ...     print(k, list(s.array_items()) if k == 'a' else s.value())
+    a [1, 2, {'b': None}]
+    c d
+    """
+
+    def __init__(self, file, chunk_size: int = default_chunk_size, max_value_size: int = default_max_value_size):
+        """
+        :param file:    the file to read, in text or binary mode
+        :param chunk_size:  the number of characters or bytes read at a time
+        :param max_value_size:  the most characters of a single value decoded by value(). Reading a larger value,
+            or malformed input, raises ValueError rather than buffering the rest of the file.
+        """
+        self.file = file
+        self.chunk_size = chunk_size
+        self.max_value_size = max_value_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.bytes_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def _fill(self) -> bool:
+        """ reads the next chunk from the file into the buffer.
+        :return: False if the end of the file has been reached
+        """
+        if self.eof:
+            return False
+        data = self.file.read(self.chunk_size)
+        if isinstance(data, bytes):
+            data = self.bytes_decoder.decode(data, not data)
+        if not data:
+            self.eof = True
+            return False
+        # discard the consumed part of the buffer so memory is bounded by the current value
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """ skips whitespace and returns the next character without consuming it, or '' at the end of the file.
+        >>> import io
+        >>> JsonStream(io.StringIO('  [')).peek()
+        '['
+        >>> JsonStream(io.StringIO(' ')).peek()
+        ''
+        """
+        while True:
+            buf, pos = self.buf, self.pos
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            self.pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, c: str):
+        """ consumes the next non-whitespace character, which must be c.
+        >>> import io
+        >>> JsonStream(io.StringIO('[')).expect(']')
+        Traceback (most recent call last):
+        ...
+        ValueError: expected ']' at offset 0 but found '['
+        """
+        found = self.peek()
+        if found != c:
+            raise ValueError("expected %r at offset %d but found %r" % (c, self.pos, found))
+        self.pos += 1
+
+    def value(self):
+        """ decodes the next complete json value.
+        A value that is cut off at the end of the buffer is decoded again once the buffered text has doubled, so a
+        value read in many chunks is decoded a few times rather than once per chunk.
+        >>> import io
+        >>> s = JsonStream(io.StringIO('12345 "abc"'), 2)
+        >>> s.value(), s.value()
+        (12345, 'abc')
+        >>> JsonStream(io.StringIO('["abc", "de'), 2, max_value_size=8).value()
+        Traceback (most recent call last):
+        ...
+        ValueError: json value is longer than 8 characters
+        """
+        self.peek()
+        attempt = 0     # the buffered length at which the value is next decoded
+        while True:
+            size = len(self.buf) - self.pos
+            if size >= attempt or self.eof:
+                try:
+                    result, end = self.decoder.raw_decode(self.buf, self.pos)
+                    # a value ending at the end of the buffer may be truncated, e.g. a number
+                    if end < len(self.buf) or self.eof:
+                        self.pos = end
+                        return result
+                except json.JSONDecodeError:
+                    if self.eof:
+                        raise
+                    attempt = 2 * size
+            if size > self.max_value_size:
+                raise ValueError('json value is longer than %d characters' % self.max_value_size)
+            self._fill()
+
+    def skip_value(self):
+        """ skips over the next value. Containers are skipped item by item so they are never held in memory. """
+        c = self.peek()
+        if c == '{':
+            for _ in self.object_keys():
+                self.skip_value()
+        elif c == '[':
+            for _ in self.array_items(self.skip_value):
+                pass
+        else:
+            self.value()
+
+    def array_items(self, decode: callable = None):
+        """ generates the items in the next array, each decoded as it is reached.
+        :param decode:  the function used to consume each item. Defaults to value()
+        >>> import io
+        >>> list(JsonStream(io.StringIO(' [ ] ')).array_items())
+        []
+        """
+        decode = decode or self.value
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield decode()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def object_keys(self):
+        """ generates the keys of the next object. The caller must consume the value for each key (e.g. with value(),
+        array_items() or skip_value()) before requesting the next key.
+        >>> import io
+        >>> list(JsonStream(io.StringIO('{}')).object_keys())
+        []
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            self.expect(',')
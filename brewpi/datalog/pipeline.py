@@ -0,0 +1,289 @@
+"""
+Stages that transform rows on their way from a source time series to a sink, such as when converting between
+repos. Rows are handed from stage to stage in batches (lists of rows), and each stage is a generator, so a chain of
+stages streams the rows in a single pass with only a few batches in memory.
+"""
+import itertools
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone, tzinfo
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+
+from brewpi.datalog.beerlog import ResampledTimeSeries, compile_projection
+
+__author__ = 'mat'
+
+
+def chunker(iterable, size, max_delay: float = None):
+    """
+    >>> [x for x in chunker([1,2,3,4,5,6,7], 3)]
+    [[1, 2, 3], [4, 5, 6], [7]]
+
+    :param max_delay:   when given, a chunk also ends once this many seconds have passed since its first item was
+        produced, even while waiting for the next item, so items from a slow source are not held back. The items are
+        then produced on a background thread, at most size items ahead of the consumer.
+    >>> def slow():
+    ...     yield 1
+    ...     yield 2
+    ...     time.sleep(0.5)
+    ...     yield 3
+    >>> [x for x in chunker(slow(), 10, 0.1)]
+    [[1, 2], [3]]
+    """
+    it = iter(iterable)
+    if max_delay is not None:
+        yield from _timed_chunks(it, size, max_delay)
+        return
+    item = list(itertools.islice(it, size))
+    while item:
+        yield item
+        item = list(itertools.islice(it, size))
+
+
+# given by a background reader once the items run out
+exhausted = object()
+
+
+@contextmanager
+def background_reader(iterable, depth: int, name: str, timing: callable = None):
+    """ produces the items of an iterable on a background thread, holding at most depth items ahead of the consumer.
+    Gives a function taking the next item, which waits at most timeout seconds, raising queue.Empty when none
+    arrives, or without a timeout, until an item arrives. The function returns exhausted once the iterable ends, and
+    raises any exception raised by the iterable. The thread is stopped when the context exits.
+    :param name:    the name of the thread
+    :param timing:  when given, called with the time in seconds taken to produce each item
+    >>> with background_reader(range(3), 2, 'example') as get:
+    ...     get(), get(), get(), get() is exhausted
+    (0, 1, 2, True)
+    """
+    queue = Queue(depth)
+    stopped = Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        it = iter(iterable)
+        try:
+            while True:
+                begin = time.monotonic()
+                item = next(it, exhausted)
+                if timing is not None:
+                    timing(time.monotonic() - begin)
+                if not put(item) or item is exhausted:
+                    return
+        except BaseException as e:
+            put(e)
+
+    def get(timeout: float = None):
+        item = queue.get(timeout=timeout)
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    producer = Thread(target=produce, name=name, daemon=True)
+    producer.start()
+    try:
+        yield get
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def _timed_chunks(it, size, max_delay: float):
+    with background_reader(it, size, 'chunker') as get:
+        chunk = []
+        deadline = None
+        while True:
+            try:
+                item = get(max(0.0, deadline - time.monotonic()) if chunk else None)
+            except Empty:
+                yield chunk
+                chunk = []
+                continue
+            if item is exhausted:
+                break
+            if not chunk:
+                deadline = time.monotonic() + max_delay
+            chunk.append(item)
+            if len(chunk) >= size or time.monotonic() >= deadline:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class Stage:
+    """
+    A transform applied to batches of rows. The first column of each row is the time.
+    """
+
+    def apply(self, batches, columns: list, size: int):
+        """ applies the stage to a stream of batches.
+        :param batches: an iterator of lists of rows, in ascending time order
+        :param columns: the column names of the input rows
+        :param size:    the preferred number of rows in each output batch, for stages that regroup rows
+        :return: a tuple of the iterator of output batches and the column names of the output rows
+        """
+        raise NotImplementedError
+
+    def input_time(self, t: datetime) -> datetime:
+        """ the time of the input row that became an output row with time t. Stages that change times override
+        this, so that a time in the output can be traced back to the source.
+        """
+        return t
+
+
+class Project(Stage):
+    """
+    Selects columns by name. The time column is always kept as the first column.
+    >>> batches, columns = Project(['fridgeTemp', 'beerTemp']).apply([[[1, 20, 10, 5]]], ['time', 'beerTemp', 'beerSet',
+    ...                                                               'fridgeTemp'], 100)
+    >>> columns, list(batches)
+    (['time', 'fridgeTemp', 'beerTemp'], [[[1, 5, 20]]])
+    """
+
+    def __init__(self, columns: list):
+        self.columns = columns
+
+    def apply(self, batches, columns: list, size: int):
+        wanted = [columns[0]] + [c for c in self.columns if c.lower() != columns[0].lower()]
+        project = compile_projection(columns, wanted)
+        return ([project(r) for r in batch] for batch in batches), wanted
+
+
+class Resample(Stage):
+    """
+    Aggregates the rows into fixed intervals. See ResampledTimeSeries.
+    When hold_last is True, the last interval is not output, since more rows may be added to it later. A later run
+    that reads the rows after resume_time outputs it once it is complete. An instance holds the state of one
+    application, so copy it to apply it to several streams.
+    >>> t = datetime(2016, 1, 1, 12, 0)
+    >>> rows = [[t + timedelta(seconds=s), s] for s in range(0, 180, 20)]
+    >>> batches, columns = Resample(timedelta(minutes=1), {'beerTemp': 'max'}).apply([rows[:4], rows[4:]],
+    ...                                                                            ['time', 'beerTemp'], 2)
+    >>> columns, [[r[1] for r in batch] for batch in batches]
+    (['time', 'beerTemp_max'], [[40, 100], [160]])
+    >>> r = Resample(timedelta(minutes=1), {'beerTemp': 'max'}, hold_last=True)
+    >>> batches, _ = r.apply([rows], ['time', 'beerTemp'], 10)
+    >>> [[row[1] for row in batch] for batch in batches], r.resume_time == t + timedelta(seconds=100)
+    ([[40, 100]], True)
+    """
+
+    def __init__(self, interval: timedelta, aggregations: dict, hold_last: bool = False):
+        self.interval = interval
+        self.aggregations = aggregations
+        self.hold_last = hold_last
+        self.resume_time = None     # the time of the last input row in an interval that has been output
+
+    def apply(self, batches, columns: list, size: int):
+        resampler = ResampledTimeSeries(None, self.interval, self.aggregations, columns)
+        rows = itertools.chain.from_iterable(batches)
+        resampled = self._hold_last(resampler, rows) if self.hold_last else resampler._resample(rows)
+        return chunker(resampled, size), resampler.columns
+
+    def _hold_last(self, resampler: ResampledTimeSeries, rows):
+        times = [None, None]    # the times of the input rows before and at the one being read
+
+        def track():
+            for r in rows:
+                times[0], times[1] = times[1], r[0]
+                yield r
+        held = None
+        # an interval is output when the first row of the next one is read, so the row before ends the interval
+        for r in resampler._resample(track()):
+            if held is not None:
+                self.resume_time = held[1]
+                yield held[0]
+            held = r, times[0]
+
+
+class ToUtc(Stage):
+    """
+    Normalises times to naive datetimes in UTC. Times with a timezone are converted to UTC, and naive times are
+    taken to be in the given timezone, or left unchanged when it is None.
+    >>> batches, _ = ToUtc(timezone(timedelta(hours=2))).apply([[[datetime(2016, 1, 1, 12), 1]]], ['time', 'a'], 10)
+    >>> list(batches)
+    [[[datetime.datetime(2016, 1, 1, 10, 0), 1]]]
+    """
+
+    def __init__(self, tz: tzinfo = None):
+        self.tz = tz
+
+    def input_time(self, t: datetime) -> datetime:
+        """ the local time of a UTC time, for a fixed offset timezone
+        >>> ToUtc(timezone(timedelta(hours=2))).input_time(datetime(2016, 1, 1, 10))
+        datetime.datetime(2016, 1, 1, 12, 0)
+        """
+        return t if self.tz is None else t + self.tz.utcoffset(t)
+
+    def utc(self, t: datetime) -> datetime:
+        if t.tzinfo is None:
+            if self.tz is None:
+                return t
+            t = t.replace(tzinfo=self.tz)
+        return t.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def apply(self, batches, columns: list, size: int):
+        utc = self.utc
+        return ([[utc(r[0])] + r[1:] for r in batch] for batch in batches), columns
+
+
+class Dedup(Stage):
+    """
+    Removes rows with the same time as the previous row, keeping the first or the last of them.
+    >>> batches = [[[1, 'a'], [2, 'b']], [[2, 'c'], [3, 'd']]]
+    >>> [list(b) for b in Dedup().apply(batches, ['time', 'x'], 10)[0]]
+    [[[1, 'a'], [2, 'b']], [[3, 'd']]]
+    >>> [list(b) for b in Dedup('last').apply(batches, ['time', 'x'], 10)[0]]
+    [[[1, 'a']], [[2, 'c']], [[3, 'd']]]
+    """
+
+    def __init__(self, keep: str = 'first'):
+        if keep not in ('first', 'last'):
+            raise ValueError('unknown duplicate policy %s' % keep)
+        self.keep = keep
+
+    def apply(self, batches, columns: list, size: int):
+        return (self._last(batches) if self.keep == 'last' else self._first(batches)), columns
+
+    @staticmethod
+    def _first(batches):
+        previous = None
+        for batch in batches:
+            out = []
+            for r in batch:
+                if previous is None or r[0] != previous:
+                    out.append(r)
+                    previous = r[0]
+            if out:
+                yield out
+
+    @staticmethod
+    def _last(batches):
+        # the last row of each batch is held back until a row with a later time is seen
+        pending = None
+        for batch in batches:
+            out = []
+            for r in batch:
+                if pending is not None and r[0] != pending[0]:
+                    out.append(pending)
+                pending = r
+            if out:
+                yield out
+        if pending is not None:
+            yield [pending]
+
+
+def apply_stages(batches, columns: list, stages: list, size: int):
+    """ chains the stages, returning the output batches and their column names """
+    for stage in stages:
+        batches, columns = stage.apply(batches, columns, size)
+    return batches, columns
@@ -0,0 +1,162 @@
+"""
+An index of the time range and row count of each log file, so that questions like "when did this brew start and
+end" and "how many rows does it have" can be answered without parsing the files.
+The index is persisted as a json file next to the logs and refreshed incrementally: an entry is only recomputed when
+the size or modification time of its file changes.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+
+import simplejson as json
+from fs.base import FS
+
+from brewpi.datalog.beerlog import TimeSeries
+from brewpi.datalog.time import datetime_to_millis, millis_to_datetime
+
+__author__ = 'mat'
+
+default_index_file = '.range-index.json'
+version = 1
+
+
+class RangeIndex:
+    """
+    Stores the first and last times and the row count for each file, keyed on the file path.
+    Each entry also records the size and modification time of the file it was computed from.
+    Recomputed entries are saved when the outermost batch() ends, or at once when no batch is active, so refreshing
+    the entries of a whole brew writes the index file once.
+    The index may be used from several threads.
+    """
+
+    def __init__(self, dir: FS, path: str = default_index_file):
+        """
+        :param dir: the file system the index is stored in, usually the root of the log repo.
+        :param path:    the path of the index file in dir
+        """
+        self.dir = dir
+        self.path = path
+        self.lock = Lock()
+        self.save_lock = Lock()     # held while the temporary file is written and moved, as saves share its name
+        self.entries = self._load()
+        self.dirty = False
+        self.batches = 0
+
+    def _load(self) -> dict:
+        if not self.dir.exists(self.path):
+            return {}
+        data = json.loads(self.dir.getcontents(self.path, 'rb').decode('utf-8'))
+        return data['files'] if data.get('version') == version else {}
+
+    def save(self):
+        """ writes the index to a temporary file and moves it into place, so readers never see a partial index """
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps({'version': version, 'files': self.entries}, sort_keys=True)
+                self.dirty = False
+            temp = self.path + '.tmp'
+            self.dir.setcontents(temp, data.encode('utf-8'))
+            self.dir.move(temp, self.path, overwrite=True)     # a rename when the file system has system paths
+
+    def flush(self):
+        """ saves the index if any entries have changed since it was last saved """
+        if self.dirty:
+            self.save()
+
+    @contextmanager
+    def batch(self):
+        """ defers saving recomputed entries until the outermost batch ends """
+        with self.lock:
+            self.batches += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.batches -= 1
+                done = not self.batches
+            if done:
+                self.flush()
+
+    def entry(self, key: list, series: TimeSeries) -> dict:
+        """ fetches the index entry for a file, computing it from the series when missing or out of date.
+        :param key: a list of the file path, size and modification time
+        :param series:  the series read to compute the entry
+        :return: a dict with the 'first' and 'last' times (as millis, or None when empty) and the row 'count'
+        """
+        path, size, mtime = key
+        with self.lock:
+            e = self.entries.get(path)
+        if e is None or e['size'] != size or e['mtime'] != mtime:
+            e = self.compute(series)
+            e.update(size=size, mtime=mtime)
+            with self.lock:
+                self.entries[path] = e
+                self.dirty = True
+                batched = self.batches > 0
+            if not batched:
+                self.save()
+        return e
+
+    @staticmethod
+    def compute(series: TimeSeries) -> dict:
+        """ computes an index entry in a single pass over the rows.
+        >>> from brewpi.datalog.beerlog import ListTimeSeries
+        >>> sorted(RangeIndex.compute(ListTimeSeries([[datetime(1970, 1, 2)], [datetime(1970, 1, 1)]])).items())
+        [('count', 2), ('first', 0), ('last', 86400000)]
+        """
+        first = last = None
+        count = 0
+        for r in series.rows():
+            t = r[0]
+            count += 1
+            if first is None:
+                first = last = t
+            elif t < first:
+                first = t
+            elif t > last:
+                last = t
+        return {'first': None if first is None else datetime_to_millis(first),
+                'last': None if last is None else datetime_to_millis(last),
+                'count': count}
+
+
+class IndexedTimeSeries(TimeSeries):
+    """
+    A time series whose range and row count are answered from a RangeIndex. The rows are read from the source.
+    """
+
+    def __init__(self, index: RangeIndex, key: callable, source: TimeSeries):
+        """
+        :param key: a callable returning the index key for the source, evaluated each time the index is consulted
+        """
+        self.index = index
+        self.key = key
+        self.source = source
+
+    def __str__(self):
+        return 'indexed %s' % self.source
+
+    def _entry(self):
+        return self.index.entry(self.key(), self.source)
+
+    def range(self) -> (datetime, datetime):
+        e = self._entry()
+        return None if e['first'] is None else (millis_to_datetime(e['first']), millis_to_datetime(e['last']))
+
+    def count(self) -> int:
+        return self._entry()['count']
+
+    def range_is_indexed(self) -> bool:
+        return True
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        r = self.range()
+        if r is None or (start is not None and r[1] < start) or (end is not None and r[0] >= end):
+            return iter(())
+        return self.source.rows_between(start, end)
+
+    def rows(self):
+        return self.source.rows()
+
+    def append(self, row: list):
+        self.source.append(row)
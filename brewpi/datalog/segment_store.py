@@ -0,0 +1,290 @@
+"""
+An archive of time series stored as fixed-width binary records in append-only segment files, for compact storage
+and fast replay. Segments are memory mapped and read as numpy views without decoding.
+
+Each series is a directory holding:
+    - series.json, describing the columns and the float type of the numeric columns
+    - numbered segment files of records. Each record is the time as int64 millis since the epoch, a float for each
+      numeric column (NaN when missing) and an int32 for each annotation column, indexing the strings file, or -1
+      when there is no annotation.
+    - strings.json, the side dictionary of annotation strings, one json string per line
+
+A crash part way through an append can leave a partial record at the end of a segment, which is ignored.
+"""
+from datetime import datetime
+from urllib.parse import quote, unquote
+import mmap
+import os
+import shutil
+
+import numpy as np
+import simplejson as json
+
+from brewpi.datalog.beerlog import TimeSeriesRepo, TimeSeries, ts_columns
+from brewpi.datalog.columnar import ColumnarTimeSeries, annotation_columns
+from brewpi.datalog.time import datetime_to_millis, millis_to_datetime
+
+__author__ = 'mat'
+
+version = 1
+series_file = 'series.json'
+strings_file = 'strings.json'
+segment_suffix = '.seg'
+
+
+def record_dtype(columns: list, float_type: str = 'f8') -> np.dtype:
+    """ the numpy type of a record for rows with the given columns.
+    >>> record_dtype(['time', 'beerTemp', 'beerAnn'], 'f4').itemsize
+    16
+    """
+    fields = [(columns[0], '<i8')]
+    for c in columns[1:]:
+        fields.append((c, '<i4' if c in annotation_columns else '<' + float_type))
+    return np.dtype(fields)
+
+
+def _map(path: str, dtype: np.dtype) -> np.ndarray:
+    """ maps the complete records in a segment file as a read only array. """
+    size = os.path.getsize(path)
+    n = size // dtype.itemsize
+    if not n:
+        return np.empty(0, dtype)
+    with open(path, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(m, dtype, n)
+
+
+class SegmentTimeSeries(TimeSeries):
+    """
+    A series stored in a directory of segment files. Rows must be appended in ascending time order.
+    """
+
+    def __init__(self, directory: str, name: str = None, segment_records: int = 1024 * 1024):
+        """
+        :param directory:   the directory of the series, which must already contain its series.json
+        :param name:    the name of the series
+        :param segment_records: the number of records at which a new segment is started
+        """
+        self.directory = directory
+        self.name = name
+        self.segment_records = segment_records
+        with open(os.path.join(directory, series_file), 'rb') as f:
+            meta = json.loads(f.read().decode('utf-8'))
+        self.columns = meta['columns']
+        self.dtype = record_dtype(self.columns, meta['float_type'])
+        self.numeric = [c for c in self.columns[1:] if c not in annotation_columns]
+        self.annotated = [c for c in self.columns[1:] if c in annotation_columns]
+        self.strings = []
+        self.codes = {}
+        self.strings_size = 0
+
+    def __str__(self):
+        return 'segment series %s' % (self.name or self.directory)
+
+    @staticmethod
+    def init(directory: str, columns: list, float_type: str = 'f8'):
+        """ creates the directory for a new series """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, series_file), 'wb') as f:
+            f.write(json.dumps({'version': version, 'columns': columns, 'float_type': float_type}).encode('utf-8'))
+
+    def _segment_paths(self) -> list:
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(segment_suffix))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _load_strings(self):
+        """ reads the strings appended to the side dictionary since it was last read """
+        path = os.path.join(self.directory, strings_file)
+        if not os.path.exists(path) or os.path.getsize(path) == self.strings_size:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self.strings_size)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                text = json.loads(line.decode('utf-8'))
+                self.codes.setdefault(text, len(self.strings))
+                self.strings.append(text)
+                self.strings_size += len(line)
+
+    def segments(self, start: datetime = None, end: datetime = None):
+        """ generates each segment as a ColumnarTimeSeries whose arrays are views on the mapped file, restricted
+        to the rows with start <= time < end. The window is found by binary search of the times.
+        """
+        if self.annotated:
+            self._load_strings()
+        strings = np.array(self.strings, object)
+        start = None if start is None else datetime_to_millis(start)
+        end = None if end is None else datetime_to_millis(end)
+        for path in self._segment_paths():
+            records = _map(path, self.dtype)
+            time = records[self.columns[0]]
+            lo = 0 if start is None else int(np.searchsorted(time, start, 'left'))
+            hi = len(time) if end is None else int(np.searchsorted(time, end, 'left'))
+            if lo >= hi:
+                if end is not None and lo < len(time):
+                    return      # this segment starts after the window, and so do the rest
+                continue
+            records = records[lo:hi]
+            annotations = {}
+            for c in self.annotated:
+                codes = records[c]
+                index = np.flatnonzero(codes >= 0)
+                annotations[c] = (index, strings[codes[index]])
+            yield ColumnarTimeSeries(records[self.columns[0]], {c: records[c] for c in self.numeric},
+                                     annotations, self.columns)
+
+    def rows(self):
+        return self.rows_between()
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        for segment in self.segments(start, end):
+            yield from segment.rows()
+
+    def _record(self, path: str, index: int) -> np.ndarray:
+        with open(path, 'rb') as f:
+            f.seek(index * self.dtype.itemsize)
+            return np.frombuffer(f.read(self.dtype.itemsize), self.dtype)[0]
+
+    def _record_counts(self) -> list:
+        return [(path, os.path.getsize(path) // self.dtype.itemsize) for path in self._segment_paths()]
+
+    def range(self) -> (datetime, datetime):
+        """ reads just the first and the last record """
+        counts = [(path, n) for path, n in self._record_counts() if n]
+        if not counts:
+            return None
+        time = self.columns[0]
+        first = self._record(counts[0][0], 0)[time]
+        last = self._record(counts[-1][0], counts[-1][1] - 1)[time]
+        return millis_to_datetime(int(first)), millis_to_datetime(int(last))
+
+    def range_is_indexed(self) -> bool:
+        return True
+
+    def count(self) -> int:
+        return sum(n for _, n in self._record_counts())
+
+    def append(self, row: list):
+        self.append_bulk([row])
+
+    def append_bulk(self, rows: list):
+        """ appends rows to the last segment, starting new segments as they fill.
+        The times must be in ascending order, and not earlier than the last time in the series.
+        New annotation strings are written to the side dictionary before the records that refer to them.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        n = len(self.columns)
+        for r in rows:
+            if len(r) != n:
+                raise ValueError('data and column lists not the same length: %d!=%d' % (len(r), n))
+        records = np.empty(len(rows), self.dtype)
+        time = records[self.columns[0]]
+        time[:] = [datetime_to_millis(r[0]) for r in rows]
+        counts = self._record_counts()
+        if (np.diff(time) < 0).any():
+            raise ValueError('rows are not in time order')
+        filled = [(path, count) for path, count in counts if count]
+        if filled:
+            path, count = filled[-1]
+            previous = int(self._record(path, count - 1)[self.columns[0]])
+            if time[0] < previous:
+                raise ValueError('time is not ascending: %d is before %d' % (time[0], previous))
+        for i, c in enumerate(self.columns[1:], 1):
+            if c in annotation_columns:
+                records[c] = self._encode([r[i] for r in rows])
+            else:
+                records[c] = [np.nan if r[i] is None else float(r[i]) for r in rows]
+        self._write(records, counts)
+
+    def _encode(self, texts: list) -> list:
+        self._load_strings()
+        new = []
+        for t in texts:
+            if t is not None and t not in self.codes:
+                self.codes[t] = len(self.strings)
+                self.strings.append(t)
+                new.append(t)
+        if new:
+            data = b''.join(json.dumps(t).encode('utf-8') + b'\n' for t in new)
+            with open(os.path.join(self.directory, strings_file), 'ab') as f:
+                f.truncate(self.strings_size)   # discard a partial line left by a crash
+                f.write(data)
+            self.strings_size += len(data)
+        return [-1 if t is None else self.codes[t] for t in texts]
+
+    def _write(self, records: np.ndarray, counts: list):
+        if counts:
+            path, count = counts[-1]
+            number = int(os.path.basename(path)[:-len(segment_suffix)])
+        else:
+            number, count = 0, 0
+        itemsize = self.dtype.itemsize
+        while len(records):
+            if count >= self.segment_records:
+                number, count = number + 1, 0
+            path = os.path.join(self.directory, '%08d%s' % (number, segment_suffix))
+            take = self.segment_records - count
+            with open(path, 'ab') as f:
+                f.truncate(count * itemsize)    # discard a partial record left by a crash
+                f.write(records[:take].tobytes())
+            count += len(records[:take])
+            records = records[take:]
+
+
+class SegmentTimeSeriesRepo(TimeSeriesRepo):
+    """ Provides a TimeSeriesRepo storing each series in a directory of binary segment files.
+
+    >>> import tempfile
+    >>> repo = SegmentTimeSeriesRepo(tempfile.mkdtemp())
+    >>> ts = repo.create('brew 1', ['time', 'beerTemp', 'beerAnn'])
+    >>> ts.append_bulk([[datetime(2015, 1, 1, 12), 20.5, 'pitched'], [datetime(2015, 1, 1, 13), None, None]])
+    >>> repo.names(), ts.count(), ts.range()
+    (['brew 1'], 2, (datetime.datetime(2015, 1, 1, 12, 0), datetime.datetime(2015, 1, 1, 13, 0)))
+    >>> list(repo.fetch('brew 1').rows())
+    [[datetime.datetime(2015, 1, 1, 12, 0), 20.5, 'pitched'], [datetime.datetime(2015, 1, 1, 13, 0), None, None]]
+    >>> shutil.rmtree(repo.directory)
+    """
+
+    def __init__(self, directory: str, float_type: str = 'f8', segment_records: int = 1024 * 1024):
+        """
+        :param directory:   the directory holding a subdirectory for each series. It is created if it does not exist.
+        :param float_type:  the numpy type of the numeric columns of new series, 'f8' or 'f4'
+        :param segment_records: the number of records in each segment file
+        """
+        if float_type not in ('f4', 'f8'):
+            raise ValueError('float type must be f4 or f8: %s' % float_type)
+        self.directory = directory
+        self.float_type = float_type
+        self.segment_records = segment_records
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, quote(name, safe=''))
+
+    def names(self) -> list:
+        return sorted(unquote(n) for n in os.listdir(self.directory)
+                      if os.path.exists(os.path.join(self.directory, n, series_file)))
+
+    def fetch(self, name) -> SegmentTimeSeries:
+        """
+        :param name: retrieves a TimeSeries instance for the named time series.
+        :raises KeyError: when there is no series with the name
+        """
+        path = self._path(name)
+        if not os.path.exists(os.path.join(path, series_file)):
+            raise KeyError('no series named %s' % name)
+        return SegmentTimeSeries(path, name, self.segment_records)
+
+    def create(self, name, columns: list = None) -> SegmentTimeSeries:
+        """ creates the series if it does not exist, and returns it. An existing series keeps its columns. """
+        path = self._path(name)
+        if not os.path.exists(os.path.join(path, series_file)):
+            SegmentTimeSeries.init(path, columns or ts_columns, self.float_type)
+        return self.fetch(name)
+
+    def delete(self, name):
+        """ removes a series and its segments """
+        shutil.rmtree(self._path(name), ignore_errors=True)
@@ -0,0 +1,235 @@
+"""
+A persistent cache of parsed log files. Each parsed file is stored as a binary sidecar in a cache directory, laid out
+column by column so that it can be memory mapped and read back as a ColumnarTimeSeries without decoding.
+
+A sidecar file contains:
+    - the magic bytes b'BPSC', a uint32 format version and a uint64 header length
+    - a utf-8 json header describing the source file, the columns, the row count, the (sparse) annotations and the
+      original types of the numeric values: the columns of ints, and the sparse values of other types
+    - padding to an 8 byte boundary, then the int64 times followed by a float64 array for each numeric column
+"""
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+import simplejson as json
+
+from brewpi.datalog.beerlog import TimeSeries, ts_columns
+from brewpi.datalog.columnar import ColumnarTimeSeries, object_array
+
+__author__ = 'mat'
+
+magic = b'BPSC'
+version = 2
+preamble = struct.Struct('<4sIQ')
+suffix = '.sidecar'
+
+
+def _aligned(n: int) -> int:
+    """
+    >>> _aligned(0), _aligned(1), _aligned(8), _aligned(9)
+    (0, 8, 8, 16)
+    """
+    return (n + 7) & ~7
+
+
+def write_sidecar(path: str, key: list, ts: ColumnarTimeSeries):
+    """ writes the series to a sidecar file. The file is written to a temporary name first and then moved into place
+    so that readers never see a partially written file.
+    """
+    numeric = [c for c in ts.columns[1:] if c in ts.values]
+    header = json.dumps({
+        'key': key,
+        'columns': ts.columns,
+        'rows': len(ts),
+        'numeric': numeric,
+        'annotations': {c: [index.tolist(), text.tolist()] for c, (index, text) in ts.annotations.items()},
+        'exact': ts.exact,
+        'int_columns': sorted(ts.int_columns),
+        'exceptions': {c: [index.tolist(), values.tolist()] for c, (index, values) in ts.exceptions.items()}
+    }).encode('utf-8')
+    directory = os.path.dirname(path)
+    fd, temp = tempfile.mkstemp(suffix + '.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(preamble.pack(magic, version, len(header)))
+            f.write(header)
+            f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(ts.time, '<i8').tobytes())
+            for c in numeric:
+                f.write(np.ascontiguousarray(ts.values[c], '<f8').tobytes())
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def read_sidecar(path: str, key: list = None):
+    """ maps a sidecar file into memory and returns it as a ColumnarTimeSeries whose arrays are views on the mapping.
+    :param key: when given, the key stored in the sidecar must match or None is returned.
+    :return: the series, or None if the file is not a valid sidecar for the key
+    :raises ValueError: if the file is truncated or its header is corrupt
+    """
+    with open(path, 'rb') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:      # empty file
+            return None
+    if len(m) < preamble.size:
+        return None
+    file_magic, file_version, header_len = preamble.unpack_from(m)
+    if file_magic != magic or file_version != version:
+        return None
+    if len(m) < preamble.size + header_len:
+        raise ValueError('sidecar header truncated: %s' % path)
+    header = json.loads(m[preamble.size:preamble.size + header_len].decode('utf-8'))
+    if key is not None and header['key'] != key:
+        return None
+    n = header['rows']
+    offset = _aligned(preamble.size + header_len)
+    if len(m) != offset + 8 * n * (1 + len(header['numeric'])):
+        raise ValueError('sidecar length %d does not match its header: %s' % (len(m), path))
+    time = np.frombuffer(m, '<i8', n, offset)
+    offset += 8 * n
+    values = {}
+    for c in header['numeric']:
+        values[c] = np.frombuffer(m, '<f8', n, offset)
+        offset += 8 * n
+    annotations = {c: (np.array(index, np.int64), np.array(text, object))
+                   for c, (index, text) in header['annotations'].items()}
+    exceptions = {c: (np.array(index, np.int64), object_array(exact))
+                  for c, (index, exact) in header['exceptions'].items()}
+    return ColumnarTimeSeries(time, values, annotations, header['columns'], header['exact'], header['int_columns'],
+                              exceptions)
+
+
+class SidecarCache:
+    """
+    A directory of sidecar files, one per source log file, limited to a maximum total size.
+    Sidecars are keyed on the source path, and also record the source size and modification time so that a sidecar
+    is rebuilt when the source changes. Reading a sidecar touches its modification time, and when the cache grows
+    beyond max_bytes the least recently used sidecars are removed. The directory is scanned once, when the cache is
+    created, and the sizes are then tracked as sidecars are written and removed.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        :param directory:   the directory the sidecars are stored in. It is created if it does not exist.
+        :param max_bytes:   the maximum total size of the sidecar files
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(suffix):
+                st = os.stat(os.path.join(directory, name))
+                entries.append((st.st_mtime, name, st.st_size))
+        self.sizes = OrderedDict((name, size) for _, name, size in sorted(entries))   # least recently used first
+        self.total = sum(self.sizes.values())
+
+    def sidecar_path(self, source: str) -> str:
+        """ the path of the sidecar file for a source file path """
+        return os.path.join(self.directory, hashlib.sha1(source.encode('utf-8')).hexdigest() + suffix)
+
+    def get(self, key: list):
+        """ fetches the cached series for a key, or None if it isn't cached or the source has changed.
+        :param key: a list of the source path, size and modification time
+        """
+        path = self.sidecar_path(key[0])
+        if not os.path.exists(path):
+            return None
+        name = os.path.basename(path)
+        try:
+            ts = read_sidecar(path, key)
+        except (ValueError, KeyError, TypeError, struct.error):     # corrupt, so parse the source again
+            self.remove(name)
+            return None
+        if ts is not None:
+            os.utime(path)
+            if name in self.sizes:
+                self.sizes.move_to_end(name)
+        return ts
+
+    def put(self, key: list, ts: ColumnarTimeSeries):
+        """ stores the series for a key, replacing any previous version, and then evicts old entries. """
+        path = self.sidecar_path(key[0])
+        write_sidecar(path, key, ts)
+        name = os.path.basename(path)
+        self.total -= self.sizes.pop(name, 0)
+        self.sizes[name] = os.path.getsize(path)
+        self.total += self.sizes[name]
+        self.evict()
+
+    def remove(self, name: str):
+        """ removes a sidecar file by name """
+        self.total -= self.sizes.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """ removes the least recently used sidecars until the total size is within max_bytes """
+        while self.total > self.max_bytes and self.sizes:
+            self.remove(next(iter(self.sizes)))
+
+    def series(self, key: callable, source: TimeSeries, columns: list = ts_columns):
+        """ wraps a time series so that its rows are read from the cache when possible.
+        :param key: a callable returning the cache key for the source, evaluated each time the rows are read
+        """
+        return CachedTimeSeries(self, key, source, columns)
+
+
+class CachedTimeSeries(TimeSeries):
+    """
+    A time series whose rows are read from a sidecar cache, and parsed from the source series on a cache miss.
+    """
+
+    def __init__(self, cache: SidecarCache, key: callable, source: TimeSeries, columns: list = ts_columns):
+        self.cache = cache
+        self.key = key
+        self.source = source
+        self.columns = columns
+
+    def __str__(self):
+        return 'cached %s' % self.source
+
+    def columnar(self) -> ColumnarTimeSeries:
+        """ fetches the rows as a columnar series, from the cache if possible.
+        :return: the series, or None if the source rows cannot be stored in columns, e.g. they contain
+            non-numeric values in a numeric column or are not in time order.
+        """
+        key = self.key()
+        ts = self.cache.get(key)
+        if ts is None:
+            try:
+                ts = ColumnarTimeSeries.from_rows(self.source.rows(), self.columns, sort=False, exact=True)
+            except (ValueError, TypeError):
+                return None
+            self.cache.put(key, ts)
+        return ts
+
+    def rows(self):
+        ts = self.columnar()
+        return self.source.rows() if ts is None else ts.rows()
+
+    def range(self) -> (datetime, datetime):
+        ts = self.columnar()
+        return self.source.range() if ts is None else ts.range()
+
+    def count(self) -> int:
+        ts = self.columnar()
+        return self.source.count() if ts is None else len(ts)
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        ts = self.columnar()
+        return self.source.rows_between(start, end) if ts is None else ts.rows_between(start, end)
+
+    def append(self, row: list):
+        raise NotImplementedError
@@ -0,0 +1,287 @@
+"""
+A write-ahead spool that journals write requests to disk before they are sent, so that writes made while the
+database is slow or unreachable are kept and replayed in order once it accepts writes again.
+
+The spool is a directory of append-only segment files, named by their sequence number, each holding one json
+request per line. A background thread reads the segments from the last acknowledged position and passes the
+requests in batches to a write function, retrying with a growing delay while the write fails. The acknowledged
+position is saved after each successful write, and segments that have been fully written are removed.
+"""
+import logging
+import os
+from threading import Condition, Event, Thread
+
+import simplejson as json
+
+__author__ = 'mat'
+
+logger = logging.getLogger(__name__)
+
+segment_suffix = '.seg'
+ack_file = 'ack.json'
+
+
+def segment_name(number: int) -> str:
+    """
+    >>> segment_name(12)
+    '00000000000000000012.seg'
+    """
+    return '%020d%s' % (number, segment_suffix)
+
+
+class Spool:
+    """
+    Journals requests to segment files and writes them from a background thread.
+    Disk usage is bounded by max_bytes: when the segments grow larger than this, the oldest segments are discarded
+    and their requests counted as dropped. Dropped requests are never written: a batch being written when its segment
+    is discarded is counted as written if the write succeeds, and as dropped if it fails.
+    After a crash or restart, writing resumes from the last acknowledged request, so a request may be written more
+    than once but is not lost. An incomplete last line, left by a crash part way through an append, is ignored. A
+    line that can't be decoded is skipped, logged and counted as dropped.
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> batches = []
+    >>> s = Spool(d, batches.append, max_batch=2)
+    >>> for i in range(3):
+    ...     s.append({'n': i})
+    >>> s.flush(5)
+    True
+    >>> s.close()
+    >>> [r['n'] for b in batches for r in b]
+    [0, 1, 2]
+    >>> sorted(s.stats().items())
+    [('dropped', 0), ('pending', 0), ('written', 3)]
+    >>> shutil.rmtree(d)
+    """
+
+    def __init__(self, directory: str, write: callable, max_batch: int = 500, segment_bytes: int = 4 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, retry_interval: float = 1.0, max_retry_interval: float = 60.0,
+                 fsync: bool = False):
+        """
+        :param directory:   the directory the segments are stored in. It is created if it does not exist.
+        :param write:   called with a list of requests to write. It is called on the drain thread, and should raise
+            an exception when the requests could not be written, in which case they are retried.
+        :param max_batch:   the maximum number of requests passed to one call of write
+        :param segment_bytes:   the size at which a new segment is started
+        :param max_bytes:   the maximum total size of the segments
+        :param retry_interval:  the delay in seconds before retrying a failed write. The delay doubles after each
+            failure, up to max_retry_interval.
+        :param fsync:   when True, each append is synced to disk before returning, so that it survives a power loss
+            as well as a crash of the process. This is much slower.
+        """
+        self.directory = directory
+        self.write = write
+        self.max_batch = max_batch
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.fsync = fsync
+        self.lock = Condition()
+        self.stopping = Event()
+        self.written = 0
+        self.dropped = 0
+        self.last_error = None
+        self.closed = False
+        self.inflight = None    # the start and end positions of the batch being written
+        os.makedirs(directory, exist_ok=True)
+        self.segments = {n: os.path.getsize(self._path(n)) for n in self._segment_numbers()}
+        self.size = sum(self.segments.values())
+        self.read_pos = self._load_ack()
+        # always start a new segment, so that appends never follow an incomplete line left by a crash
+        self.write_segment = max([n + 1 for n in self.segments] + [self.read_pos[0]])
+        self._open_segment()
+        self.thread = Thread(target=self._run, name='Spool', daemon=True)
+        self.thread.start()
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, segment_name(number))
+
+    def _segment_numbers(self) -> list:
+        return sorted(int(name[:-len(segment_suffix)]) for name in os.listdir(self.directory)
+                      if name.endswith(segment_suffix))
+
+    def _load_ack(self) -> tuple:
+        first = min(self.segments) if self.segments else 0
+        try:
+            with open(os.path.join(self.directory, ack_file), 'rb') as f:
+                ack = json.loads(f.read().decode('utf-8'))
+            segment, offset = ack['segment'], ack['offset']
+        except (OSError, ValueError, KeyError, TypeError):
+            return first, 0
+        if segment in self.segments:
+            return segment, offset
+        # the acknowledged segment was removed once fully written, so resume from the next one
+        later = [n for n in self.segments if n > segment]
+        return (min(later), 0) if later else (max(segment, first), 0)
+
+    def _save_ack(self, pos: tuple):
+        path = os.path.join(self.directory, ack_file)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(json.dumps({'segment': pos[0], 'offset': pos[1]}).encode('utf-8'))
+        os.replace(temp, path)
+
+    def _open_segment(self):
+        self.file = open(self._path(self.write_segment), 'ab')
+        self.segments[self.write_segment] = self.write_offset = self.file.tell()
+
+    def stats(self) -> dict:
+        """ the number of bytes of requests waiting to be written, and the total number of requests written and
+        dropped since the spool was opened. """
+        with self.lock:
+            pending = self.size - self.read_pos[1] if self.read_pos[0] in self.segments else self.size
+            return {'pending': pending, 'written': self.written, 'dropped': self.dropped}
+
+    def append(self, request):
+        """ journals a request. The request must be serializable as json. It is written to the segment before
+        this method returns, and is written to the database later by the drain thread.
+        """
+        line = json.dumps(request, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.lock:
+            if self.closed:
+                raise ValueError('spool is closed')
+            self.file.write(line)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.write_offset += len(line)
+            self.segments[self.write_segment] = self.write_offset
+            self.size += len(line)
+            if self.write_offset >= self.segment_bytes:
+                self.file.close()
+                self.write_segment += 1
+                self._open_segment()
+            if self.size > self.max_bytes:
+                self._discard_oldest()
+            self.lock.notify_all()
+
+    def _discard_oldest(self):
+        """ removes the oldest segments until the spool is within max_bytes. The segment being written is kept.
+        The requests of the batch being written are not counted, as the drain thread counts them once it knows
+        whether they were written.
+        """
+        for n in sorted(self.segments):
+            if self.size <= self.max_bytes or n == self.write_segment:
+                break
+            if n >= self.read_pos[0]:
+                offset = self.read_pos[1] if n == self.read_pos[0] else 0
+                if self.inflight is not None and self.inflight[0] == (n, offset):
+                    end = self.inflight[1]
+                    offset = end[1] if end[0] == n else None
+                if offset is not None:
+                    self.dropped += self._count_requests(n, offset)
+                self.read_pos = (n + 1, 0)
+            self._remove_segment(n)
+
+    def _count_requests(self, number: int, offset: int) -> int:
+        with open(self._path(number), 'rb') as f:
+            f.seek(offset)
+            return f.read().count(b'\n')
+
+    def _remove_segment(self, number: int):
+        self.size -= self.segments.pop(number)
+        os.remove(self._path(number))
+
+    def flush(self, timeout: float = None) -> bool:
+        """ waits until all requests appended before this call have been written.
+        :param timeout: the maximum time to wait in seconds, or None to wait until they are written.
+        :return: True if the requests were written, False if the timeout expired first.
+        """
+        with self.lock:
+            target = (self.write_segment, self.write_offset)
+            return self.lock.wait_for(lambda: self.read_pos >= target or self.stopping.is_set(), timeout) and \
+                self.read_pos >= target
+
+    def close(self, timeout: float = None):
+        """ waits for the pending requests to be written, and stops the drain thread. Requests not written
+        within the timeout remain in the spool, and are written when it is next opened.
+        """
+        if self.closed:
+            return
+        self.flush(timeout)
+        with self.lock:
+            self.closed = True
+            self.stopping.set()
+            self.lock.notify_all()
+        self.thread.join()
+        self.file.close()
+
+    def _read(self, pos: tuple) -> (list, tuple, int):
+        """ reads up to max_batch requests from the position. A batch is read from a single segment, so that it is
+        discarded as a whole.
+        :return: the requests, the position following the last one read, and the number of lines skipped because
+            they could not be decoded. The position is the start of the next segment when the rest of a segment that
+            is no longer appended to has been read.
+        """
+        segment, offset = pos
+        requests = []
+        undecodable = 0
+        with self.lock:
+            if segment not in self.segments:
+                return requests, pos, undecodable
+            limit = self.write_offset if segment == self.write_segment else None
+        try:
+            with open(self._path(segment), 'rb') as f:
+                f.seek(offset)
+                while len(requests) < self.max_batch and (limit is None or offset < limit):
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        break       # end of the segment, or an incomplete line left by a crash
+                    offset += len(line)
+                    try:
+                        requests.append(json.loads(line.decode('utf-8')))
+                    except ValueError:
+                        undecodable += 1
+                else:
+                    return requests, (segment, offset), undecodable
+        except FileNotFoundError:   # discarded while reading
+            return requests, (segment, offset), undecodable
+        return requests, (segment, offset) if limit is not None else (segment + 1, 0), undecodable
+
+    def _run(self):
+        delay = self.retry_interval
+        while not self.stopping.is_set():
+            with self.lock:
+                self.lock.wait_for(lambda: self.stopping.is_set() or
+                                   self.read_pos < (self.write_segment, self.write_offset))
+                pos = self.read_pos
+            if self.stopping.is_set():
+                return
+            requests, end, undecodable = self._read(pos)
+            with self.lock:
+                if self.read_pos != pos:    # the segment read was discarded while reading
+                    continue
+                self.inflight = pos, end
+            error = None
+            if requests:
+                try:
+                    self.write(requests)
+                except Exception as e:
+                    error = e
+            ack = None
+            with self.lock:
+                self.inflight = None
+                discarded = self.read_pos != pos    # the segment was discarded while writing
+                if undecodable and (error is None or discarded):    # otherwise the batch is read again
+                    self.dropped += undecodable
+                    logger.warning('dropped %d undecodable requests from spool segment %d', undecodable, pos[0])
+                if error is not None:
+                    self.last_error = error
+                    if discarded:
+                        self.dropped += len(requests)
+                else:
+                    self.written += len(requests)
+                    if not discarded:
+                        self.read_pos = ack = end
+                        for n in [n for n in self.segments if n < end[0]]:
+                            self._remove_segment(n)
+                self.lock.notify_all()
+            if ack is not None:
+                self._save_ack(ack)     # only this thread saves the ack, so it needn't hold the lock
+            if error is not None:
+                self.stopping.wait(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+            else:
+                delay = self.retry_interval
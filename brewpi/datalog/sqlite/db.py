@@ -0,0 +1,188 @@
+"""
+A TimeSeriesRepo stored in a local sqlite database, so that logs can be queried without a server.
+
+All series share one table of points keyed on (series, time), so time windows, ranges and counts are answered
+from the primary key index. Times are stored as millis since the epoch, and the values in columns v1..vN, where N
+is the largest number of value columns of any series. The series table is the catalog of names and column names.
+"""
+from datetime import datetime
+from threading import RLock
+import sqlite3
+
+import simplejson as json
+
+from brewpi.datalog.beerlog import TimeSeriesRepo, TimeSeries, ts_columns
+from brewpi.datalog.time import datetime_to_millis, millis_to_datetime
+
+__author__ = 'mat'
+
+
+class SqliteTimeSeriesRepo:
+    pass
+
+
+class SqliteTimeSeries(TimeSeries):
+    """
+    A series in a SqliteTimeSeriesRepo. Rows with the same time replace each other, keeping the last one appended.
+    """
+
+    def __init__(self, repo: SqliteTimeSeriesRepo, name: str, id: int, columns: list, page_size: int = 10000):
+        """
+        :param repo:    the repo this series is part of
+        :param name:    the name of this series
+        :param id:  the key of this series in the series table
+        :param columns: the column names of the rows. The first is the time.
+        :param page_size:   the number of rows fetched from the database at a time
+        """
+        self.repo = repo
+        self.name = name
+        self.id = id
+        self.columns = columns
+        self.page_size = page_size
+        self.value_columns = ['v%d' % i for i in range(1, len(columns))]
+        self.select = 'select %s from points where series = ?' % ', '.join(['time'] + self.value_columns)
+        self.insert = 'insert or replace into points (%s) values (%s)' % (
+            ', '.join(['series', 'time'] + self.value_columns), ', '.join('?' * (len(columns) + 1)))
+
+    def __str__(self):
+        return 'sqlite series %s' % self.name
+
+    def rows(self):
+        return self.rows_between()
+
+    def rows_between(self, start: datetime = None, end: datetime = None):
+        """ queries the rows in the window in time order, using the primary key index. The rows are fetched in
+        pages, so memory is bounded by the page size.
+        """
+        q, params = self.select, [self.id]
+        if start is not None:
+            q += ' and time >= ?'
+            params.append(datetime_to_millis(start))
+        if end is not None:
+            q += ' and time < ?'
+            params.append(datetime_to_millis(end))
+        for page in self.repo.fetch_pages(q + ' order by time', params, self.page_size):
+            for r in page:
+                row = list(r)
+                row[0] = millis_to_datetime(r[0])
+                yield row
+
+    def range(self) -> (datetime, datetime):
+        first, last = self.repo.query_one('select min(time), max(time) from points where series = ?', (self.id,))
+        return None if first is None else (millis_to_datetime(first), millis_to_datetime(last))
+
+    def range_is_indexed(self) -> bool:
+        return True
+
+    def count(self) -> int:
+        return self.repo.query_one('select count(*) from points where series = ?', (self.id,))[0]
+
+    def append(self, row: list):
+        self.append_bulk([row])
+
+    def append_bulk(self, rows: list):
+        """ inserts the rows in a single transaction. """
+        n = len(self.columns)
+        sid = self.id
+
+        def params():
+            for r in rows:
+                if len(r) != n:
+                    raise ValueError('data and column lists not the same length: %d!=%d' % (len(r), n))
+                yield (sid, datetime_to_millis(r[0])) + tuple(r[1:])
+        self.repo.execute_many(self.insert, params())
+
+
+class SqliteTimeSeriesRepo(TimeSeriesRepo):
+    """ Provides a TimeSeriesRepo stored in a sqlite database file.
+    The database uses write-ahead logging, so that readers are not blocked while rows are appended.
+    A repo may be used from several threads.
+
+    >>> repo = SqliteTimeSeriesRepo(':memory:')
+    >>> ts = repo.create('brew 1', ['time', 'beerTemp'])
+    >>> ts.append_bulk([[datetime(2015, 1, 1, 12), 20.5], [datetime(2015, 1, 1, 13), 21]])
+    >>> repo.names(), ts.count(), ts.range()
+    (['brew 1'], 2, (datetime.datetime(2015, 1, 1, 12, 0), datetime.datetime(2015, 1, 1, 13, 0)))
+    >>> list(repo.fetch('brew 1').rows_between(datetime(2015, 1, 1, 12, 30)))
+    [[datetime.datetime(2015, 1, 1, 13, 0), 21]]
+    """
+
+    def __init__(self, path: str, page_size: int = 10000):
+        """
+        :param path:    the path of the database file. It is created if it does not exist.
+        :param page_size:   the number of rows fetched from the database at a time when reading a series
+        """
+        self.path = path
+        self.page_size = page_size
+        self.lock = RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('pragma journal_mode=wal')
+        self.db.execute('pragma synchronous=normal')
+        with self.db:
+            self.db.execute('create table if not exists series '
+                            '(id integer primary key, name text not null unique, columns text not null)')
+            self.db.execute('create table if not exists points (series integer not null, time integer not null, '
+                            'primary key (series, time)) without rowid')
+        self.value_columns = sum(1 for c in self.db.execute('pragma table_info(points)')) - 2
+
+    def names(self) -> list:
+        """ the names of the series in the catalog, in sorted order """
+        with self.lock:
+            return [r[0] for r in self.db.execute('select name from series order by name')]
+
+    def fetch(self, name) -> SqliteTimeSeries:
+        """
+        :param name: retrieves a TimeSeries instance for the named time series.
+        :raises KeyError: when there is no series with the name
+        """
+        r = self.query_one('select id, columns from series where name = ?', (name,))
+        if r is None:
+            raise KeyError('no series named %s' % name)
+        return SqliteTimeSeries(self, name, r[0], json.loads(r[1]), self.page_size)
+
+    def create(self, name, columns: list = None) -> SqliteTimeSeries:
+        """ creates the series if it does not exist, and returns it. An existing series keeps its columns. """
+        columns = columns or ts_columns
+        with self.lock, self.db:
+            self._ensure_value_columns(len(columns) - 1)
+            self.db.execute('insert or ignore into series (name, columns) values (?, ?)', (name, json.dumps(columns)))
+        return self.fetch(name)
+
+    def _ensure_value_columns(self, n: int):
+        while self.value_columns < n:
+            self.value_columns += 1
+            self.db.execute('alter table points add column v%d' % self.value_columns)
+
+    def delete(self, name):
+        """ removes a series and its rows """
+        with self.lock, self.db:
+            self.db.execute('delete from points where series = (select id from series where name = ?)', (name,))
+            self.db.execute('delete from series where name = ?', (name,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def query_one(self, q: str, params=()):
+        with self.lock:
+            return self.db.execute(q, params).fetchone()
+
+    def execute_many(self, q: str, params):
+        with self.lock, self.db:
+            self.db.executemany(q, params)
+
+    def fetch_pages(self, q: str, params, size: int):
+        """ generates the results of a query in lists of up to size rows.
+        The lock is only held while fetching each page, so other threads may use the repo between pages.
+        """
+        with self.lock:
+            cursor = self.db.execute(q, params)
+        try:
+            while True:
+                with self.lock:
+                    page = cursor.fetchmany(size)
+                if not page:
+                    return
+                yield page
+        finally:
+            cursor.close()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from threading import Thread
+
+from hamcrest import assert_that, equal_to, is_, none
+
+from brewpi.datalog.beerlog import ts_columns
+from brewpi.datalog.sqlite.db import SqliteTimeSeriesRepo
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+
+
+def row(minutes):
+    return [t + timedelta(minutes=minutes), 20, 10, "beer" if minutes % 2 else None, 5, 1, None, 0, 3.5]
+
+
+class SqliteTimeSeriesRepoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'logs.db')
+        self.repo = SqliteTimeSeriesRepo(self.path, page_size=3)
+
+    def tearDown(self):
+        self.repo.close()
+        shutil.rmtree(self.dir)
+
+    def test_new_series_is_empty(self):
+        ts = self.repo.create('brew')
+        assert_that(list(ts.rows()), is_(equal_to([])))
+        assert_that(ts.range(), is_(none()))
+        assert_that(ts.count(), is_(0))
+
+    def test_rows_round_trip(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(i) for i in range(10)])
+        ts.append(row(10))
+        assert_that(list(self.repo.fetch('brew').rows()), is_(equal_to([row(i) for i in range(11)])))
+        assert_that(ts.range(), is_(equal_to((row(0)[0], row(10)[0]))))
+        assert_that(ts.count(), is_(11))
+
+    def test_rows_between(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(i) for i in range(10)])
+        assert_that(list(ts.rows_between(row(2)[0], row(5)[0])), is_(equal_to([row(2), row(3), row(4)])))
+        assert_that(list(ts.rows_between(row(8)[0])), is_(equal_to([row(8), row(9)])))
+
+    def test_series_are_separate(self):
+        a = self.repo.create('a')
+        b = self.repo.create('b', ['time', 'x'])
+        a.append_bulk([row(0)])
+        b.append_bulk([[row(1)[0], 'y']])
+        assert_that(self.repo.names(), is_(equal_to(['a', 'b'])))
+        assert_that(list(a.rows()), is_(equal_to([row(0)])))
+        assert_that(list(self.repo.fetch('b').rows()), is_(equal_to([[row(1)[0], 'y']])))
+
+    def test_same_time_replaces_row(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(0), row(0)[:1] + [21] + row(0)[2:]])
+        assert_that([r[1] for r in ts.rows()], is_(equal_to([21])))
+
+    def test_wrong_row_length(self):
+        ts = self.repo.create('brew')
+        with self.assertRaises(ValueError):
+            ts.append_bulk([row(0)[:3]])
+        assert_that(ts.count(), is_(0))
+
+    def test_unknown_series(self):
+        with self.assertRaises(KeyError):
+            self.repo.fetch('nothing')
+
+    def test_delete(self):
+        self.repo.create('brew').append_bulk([row(0)])
+        self.repo.delete('brew')
+        assert_that(self.repo.names(), is_(equal_to([])))
+        assert_that(self.repo.create('brew').count(), is_(0))
+
+    def test_persisted(self):
+        self.repo.create('brew', ts_columns).append_bulk([row(0), row(1)])
+        self.repo.close()
+        self.repo = SqliteTimeSeriesRepo(self.path)
+        assert_that(list(self.repo.fetch('brew').rows()), is_(equal_to([row(0), row(1)])))
+
+    def test_threads(self):
+        def write(name):
+            ts = self.repo.create(name)
+            for i in range(20):
+                ts.append_bulk([row(i)])
+                list(ts.rows())
+        threads = [Thread(target=write, args=('brew %d' % i,)) for i in range(4)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert_that([self.repo.fetch(n).count() for n in self.repo.names()], is_(equal_to([20] * 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
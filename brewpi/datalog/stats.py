@@ -0,0 +1,226 @@
+"""
+Summary statistics of a time series - the time range, row count, per column null counts, min, max and mean, and
+gaps in the times - computed in a single streaming pass with constant memory.
+Statistics computed separately for consecutive parts of a series, such as its log files, can be merged, so the
+parts can be processed in parallel.
+"""
+from datetime import datetime, timedelta
+import heapq
+
+from brewpi.datalog.beerlog import TimeSeries, CompositeTimeSeries, ts_columns
+from brewpi.datalog.beerlog_json import BeerlogJson, beerlog_source, parallel_logs, source_opener
+
+__author__ = 'mat'
+
+
+class ColumnStats:
+    """
+    The statistics of one column. Values that are not numbers, such as annotations, are counted but not
+    aggregated. NaN values are counted as nulls.
+    """
+    __slots__ = ('nulls', 'values', 'numbers', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.nulls = 0
+        self.values = 0
+        self.numbers = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @property
+    def mean(self):
+        return self.total / self.numbers if self.numbers else None
+
+    def merge(self, other):
+        self.nulls += other.nulls
+        self.values += other.values
+        self.numbers += other.numbers
+        self.total += other.total
+        if other.numbers:
+            self.min = other.min if self.min is None or other.min < self.min else self.min
+            self.max = other.max if self.max is None or other.max > self.max else self.max
+
+    def to_dict(self) -> dict:
+        return {'nulls': self.nulls, 'values': self.values, 'min': self.min, 'max': self.max, 'mean': self.mean}
+
+
+class SeriesStats:
+    """
+    Accumulates the statistics of a series row by row.
+    A gap is an interval between consecutive rows longer than the gap threshold. All gaps are counted, and the
+    longest max_gaps of them are kept.
+
+    >>> t = datetime(2016, 1, 1)
+    >>> s = SeriesStats(['time', 'beerTemp', 'beerAnn'], timedelta(minutes=5))
+    >>> s.add([[t, 20, 'pitched'], [t + timedelta(minutes=1), None, None], [t + timedelta(minutes=21), 22, None]])
+    >>> s.count, s.gap_count, s.gap_total
+    (3, 1, datetime.timedelta(seconds=1200))
+    >>> beer, ann = s.columns
+    >>> beer.nulls, beer.min, beer.max, beer.mean, ann.values, ann.mean
+    (1, 20, 22, 21.0, 1, None)
+    """
+
+    def __init__(self, columns: list = ts_columns, gap: timedelta = timedelta(minutes=5), max_gaps: int = 10):
+        """
+        :param columns: the column names of the rows. The first is the time.
+        :param gap: the longest interval between rows that is not counted as a gap
+        :param max_gaps:    the number of the longest gaps that are kept
+        """
+        self.names = list(columns)
+        self.gap = gap
+        self.max_gaps = max_gaps
+        self.count = 0
+        self.start = self.end = None        # the earliest and latest times
+        self.first = self.last = None       # the times of the first and last rows
+        self.out_of_order = 0
+        self.gap_count = 0
+        self.gap_total = timedelta(0)
+        self._gaps = []                     # a heap of (length, start, end)
+        self.columns = [ColumnStats() for _ in self.names[1:]]
+
+    @property
+    def range(self) -> (datetime, datetime):
+        return None if self.start is None else (self.start, self.end)
+
+    @property
+    def gaps(self) -> list:
+        """ the longest gaps as (start, end) tuples, in time order """
+        return sorted((start, end) for _, start, end in self._gaps)
+
+    def _found_gap(self, start: datetime, end: datetime):
+        self.gap_count += 1
+        self.gap_total += end - start
+        self._keep_gap((end - start, start, end))
+
+    def _keep_gap(self, item: tuple):
+        if len(self._gaps) < self.max_gaps:
+            heapq.heappush(self._gaps, item)
+        elif self._gaps and item > self._gaps[0]:
+            heapq.heapreplace(self._gaps, item)
+
+    def _between(self, previous: datetime, t: datetime):
+        if t < previous:
+            self.out_of_order += 1
+        elif t - previous > self.gap:
+            self._found_gap(previous, t)
+
+    def add(self, rows):
+        """ adds rows to the statistics. The rows are only iterated, so they may be a stream of any length. """
+        columns = list(enumerate(self.columns, 1))
+        previous = self.last
+        start, end = self.start, self.end
+        count = 0
+        for r in rows:
+            t = r[0]
+            if previous is None:
+                self.first = start = end = t
+            else:
+                self._between(previous, t)
+                if t < start:
+                    start = t
+                elif t > end:
+                    end = t
+            previous = t
+            count += 1
+            for i, c in columns:
+                v = r[i]
+                if v is None or v != v:     # NaN, as read from columnar series, is missing too
+                    c.nulls += 1
+                    continue
+                c.values += 1
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    if c.numbers:
+                        if v < c.min:
+                            c.min = v
+                        elif v > c.max:
+                            c.max = v
+                    else:
+                        c.min = c.max = v
+                    c.numbers += 1
+                    c.total += v
+        self.count += count
+        self.start, self.end, self.last = start, end, previous
+
+    def merge(self, other):
+        """ merges the statistics of the rows following those already added.
+        >>> t = datetime(2016, 1, 1)
+        >>> a, b = SeriesStats(['time', 'x']), SeriesStats(['time', 'x'])
+        >>> a.add([[t, 1]]); b.add([[t + timedelta(hours=1), 3]])
+        >>> a.merge(b).count, a.columns[0].mean, a.gap_count
+        (2, 2.0, 1)
+        """
+        if not other.count:
+            return self
+        if self.count:
+            self._between(self.last, other.first)
+            self.start = min(self.start, other.start)
+            self.end = max(self.end, other.end)
+        else:
+            self.first, self.start, self.end = other.first, other.start, other.end
+        self.last = other.last
+        self.count += other.count
+        self.out_of_order += other.out_of_order
+        for item in other._gaps:
+            self._keep_gap(item)
+        self.gap_count += other.gap_count
+        self.gap_total += other.gap_total
+        for c, o in zip(self.columns, other.columns):
+            c.merge(o)
+        return self
+
+    def to_dict(self) -> dict:
+        """ the statistics as a dict of json serializable values """
+        def iso(t):
+            return None if t is None else t.isoformat()
+        return {'count': self.count, 'start': iso(self.start), 'end': iso(self.end),
+                'out_of_order': self.out_of_order, 'gap_count': self.gap_count,
+                'gap_seconds': self.gap_total.total_seconds(),
+                'gaps': [[iso(start), iso(end)] for start, end in self.gaps],
+                'columns': {n: c.to_dict() for n, c in zip(self.names[1:], self.columns)}}
+
+    def report(self) -> str:
+        lines = ['range %s to %s' % (self.start, self.end), 'rows %d' % self.count]
+        if self.out_of_order:
+            lines.append('rows out of order %d' % self.out_of_order)
+        lines.append('gaps longer than %s: %d, totalling %s' % (self.gap, self.gap_count, self.gap_total))
+        lines.extend('    %s to %s' % gap for gap in self.gaps)
+        for name, c in zip(self.names[1:], self.columns):
+            if c.numbers:
+                lines.append('%-12s nulls %d  min %s  max %s  mean %.3f' % (name, c.nulls, c.min, c.max, c.mean))
+            else:
+                lines.append('%-12s nulls %d  values %d' % (name, c.nulls, c.values))
+        return '\n'.join(lines)
+
+
+def log_stats(source, columns: list, gap: timedelta, max_gaps: int) -> SeriesStats:
+    """ computes the statistics of a beerlog json file from its worker source (see worker_source). This is run in
+    the worker processes.
+    """
+    s = SeriesStats(columns, gap, max_gaps)
+    s.add(BeerlogJson(source_opener(source), stream=True).rows())
+    return s
+
+
+def series_stats(series: TimeSeries, columns: list = ts_columns, gap: timedelta = timedelta(minutes=5),
+                 max_gaps: int = 10, workers: int = 0) -> SeriesStats:
+    """ computes the statistics of a series in one pass over its rows.
+    :param workers: when non-zero and the series is a composite of log files, such as that fetched from a
+        BeerlogJsonRepo, the files are processed in a pool of this many processes and the results merged in order.
+    """
+    result = SeriesStats(columns, gap, max_gaps)
+    if not workers or not isinstance(series, CompositeTimeSeries) or \
+            any(_log_file(s) is None for s in series.serieses):
+        result.add(series.rows())
+        return result
+    for _, stats in parallel_logs(series.serieses, workers, 2 * workers, log_stats, columns, gap, max_gaps):
+        result.merge(stats)
+    return result
+
+
+def _log_file(series: TimeSeries) -> BeerlogJson:
+    """ the log file providing the rows of a series, or None if they don't come from a log file """
+    try:
+        return beerlog_source(series)
+    except AttributeError:
+        return None
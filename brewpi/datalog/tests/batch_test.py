@@ -0,0 +1,84 @@
+import threading
+import unittest
+
+from hamcrest import assert_that, equal_to, is_, calling, raises
+
+from brewpi.datalog.batch import BatchWriter
+
+
+class BatchWriterTest(unittest.TestCase):
+
+    def test_batch_written_when_old(self):
+        batches = []
+        written = threading.Event()
+
+        def write(batch):
+            batches.append(batch)
+            written.set()
+        w = BatchWriter(write, max_batch=100, max_age=0.05)
+        w.put(1)
+        w.put(2)
+        assert_that(written.wait(5), is_(True), 'batch should be written once max_age has passed')
+        assert_that(batches, is_(equal_to([[1, 2]])))
+        w.close()
+
+    def test_flush_writes_pending_items(self):
+        batches = []
+        w = BatchWriter(batches.append, max_batch=100, max_age=60)
+        w.put(1)
+        w.flush()
+        assert_that(batches, is_(equal_to([[1]])))
+        assert_that(w.stats(), is_(equal_to({'queued': 0, 'written': 1, 'dropped': 0})))
+        w.close()
+
+    def test_full_queue_drops_after_timeout(self):
+        writing = threading.Event()
+        release = threading.Event()
+        batches = []
+
+        def write(batch):
+            writing.set()
+            release.wait()
+            batches.append(batch)
+        w = BatchWriter(write, max_batch=1, max_queue=1, put_timeout=0.01)
+        results = [w.put(0)]
+        writing.wait()          # the writer thread holds the first item
+        results += [w.put(i) for i in range(1, 4)]
+        release.set()
+        w.close()
+        # one item is queued behind the one being written, and the rest are dropped
+        assert_that(results, is_(equal_to([True, True, False, False])))
+        assert_that(batches, is_(equal_to([[0], [1]])))
+        assert_that(w.stats(), is_(equal_to({'queued': 0, 'written': 2, 'dropped': 2})))
+
+    def test_first_write_error_raised_by_flush(self):
+        errors = [IOError('server unavailable'), IOError('still unavailable')]
+
+        def write(batch):
+            raise errors.pop(0)
+        w = BatchWriter(write, max_batch=1)
+        w.put(1)
+        w.put(2)
+        assert_that(calling(w.flush), raises(IOError, 'server unavailable'))
+        assert_that(w.stats()['dropped'], is_(2))
+        w.flush()       # the error is raised once
+        w.close()
+
+    def test_write_error_raised_by_close(self):
+        def write(batch):
+            raise IOError('server unavailable')
+        w = BatchWriter(write)
+        w.put(1)
+        assert_that(calling(w.close), raises(IOError, 'server unavailable'))
+        assert_that(w.stats()['dropped'], is_(1))
+        assert_that(calling(w.put).with_args(2), raises(ValueError))
+
+    def test_flush_after_close_raises(self):
+        w = BatchWriter(list)
+        w.close()
+        assert_that(calling(w.flush), raises(ValueError))
+        w.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,23 @@
+import bz2
+import gzip
+import lzma
+
 import simplejson
-from hamcrest import assert_that, equal_to, calling, raises, is_
+from hamcrest import assert_that, equal_to, calling, raises, is_, instance_of, less_than_or_equal_to
 
 from brewpi.datalog.beerlog import v021_columns, v010_columns
+from brewpi.datalog.time import datetime_to_millis
 
 import unittest
 from datetime import datetime, timedelta
-from brewpi.datalog.beerlog_json import sort_and_filter_log_files, parse_datetime, BeerlogJson, BeerlogJsonRepo
+from threading import Event
+from brewpi.datalog.beerlog_json import sort_and_filter_log_files, parse_datetime, BeerlogJson, BeerlogJsonRepo, \
+    DateParser, LogOpener, beerlog_source, parse_datetime_general, worker_source
 import io
+import shutil
+import tempfile
 import fs.memoryfs
+import fs.osfs
 
 single_log_entry = "{'c':[{'v':'Date(2013,10,18,15,41,31)'},null,null,null,null,{'v':20.7},null,null,{'v':'0'}]}"
 
@@ -41,6 +51,36 @@ class JsonDecodeTestCase(unittest.TestCase):
             'Date(2013,-1,1,24,0,0)'))
 
 
+class DateParserTestCase(unittest.TestCase):
+    # several hours, returning to an hour after it has been evicted from a cache of 2 hours
+    dates = ['Date(2013,11,18,15,41,31)', 'Date(2013,11,18,15,59,59)', 'Date(2013,11,18,16,0,0)',
+             'Date(2014,0,1,0,0,0)', 'Date(2013,11,18,15,0,1)', 'Date(2013,11,18,16,30,0)',
+             'Date(2013,11,18)', 'Date(2013,11,18,15,41,31,250)']
+
+    def test_same_as_general_parser(self):
+        p = DateParser(cache_size=2)
+        for s in self.dates:
+            assert_that(p(s), equal_to(parse_datetime_general(s)))
+            assert_that(len(p.cache), is_(less_than_or_equal_to(2)))
+
+    def test_same_millis_as_general_parser(self):
+        p = DateParser(millis=True, cache_size=2)
+        for s in self.dates:
+            assert_that(p(s), equal_to(datetime_to_millis(parse_datetime_general(s))))
+            assert_that(len(p.cache), is_(less_than_or_equal_to(2)))
+
+    def test_millis(self):
+        expected = datetime(2013, 12, 18, 15, 41, 31) - datetime(1970, 1, 1)
+        assert_that(parse_datetime('Date(2013,11,18,15,41,31)', millis=True),
+                    equal_to(int(expected.total_seconds() * 1000)))
+
+    def test_invalid_values(self):
+        p = DateParser()
+        for s in ['Date(2013,11,18,15,41,60)', 'Date(2013,11,18,15,-1,0)', 'Date(2013,12,18,15,41,0)',
+                  'date(2013,11,18,15,41,0)', 'Date(2013,11,18,15,41,0']:
+            self.assertRaises(ValueError, p, s)
+
+
 class LogFileListingTestCase(unittest.TestCase):
     def test_files_filtered_and_sorted(self):
         name = 'a'
@@ -68,6 +108,11 @@ class LogFileListingTestCase(unittest.TestCase):
             'a-01-02-10.b'
         ]))
 
+    def test_compressed_files_sorted_with_uncompressed(self):
+        files = ['a-2.json.xz', 'a-1.json', 'a-3.json.gz', 'a-10.json.bz2', 'a-4.txt.gz', 'a-5.gz']
+        result = sort_and_filter_log_files(files, 'a', ('.json', '.json.gz', '.json.bz2', '.json.xz'))
+        assert_that(result, equal_to(['a-1.json', 'a-2.json.xz', 'a-3.json.gz', 'a-10.json.bz2']))
+
 
 def rows_for_log(file):
     log = BeerlogJson(file)
@@ -127,6 +172,42 @@ def build_json_file(colnames, data):
     return simplejson.dumps(d)
 
 
+def json_file_callable(content):
+    def file():
+        return io.StringIO(content)
+    return file
+
+
+class BeerlogJsonStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.data = [d1, [t + timedelta(seconds=1), 21, 10, None, 5.5, 1, "fridge", 1, 3.25]]
+
+    def test_stream_rows_same_as_loaded_rows(self):
+        content = build_json_file(v021_columns, self.data)
+        loaded = rows_for_log(json_file_callable(content))
+        streamed = list(BeerlogJson(json_file_callable(content), stream=True).rows())
+        assert_that(streamed, is_(equal_to(loaded)))
+        assert_that(streamed, is_(equal_to(self.data)))
+
+    def test_stream_rows_before_colspec(self):
+        """ the rows can only be interpreted with the colspec so are re-read when they come first in the file """
+        d = simplejson.loads(build_json_file(v010_columns, [d1_old]))
+        content = '{"rows": %s, "cols": %s}' % (simplejson.dumps(d['rows']), simplejson.dumps(d['cols']))
+        streamed = list(BeerlogJson(json_file_callable(content), stream=True).rows())
+        assert_that(streamed, is_(equal_to([d1_old_row])))
+
+    def test_stream_yields_rows_before_end_of_file(self):
+        content = build_json_file(v021_columns, self.data)
+        truncated = content[:content.index(json_date_str(self.data[1][0]))]
+        rows = BeerlogJson(json_file_callable(truncated), stream=True).rows()
+        assert_that(next(rows), is_(equal_to(d1)))
+        assert_that(calling(lambda: next(rows)), raises(ImportError))
+
+    def test_stream_invalid_json(self):
+        log = BeerlogJson(json_file_callable('{abc'), stream=True)
+        assert_that(calling(lambda: list(log.rows())), raises(ImportError, pattern='error decoding ".*"$'))
+
+
 class BeerlogJsonRepoTest(unittest.TestCase):
     def test_enumerate_directories_as_series_names(self):
         root = fs.memoryfs.MemoryFS()
@@ -155,6 +236,73 @@ class BeerlogJsonRepoTest(unittest.TestCase):
         assert_that(len(rows), is_(1), "one row timeseries expected")
         assert_that(rows[0], is_(equal_to(d1)))
 
+    def test_streaming_timeseries_from_jsonfiles_in_folder(self):
+        root = fs.memoryfs.MemoryFS()
+        brew = root.makeopendir("brew")
+        brew.setcontents("brew-01.json", build_json_file(v021_columns, [d1]))
+        repo = BeerlogJsonRepo(root, stream=True)
+        rows = list(repo.fetch("brew").rows())
+        assert_that(rows, is_(equal_to([d1])))
+
+    def test_parallel_timeseries_in_file_order(self):
+        """ given a brew with several files, when the series is read with a worker pool,
+            then the rows are the same as when read serially """
+        root = fs.memoryfs.MemoryFS()
+        brew = root.makeopendir("brew")
+        data = [[t + timedelta(minutes=i)] + d1[1:] for i in range(5)]
+        for i, d in enumerate(data):
+            brew.setcontents("brew-01-%d.json" % (i + 1), build_json_file(v021_columns, [d]))
+        serial = list(BeerlogJsonRepo(root).fetch("brew").rows())
+        parallel = list(BeerlogJsonRepo(root, workers=2, read_ahead=1).fetch("brew").rows())
+        assert_that(serial, is_(equal_to(data)))
+        assert_that(parallel, is_(equal_to(serial)))
+
+    def test_parallel_timeseries_read_by_workers_from_system_paths(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        root = fs.osfs.OSFS(directory)
+        brew = root.makeopendir("brew")
+        data = [[t + timedelta(minutes=i)] + d1[1:] for i in range(4)]
+        brew.setcontents("brew-01.json", build_json_file(v021_columns, data[:2]))
+        brew.setcontents("brew-02.json.gz", gzip.compress(build_json_file(v021_columns, data[2:]).encode('utf-8')))
+        ts = BeerlogJsonRepo(root, workers=2).fetch("brew")
+        assert_that(worker_source(beerlog_source(ts.serieses[0])), is_(instance_of(LogOpener)))
+        assert_that(list(ts.rows()), is_(equal_to(data)))
+
+    def test_parallel_timeseries_unreadable_file(self):
+        root = fs.memoryfs.MemoryFS()
+        brew = root.makeopendir("brew")
+        brew.setcontents("brew-01.json.gz", b'not gzip')
+        ts = BeerlogJsonRepo(root, workers=1).fetch("brew")
+        assert_that(calling(lambda: list(ts.rows())), raises(ImportError, pattern='error decoding ".*"$'))
+
+    def test_parallel_timeseries_invalid_json(self):
+        root = fs.memoryfs.MemoryFS()
+        brew = root.makeopendir("brew")
+        brew.setcontents("brew-01.json", '{abc')
+        ts = BeerlogJsonRepo(root, workers=1).fetch("brew")
+        assert_that(calling(lambda: list(ts.rows())), raises(ImportError, pattern='error decoding ".*"$'))
+
+    def test_timeseries_from_compressed_jsonfiles_in_folder(self):
+        root = fs.memoryfs.MemoryFS()
+        brew = root.makeopendir("brew")
+        data = [[t + timedelta(minutes=i)] + d1[1:] for i in range(4)]
+        brew.setcontents("brew-1.json", build_json_file(v021_columns, data[:1]))
+        for i, (ext, compress) in enumerate((('gz', gzip.compress), ('bz2', bz2.compress), ('xz', lzma.compress)), 2):
+            brew.setcontents("brew-%d.json.%s" % (i, ext),
+                             compress(build_json_file(v021_columns, [data[i - 1]]).encode('utf-8')))
+        for stream in (False, True):
+            rows = list(BeerlogJsonRepo(root, stream=stream).fetch("brew").rows())
+            assert_that(rows, is_(equal_to(data)))
+
+    def test_compressed_copy_of_log_ignored(self):
+        root = fs.memoryfs.MemoryFS()
+        brew = root.makeopendir("brew")
+        text = build_json_file(v021_columns, [d1])
+        brew.setcontents("brew-01.json", text)
+        brew.setcontents("brew-01.json.gz", gzip.compress(text.encode('utf-8')))
+        assert_that(list(BeerlogJsonRepo(root).fetch("brew").rows()), is_(equal_to([d1])))
+
     def test_timeseries_from_old_format_jsonfiles_in_folder(self):
         """ given a "brew" directory with a single file of the format <name>-<numbers>.json containing a single entry,
             when the time series is read
@@ -173,5 +321,72 @@ class BeerlogJsonRepoTest(unittest.TestCase):
             d1_old_row)), "old format is extended with 2 additional columns, filled with None")
 
 
+class BeerlogJsonFollowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = fs.memoryfs.MemoryFS()
+        self.brew = self.root.makeopendir("brew")
+        self.data = [[t + timedelta(minutes=i)] + d1[1:] for i in range(6)]
+
+    def write(self, name, rows):
+        self.brew.setcontents(name, build_json_file(v021_columns, rows))
+
+    def test_new_rows_parsed_from_last_offset(self):
+        self.write("brew-01.json", self.data[:2])
+        log = BeerlogJsonRepo(self.root).fetch("brew").serieses[0]
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[:2])))
+        assert_that(list(log.new_rows()), is_(equal_to([])))
+        self.write("brew-01.json", self.data[:4])
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[2:4])))
+
+    def test_partly_written_row_is_left_until_complete(self):
+        text = build_json_file(v021_columns, self.data[:3])
+        self.brew.setcontents("brew-01.json", text[:-20])
+        log = BeerlogJsonRepo(self.root).fetch("brew").serieses[0]
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[:2])))
+        self.brew.setcontents("brew-01.json", text)
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[2:3])))
+
+    def test_replaced_file_is_read_from_the_start(self):
+        self.write("brew-01.json", self.data[:4])
+        log = BeerlogJsonRepo(self.root).fetch("brew").serieses[0]
+        list(log.new_rows())
+        self.write("brew-01.json", self.data[4:5])
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[4:5])))
+        self.write("brew-01.json", self.data[4:6])
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[5:6])))
+
+    def test_file_replaced_by_a_longer_file_is_read_from_the_start(self):
+        self.write("brew-01.json", self.data[:2])
+        log = BeerlogJsonRepo(self.root).fetch("brew").serieses[0]
+        list(log.new_rows())
+        rows = [[r[0] + timedelta(days=1)] + r[1:] for r in self.data]
+        self.write("brew-01.json", rows)
+        assert_that(list(log.new_rows()), is_(equal_to(rows)))
+        self.write("brew-01.json", rows + self.data[:1])
+        assert_that(list(log.new_rows()), is_(equal_to(self.data[:1])))
+
+    def test_unchanged_file_is_not_read(self):
+        self.write("brew-01.json", self.data[:2])
+        log = BeerlogJsonRepo(self.root).fetch("brew").serieses[0]
+        list(log.new_rows())
+        log.file_callable = None
+        assert_that(list(log.new_rows()), is_(equal_to([])))
+
+    def test_follow_rolls_over_to_new_files(self):
+        self.write("brew-01.json", self.data[:2])
+        stop = Event()
+        rows = BeerlogJsonRepo(self.root).fetch("brew").follow(0.01, stop)
+        assert_that([next(rows), next(rows)], is_(equal_to(self.data[:2])))
+        self.write("brew-01.json", self.data[:3])
+        self.write("brew-02.json", self.data[3:4])
+        self.write("brew-03.json", self.data[4:5])
+        assert_that([next(rows) for _ in range(3)], is_(equal_to(self.data[2:5])))
+        self.write("brew-03.json", self.data[4:6])
+        assert_that(next(rows), is_(equal_to(self.data[5])))
+        stop.set()
+        assert_that(list(rows), is_(equal_to([])))
+
+
 if __name__ == '__main__':
     unittest.main()
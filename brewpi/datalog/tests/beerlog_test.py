@@ -1,7 +1,8 @@
 from unittest.mock import Mock, call
 
 import unittest
-from brewpi.datalog.beerlog import ListTimeSeries, CompositeTimeSeries, TimeSeries
+from brewpi.datalog.beerlog import ListTimeSeries, CompositeTimeSeries, TimeSeries, compile_projection, \
+    select_columns, ts_columns, v010_columns
 from hamcrest import equal_to, is_, assert_that, calling, raises, none
 from datetime import datetime, timedelta
 
@@ -43,9 +44,104 @@ class CompositeTimeSeriesTest(unittest.TestCase):
         assert_that(calling(lambda: next(rows)), raises(ValueError),
                     'second row has an earlier time so should raise ValueError')
 
+    def test_rows_between_stops_after_end(self):
+        """ given a composite of three series, when the rows before a time in the second series are fetched,
+            then the third series is not read """
+        t1 = datetime.now()
+        s1 = ListTimeSeries([[t1, 1], [t1 + timedelta(seconds=1), 2]])
+        s2 = ListTimeSeries([[t1 + timedelta(seconds=2), 3], [t1 + timedelta(seconds=3), 4]])
+        s3 = Mock()
+        s3.range_is_indexed.return_value = False
+        c = CompositeTimeSeries("abc", [s1, s2, s3])
+        rows = list(c.rows_between(t1 + timedelta(seconds=1), t1 + timedelta(seconds=3)))
+        assert_that(rows, is_(equal_to([[t1 + timedelta(seconds=1), 2], [t1 + timedelta(seconds=2), 3]])))
+        assert_that(s3.rows_between.called, is_(False))
+
+
+class MergedCompositeTimeSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.t = [datetime(2016, 3, 27, 1, 0, 0) + timedelta(minutes=i) for i in range(5)]
+
+    def test_overlapping_series_are_merged(self):
+        """ given a logger restarted with a clock that went backwards, when the rows are merged,
+            then they are in ascending time order """
+        s1 = ListTimeSeries([[self.t[0], 1], [self.t[2], 1], [self.t[4], 1]])
+        s2 = ListTimeSeries([[self.t[1], 2], [self.t[3], 2]])
+        c = CompositeTimeSeries("abc", [s1, s2], merge=True)
+        assert_that([r[0] for r in c.rows()], is_(equal_to(self.t)))
+        assert_that(c.count(), is_(5))
+
+    def test_duplicate_policies(self):
+        s1 = ListTimeSeries([[self.t[0], 1], [self.t[1], 1]])
+        s2 = ListTimeSeries([[self.t[1], 2], [self.t[2], 2]])
+        rows = {}
+        for policy in ('keep', 'first', 'last'):
+            rows[policy] = list(CompositeTimeSeries("abc", [s1, s2], True, policy).rows())
+        assert_that(rows['keep'], is_(equal_to([[self.t[0], 1], [self.t[1], 1], [self.t[1], 2], [self.t[2], 2]])))
+        assert_that(rows['first'], is_(equal_to([[self.t[0], 1], [self.t[1], 1], [self.t[2], 2]])))
+        assert_that(rows['last'], is_(equal_to([[self.t[0], 1], [self.t[1], 2], [self.t[2], 2]])))
+        assert_that(CompositeTimeSeries("abc", [s1, s2], True, 'first').count(), is_(3))
+        c = CompositeTimeSeries("abc", [s1, s2], True, 'error')
+        assert_that(calling(lambda: list(c.rows())), raises(ValueError))
+
+    def test_unordered_series_is_not_merged(self):
+        s1 = ListTimeSeries([[self.t[0], 1], [self.t[3], 1]])
+        s2 = ListTimeSeries([[self.t[2], 2], [self.t[1], 2]])
+        c = CompositeTimeSeries("abc", [s1, s2], merge=True)
+        assert_that(calling(lambda: list(c.rows())), raises(ValueError, 'not ascending in series 1'))
+
+    def test_merged_rows_with_unorderable_values(self):
+        s1 = ListTimeSeries([[self.t[0], 1, None]])
+        s2 = ListTimeSeries([[self.t[0], 2, 'Beer temp set']])
+        c = CompositeTimeSeries("abc", [s2, s1], merge=True)
+        assert_that(list(c.rows()), is_(equal_to([[self.t[0], 2, 'Beer temp set'], [self.t[0], 1, None]])))
+
+    def test_merged_rows_between(self):
+        s1 = ListTimeSeries([[self.t[0], 1], [self.t[2], 1], [self.t[4], 1]])
+        s2 = ListTimeSeries([[self.t[1], 2], [self.t[3], 2]])
+        c = CompositeTimeSeries("abc", [s1, s2], merge=True)
+        assert_that([r[0] for r in c.rows_between(self.t[1], self.t[4])], is_(equal_to(self.t[1:4])))
+
+
+class ResampledTimeSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        t = datetime(2016, 1, 1, 11, 50)
+        # beerTemp logged every 5 minutes, with a gap of missing values
+        self.rows = [[t + timedelta(minutes=5 * i), None if 4 <= i < 8 else 20 + i, 18] for i in range(16)]
+
+    def test_resample_composite(self):
+        c = CompositeTimeSeries("abc", [ListTimeSeries(self.rows[:5]), ListTimeSeries(self.rows[5:])])
+        r = c.resample(timedelta(minutes=15), {'beerTemp': ('mean', 'min', 'max', 'count'), 'beerSet': 'last'},
+                       ['time', 'beerTemp', 'beerSet'])
+        rows = list(r.rows())
+        starts = [datetime(2016, 1, 1, 11, 45) + timedelta(minutes=15 * i) for i in range(6)]
+        assert_that([x[0] for x in rows], is_(equal_to(starts)))
+        assert_that(rows[0][1:], is_(equal_to([20.5, 20, 21, 2, 18])))
+        assert_that(rows[2][1:], is_(equal_to([None, None, None, 0, 18])))
+        assert_that(rows[5][1:], is_(equal_to([34.5, 34, 35, 2, 18])))
+
+    def test_resample_is_a_time_series(self):
+        r = ListTimeSeries(self.rows).resample(timedelta(hours=1), {'beerTemp': 'max'}, ['time', 'beerTemp', 'beerSet'])
+        hourly = r.resample(timedelta(days=1), {'beerTemp_max': 'max'}, r.columns)
+        assert_that(list(hourly.rows()), is_(equal_to([[datetime(2016, 1, 1), 35]])))
+
+    def test_unknown_aggregation(self):
+        ts = ListTimeSeries(self.rows)
+        assert_that(calling(ts.resample).with_args(timedelta(minutes=1), {'beerTemp': 'median'}), raises(ValueError))
+        assert_that(calling(ts.resample).with_args(timedelta(minutes=1), {'abv': 'mean'}), raises(ValueError))
+
 
 class TimeSeriesTest(unittest.TestCase):
 
+    def test_rows_between_stops_at_end(self):
+        ts = TimeSeries()
+        rows = iter([[1], [2], [3], [4]])
+        ts.rows = Mock(return_value=rows)
+        assert_that(list(ts.rows_between(2, 3)), is_(equal_to([[2]])))
+        assert_that(next(rows), is_(equal_to([4])), 'rows after the end should not be read')
+
     def test_empty_range_returns_none(self):
         ts = TimeSeries()
         ts.rows = Mock(return_value=[])
@@ -67,5 +163,18 @@ class TimeSeriesTest(unittest.TestCase):
         assert_that(ts.append.mock_calls, is_(equal_to(expected_calls)))
 
 
+class ProjectionTest(unittest.TestCase):
+
+    def test_tuple_rows_with_missing_columns(self):
+        assert_that(select_columns((1, 2), ['a', 'b'], ['b', 'c']), is_(equal_to([2, None])))
+        project = compile_projection(v010_columns, ts_columns)
+        row = (datetime(2015, 1, 1), 20, 19, None, 5, 4, None)
+        assert_that(project(row), is_(equal_to(list(row) + [None, None])))
+
+    def test_missing_columns_placed_in_order(self):
+        project = compile_projection(['a', 'b', 'c'], ['x', 'c', 'y', 'z', 'a', 'w'])
+        assert_that(project((1, 2, 3)), is_(equal_to([None, 3, None, None, 1, None])))
+
+
 if __name__ == '__main__':
     unittest.main()
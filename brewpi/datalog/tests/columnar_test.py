@@ -0,0 +1,54 @@
+import unittest
+from datetime import datetime, timedelta
+
+from hamcrest import assert_that, equal_to, is_, none, calling, raises
+
+from brewpi.datalog.beerlog import ListTimeSeries, CompositeTimeSeries
+from brewpi.datalog.columnar import ColumnarTimeSeries
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+r1 = [t, 20, 10, "beer me", 5, 1, None, 0, 3.5]
+r2 = [t + timedelta(seconds=30), 21, 10, None, None, 1, "fridge", 1, 4]
+r3 = [t + timedelta(minutes=1), None, 11, None, 6, 1, None, None, 4.5]
+
+
+class ColumnarTimeSeriesTest(unittest.TestCase):
+
+    def test_round_trip_from_composite(self):
+        """ given a composite series, when converted to a columnar series and back, then the rows are the same """
+        c = CompositeTimeSeries("abc", [ListTimeSeries([r1, r2]), ListTimeSeries([r3])])
+        ts = ColumnarTimeSeries.from_series(c)
+        assert_that(len(ts), is_(3))
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2, r3])))
+
+    def test_missing_values_are_nan(self):
+        ts = ColumnarTimeSeries.from_rows([r1, r2, r3])
+        assert_that(ts.column('beerTemp').tolist()[:2], is_(equal_to([20.0, 21.0])))
+        assert_that(ts.min('beerTemp'), is_(20.0))
+        assert_that(ts.max('fridgeTemp'), is_(6.0))
+        assert_that(ts.mean('roomTemp'), is_(4.0))
+
+    def test_all_missing_aggregate_is_none(self):
+        ts = ColumnarTimeSeries.from_rows([r3])
+        assert_that(ts.mean('beerTemp'), is_(none()))
+
+    def test_time_slice(self):
+        ts = ColumnarTimeSeries.from_rows([r1, r2, r3])
+        assert_that(list(ts.slice(r2[0]).rows()), is_(equal_to([r2, r3])))
+        assert_that(list(ts.slice(r1[0], r2[0]).rows()), is_(equal_to([r1])))
+        assert_that(ts.slice(r3[0] + timedelta(seconds=1)).range(), is_(none()))
+
+    def test_unordered_rows_are_sorted(self):
+        ts = ColumnarTimeSeries.from_rows([r3, r1, r2])
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2, r3])))
+        assert_that(ts.range(), is_(equal_to((r1[0], r3[0]))))
+
+    def test_append_bulk_keeps_annotations(self):
+        ts = ColumnarTimeSeries.from_rows([r1])
+        ts.append_bulk([r2, r3])
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2, r3])))
+        assert_that(calling(ts.append).with_args(r1), raises(ValueError))
+
+
+if __name__ == '__main__':
+    unittest.main()
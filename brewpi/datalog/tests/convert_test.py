@@ -0,0 +1,274 @@
+import io
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+import fs.memoryfs
+from hamcrest import assert_that, equal_to, is_
+from influxdb.influxdb08.client import InfluxDBClientError
+
+from brewpi.datalog.beerlog import ListTimeSeries, TimeSeriesRepo, v021_columns
+from brewpi.datalog.beerlog_json import BeerlogJsonRepo, BeerlogJson
+from brewpi.datalog.convert import ConvertState, ConvertStats, convert, convert_series, import_stream, main, \
+    pipelined
+from brewpi.datalog.influxdb.db import InfluxDBTimeSeries
+from brewpi.datalog.pipeline import Dedup, Project, Resample, ToUtc
+from brewpi.datalog.range_index import RangeIndex
+from brewpi.datalog.tests.beerlog_json_test import build_json_file
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+
+
+def row(minutes):
+    return [t + timedelta(minutes=minutes), 20, 10, None, 5, 1, None, 0, 3.5]
+
+
+class ListTimeSeriesRepo(TimeSeriesRepo):
+    """ a destination repo holding each series in a list """
+
+    def __init__(self):
+        self.series = {}
+        self.columns = {}
+
+    def names(self):
+        return list(self.series)
+
+    def fetch(self, name):
+        return self.series.setdefault(name, ListTimeSeries([]))
+
+    def create(self, name, columns=None):
+        self.columns[name] = columns
+        return self.fetch(name)
+
+
+class UnqueryableTimeSeries(ListTimeSeries):
+
+    def range(self):
+        raise NotImplementedError
+
+
+class NewInfluxDBRepo(TimeSeriesRepo):
+    """ an influxdb repo whose queries fail as InfluxDB 0.8 does for a series that doesn't exist yet """
+
+    def __init__(self):
+        self.query = Mock(side_effect=InfluxDBClientError(b"Couldn't find series: brew", 400))
+        self.insert = Mock()
+
+    def create(self, name, columns=None):
+        return InfluxDBTimeSeries(self, name, columns)
+
+
+class ConvertSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = fs.memoryfs.MemoryFS()
+        self.brew = self.root.makeopendir("brew")
+        self.brew.setcontents("brew-01.json", build_json_file(v021_columns, [row(0), row(1)]))
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3)]))
+        self.dst = ListTimeSeriesRepo()
+
+    def convert(self):
+        return convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(self.root), 3)
+
+    def dst_rows(self):
+        return self.dst.fetch('brew').rows()
+
+    def test_first_run_imports_all_rows(self):
+        assert_that(self.convert(), is_(4))
+        assert_that(self.dst_rows(), is_(equal_to([row(i) for i in range(4)])))
+        state = ConvertState(self.root).series('brew')
+        assert_that(state['high_water'], is_(1433160180000))
+        assert_that(sorted(state['files']), is_(equal_to(['brew/brew-01.json', 'brew/brew-02.json'])))
+
+    def test_unchanged_files_are_not_read(self):
+        self.convert()
+        with patch.object(BeerlogJson, 'rows', side_effect=AssertionError('file should not be parsed')):
+            assert_that(self.convert(), is_(0))
+
+    def test_only_new_rows_imported(self):
+        self.convert()
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3), row(4)]))
+        self.brew.setcontents("brew-03.json", build_json_file(v021_columns, [row(5)]))
+        assert_that(self.convert(), is_(2))
+        assert_that(self.dst_rows(), is_(equal_to([row(i) for i in range(6)])))
+
+    def test_cleared_destination_is_reimported(self):
+        self.convert()
+        self.dst = ListTimeSeriesRepo()
+        assert_that(self.convert(), is_(4))
+        assert_that(self.dst_rows(), is_(equal_to([row(i) for i in range(4)])))
+
+    def test_new_influxdb_series_imports_all_rows(self):
+        self.dst = NewInfluxDBRepo()
+        assert_that(self.convert(), is_(4))
+        assert_that(self.dst.query.called, is_(True))
+        assert_that(self.dst.insert.call_count, is_(2))
+
+    def test_destination_not_queried_when_told(self):
+        self.dst.series['brew'] = UnqueryableTimeSeries([])
+        self.dst.series['brew'].range = Mock(side_effect=AssertionError('destination should not be queried'))
+        count = convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(fs.memoryfs.MemoryFS()), 3,
+                               query_destination=False)
+        assert_that(count, is_(4))
+
+    def test_state_used_when_destination_cannot_report_range(self):
+        self.dst.series['brew'] = UnqueryableTimeSeries([])
+        self.convert()
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3), row(4)]))
+        assert_that(self.convert(), is_(1))
+        assert_that(self.dst_rows(), is_(equal_to([row(i) for i in range(5)])))
+
+    def test_stages_applied(self):
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(1), row(2), row(3)]))
+        count = convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(self.root), 3,
+                               stages=[Dedup(), Project(['beerTemp'])])
+        assert_that(count, is_(4))
+        assert_that(self.dst.columns['brew'], is_(equal_to(['time', 'beerTemp'])))
+        assert_that(self.dst_rows(), is_(equal_to([[row(i)[0], 20] for i in range(4)])))
+
+    def test_stages_resume_from_state(self):
+        stages = [Project(['beerTemp'])]
+        convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(self.root), 3, stages=stages)
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3), row(4)]))
+        count = convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(self.root), 3,
+                               stages=stages)
+        assert_that(count, is_(1))
+        assert_that([r[0] for r in self.dst_rows()], is_(equal_to([row(i)[0] for i in range(5)])))
+
+    def test_resampled_intervals_not_duplicated_across_runs(self):
+        stages = [ToUtc(timezone(timedelta(hours=1))), Resample(timedelta(minutes=2), {'beerTemp': 'count'})]
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2)]))
+        convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(self.root), 3, stages=stages)
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3)]))
+        self.brew.setcontents("brew-03.json", build_json_file(v021_columns, [row(4)]))
+        convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', ConvertState(self.root), 3, stages=stages)
+        utc = t - timedelta(hours=1)
+        # the interval at 4 minutes is written once a later row is read
+        assert_that(self.dst_rows(), is_(equal_to([[utc, 2], [utc + timedelta(minutes=2), 2]])))
+
+    def test_range_index_saved_once_per_series(self):
+        self.convert()
+        self.brew.setcontents("brew-01.json", build_json_file(v021_columns, [row(0), row(1)]))
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3)]))
+        src = BeerlogJsonRepo(self.root, index=RangeIndex(self.root))
+        with patch.object(RangeIndex, 'save', autospec=True, side_effect=RangeIndex.save) as save:
+            assert_that(convert_series(src, self.dst, 'brew', ConvertState(self.root), 3), is_(0))
+        assert_that(save.call_count, is_(1))
+        assert_that(len(RangeIndex(self.root).entries), is_(2))
+
+    def test_state_saved_in_place_of_the_old_state(self):
+        self.convert()
+        assert_that(sorted(self.root.listdir(files_only=True)), is_(equal_to(['.convert-state.json'])))
+
+    def test_unreadable_state_is_ignored(self):
+        self.root.setcontents('.convert-state.json', b'{"version": 1, "series": {"brew": {"high_w')
+        with self.assertLogs('brewpi.datalog.convert', 'WARNING'):
+            state = ConvertState(self.root)
+        assert_that(state.entries, is_(equal_to({})))
+        assert_that(convert_series(BeerlogJsonRepo(self.root), self.dst, 'brew', state, 3), is_(4))
+
+    def test_any_repo_as_source(self):
+        src = ListTimeSeriesRepo()
+        src.series['brew'] = ListTimeSeries([row(i) for i in range(4)])
+        convert_series(src, self.dst, 'brew', ConvertState(self.root), 3)
+        src.series['brew'].data.append(row(4))
+        assert_that(convert_series(src, self.dst, 'brew', ConvertState(self.root), 3), is_(1))
+        assert_that(self.dst_rows(), is_(equal_to([row(i) for i in range(5)])))
+
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = fs.memoryfs.MemoryFS()
+        self.names = ['brew%d' % i for i in range(5)]
+        for i, name in enumerate(self.names):
+            brew = self.root.makeopendir(name)
+            brew.setcontents(name + "-01.json", build_json_file(v021_columns, [row(j) for j in range(i + 1)]))
+            brew.setcontents(name + "-02.json", build_json_file(v021_columns, [row(10 + j) for j in range(i + 1)]))
+        self.dst = ListTimeSeriesRepo()
+
+    def test_series_converted_in_parallel(self):
+        stats = ConvertStats()
+        results = list(convert(BeerlogJsonRepo(self.root), self.dst, self.names, ConvertState(self.root), 3, stats,
+                               chunk_size=2))
+        assert_that(results, is_(equal_to([(name, 2 * (i + 1)) for i, name in enumerate(self.names)])))
+        for i, name in enumerate(self.names):
+            expected = [row(j) for j in range(i + 1)] + [row(10 + j) for j in range(i + 1)]
+            assert_that(self.dst.fetch(name).rows(), is_(equal_to(expected)))
+        assert_that(stats.rows, is_(30))
+        assert_that(stats.bytes, is_(sum(self.root.getsize('%s/%s-%s.json' % (name, name, n))
+                                         for name in self.names for n in ('01', '02'))))
+
+    def test_errors_are_raised(self):
+        self.root.setcontents('brew2/brew2-02.json', b'not json')
+        with self.assertRaises(ImportError):
+            list(convert(BeerlogJsonRepo(self.root), self.dst, self.names, ConvertState(self.root), 3))
+
+
+class BatchRecordingTimeSeries(ListTimeSeries):
+
+    def __init__(self):
+        super().__init__([])
+        self.batches = []
+
+    def append_bulk(self, rows):
+        self.batches.append(len(rows))
+        super().append_bulk(rows)
+
+
+class ImportStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO(build_json_file(v021_columns, [row(i) for i in range(5)]))
+        self.dst = BatchRecordingTimeSeries()
+
+    def test_rows_appended_in_batches(self):
+        stats = ConvertStats()
+        assert_that(import_stream(self.dst, self.stream, 2, stats=stats), is_(5))
+        assert_that(self.dst.rows(), is_(equal_to([row(i) for i in range(5)])))
+        assert_that(self.dst.batches, is_(equal_to([2, 2, 1])))
+        assert_that(stats.rows, is_(5))
+        assert_that(self.stream.closed, is_(False))
+
+    def test_dry_run_appends_nothing(self):
+        assert_that(import_stream(None, self.stream, 2, dry_run=True), is_(5))
+
+    def test_batches_bounded_in_time(self):
+        import_stream(self.dst, self.stream, 10, max_delay=0)
+        assert_that(self.dst.batches, is_(equal_to([1] * 5)))
+
+
+class PipelinedTest(unittest.TestCase):
+
+    def test_producer_error_raised_to_consumer(self):
+        def produce():
+            yield 1
+            raise KeyError('x')
+        it = pipelined(produce(), 1)
+        assert_that(next(it), is_(1))
+        with self.assertRaises(KeyError):
+            next(it)
+
+    def test_consumer_stopping_early_stops_producer(self):
+        it = pipelined(iter(range(1000)), 2)
+        assert_that(next(it), is_(0))
+        it.close()
+
+
+class MainTest(unittest.TestCase):
+
+    def test_sink_location_required_for_file_sinks(self):
+        for sink_type in ('sqlite', 'segments'):
+            with patch('sys.stderr', io.StringIO()) as stderr:
+                self.assertRaises(SystemExit, main, ['logs', '--sink-type', sink_type])
+            assert_that('--sink is required' in stderr.getvalue(), is_(True))
+
+    def test_source_location_required_for_file_sources(self):
+        with patch('sys.stderr', io.StringIO()) as stderr:
+            self.assertRaises(SystemExit, main, ['', '--source-type', 'sqlite', '--sink-type', 'segments',
+                                                 '--sink', 'out'])
+        assert_that('a source location is required' in stderr.getvalue(), is_(True))
+
+
+if __name__ == '__main__':
+    unittest.main()
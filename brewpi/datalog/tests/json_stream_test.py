@@ -0,0 +1,30 @@
+import io
+import unittest
+from unittest.mock import Mock
+
+from hamcrest import assert_that, equal_to, is_, less_than
+
+from brewpi.datalog.json_stream import JsonStream
+
+
+class JsonStreamValueTest(unittest.TestCase):
+
+    def test_value_read_in_many_chunks_is_decoded_a_few_times(self):
+        text = '"%s"' % ('x' * 100000)
+        s = JsonStream(io.StringIO(text), 100)
+        s.decoder.raw_decode = Mock(wraps=s.decoder.raw_decode)
+        assert_that(s.value(), is_(equal_to(text[1:-1])))
+        assert_that(s.decoder.raw_decode.call_count, is_(less_than(20)))
+
+    def test_malformed_value_does_not_buffer_the_file(self):
+        f = io.StringIO('[1, 2 3, ' + '4, ' * 100000 + ']')
+        s = JsonStream(f, 100, max_value_size=1000)
+        self.assertRaises(ValueError, s.value)
+        assert_that(f.tell(), is_(less_than(2000)))
+
+    def test_malformed_value_at_end_of_file_raises(self):
+        self.assertRaises(ValueError, JsonStream(io.StringIO('[1, 2 3]'), 2).value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from hamcrest import assert_that, equal_to, is_
+
+from brewpi.datalog.beerlog import ts_columns
+from brewpi.datalog.pipeline import Dedup, Project, Resample, ToUtc, apply_stages, chunker
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+
+
+def row(seconds, beer=20):
+    return [t + timedelta(seconds=seconds), beer, 10, None, 5, 1, None, 0, 3.5]
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_stages_chained(self):
+        rows = [row(0, 18), row(0, 19), row(30, 20), row(60, 21), row(90, 22)]
+        stages = [ToUtc(timezone(timedelta(hours=1))), Dedup(), Project(['beerTemp', 'fridgeTemp']),
+                  Resample(timedelta(minutes=1), {'beerTemp': 'mean', 'fridgeTemp': 'max'})]
+        batches, columns = apply_stages(chunker(rows, 2), ts_columns, stages, 10)
+        assert_that(columns, is_(equal_to(['time', 'beerTemp_mean', 'fridgeTemp_max'])))
+        assert_that(list(batches), is_(equal_to([[[t - timedelta(hours=1), 19, 5],
+                                                  [t - timedelta(minutes=59), 21.5, 5]]])))
+
+    def test_rows_are_streamed(self):
+        read = []
+
+        def rows():
+            for i in range(100):
+                read.append(i)
+                yield row(i)
+        batches, _ = apply_stages(chunker(rows(), 10), ts_columns, [Dedup(), Project(['beerTemp'])], 10)
+        next(batches)
+        assert_that(len(read), is_(10))
+
+    def test_chunk_ends_while_waiting_for_items(self):
+        first = threading.Event()
+
+        def items():
+            yield 1
+            first.wait(5)       # the next item is produced once the first chunk has been received
+            yield 2
+        chunks = chunker(items(), 10, 0.05)
+        assert_that(next(chunks), is_(equal_to([1])))
+        first.set()
+        assert_that(list(chunks), is_(equal_to([[2]])))
+
+    def test_timed_chunker_raises_source_errors(self):
+        def items():
+            yield 1
+            raise KeyError('x')
+        with self.assertRaises(KeyError):
+            list(chunker(items(), 10, 60))
+
+    def test_dedup_last_across_batches(self):
+        batches, _ = apply_stages([[row(0, 1)], [row(0, 2)], [row(0, 3), row(1, 4)]], ts_columns, [Dedup('last')], 10)
+        assert_that([[r[1] for r in b] for b in batches], is_(equal_to([[3], [4]])))
+
+    def test_unknown_dedup_policy(self):
+        with self.assertRaises(ValueError):
+            Dedup('middle')
+
+
+if __name__ == '__main__':
+    unittest.main()
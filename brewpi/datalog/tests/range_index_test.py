@@ -0,0 +1,107 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import fs.memoryfs
+from hamcrest import assert_that, equal_to, is_, none
+
+from brewpi.datalog.beerlog import v021_columns
+from brewpi.datalog.beerlog_json import BeerlogJsonRepo, BeerlogJson
+from brewpi.datalog.range_index import RangeIndex
+from brewpi.datalog.tests.beerlog_json_test import build_json_file
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+
+
+def row(minutes):
+    return [t + timedelta(minutes=minutes), 20, 10, None, 5, 1, None, 0, 3.5]
+
+
+class RangeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = fs.memoryfs.MemoryFS()
+        self.brew = self.root.makeopendir("brew")
+        self.brew.setcontents("brew-01.json", build_json_file(v021_columns, [row(0), row(1)]))
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3), row(4)]))
+        self.brew.setcontents("brew-03.json", build_json_file(v021_columns, []))
+
+    def fetch(self):
+        return BeerlogJsonRepo(self.root, index=RangeIndex(self.root)).fetch("brew")
+
+    def test_range_and_count_from_index(self):
+        ts = self.fetch()
+        assert_that(ts.range(), is_(equal_to((row(0)[0], row(4)[0]))))
+        assert_that(ts.count(), is_(5))
+
+    def test_index_is_persisted(self):
+        self.fetch().range()
+        with patch.object(BeerlogJson, 'rows', side_effect=AssertionError('file should not be parsed')):
+            ts = self.fetch()
+            assert_that(ts.range(), is_(equal_to((row(0)[0], row(4)[0]))))
+            assert_that(ts.count(), is_(5))
+
+    def test_index_saved_once_per_range(self):
+        with patch.object(RangeIndex, 'save', autospec=True, side_effect=RangeIndex.save) as save:
+            self.fetch().range()
+            self.fetch().count()
+        assert_that(save.call_count, is_(1))
+        assert_that(sorted(self.root.listdir()), is_(equal_to(['.range-index.json', 'brew'])))
+
+    def test_entry_outside_batch_is_saved(self):
+        index = RangeIndex(self.root)
+        index.entry(['brew/brew-01.json', 1, 2], BeerlogJson(lambda: self.brew.open('brew-01.json')))
+        assert_that(RangeIndex(self.root).entries['brew/brew-01.json']['count'], is_(2))
+        assert_that(index.dirty, is_(False))
+
+    def test_entries_saved_from_several_threads(self):
+        index = RangeIndex(self.root)
+        log = BeerlogJson(lambda: self.brew.open('brew-01.json'))
+        errors = []
+
+        def index_files(n):
+            try:
+                for i in range(20):
+                    index.entry(['brew/%d-%d.json' % (n, i), 1, 2], log)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=index_files, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_that(errors, is_(equal_to([])))
+        assert_that(len(RangeIndex(self.root).entries), is_(80))
+
+    def test_changed_file_is_reindexed(self):
+        self.fetch().range()
+        self.brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(2), row(3), row(4), row(5)]))
+        ts = self.fetch()
+        assert_that(ts.range(), is_(equal_to((row(0)[0], row(5)[0]))))
+        assert_that(ts.count(), is_(6))
+
+    def test_empty_series_range_is_none(self):
+        self.brew.remove("brew-01.json")
+        self.brew.remove("brew-02.json")
+        assert_that(self.fetch().range(), is_(none()))
+
+    def test_rows_between_skips_files_outside_window(self):
+        self.fetch().range()
+        opened = []
+        original = BeerlogJson.rows
+
+        def rows(log):
+            opened.append(log)
+            return original(log)
+        with patch.object(BeerlogJson, 'rows', rows):
+            rows = list(self.fetch().rows_between(row(2)[0], row(4)[0]))
+        assert_that(rows, is_(equal_to([row(2), row(3)])))
+        assert_that(len(opened), is_(1))
+
+    def test_rows_unchanged(self):
+        assert_that(list(self.fetch().rows()), is_(equal_to([row(i) for i in range(5)])))
+
+
+if __name__ == '__main__':
+    unittest.main()
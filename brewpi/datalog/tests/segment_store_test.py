@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from hamcrest import assert_that, equal_to, is_, none
+
+from brewpi.datalog.segment_store import SegmentTimeSeries, SegmentTimeSeriesRepo
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+
+
+def row(minutes):
+    return [t + timedelta(minutes=minutes), 20.5, 10.0, "ann %d" % (minutes % 3) if minutes % 2 else None,
+            5.0, 1.0, None, 0.0, 3.5]
+
+
+class SegmentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.repo = SegmentTimeSeriesRepo(self.dir, segment_records=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def segment_files(self, name='brew'):
+        return sorted(f for f in os.listdir(self.repo._path(name)) if f.endswith('.seg'))
+
+    def test_new_series_is_empty(self):
+        ts = self.repo.create('brew')
+        assert_that(list(ts.rows()), is_(equal_to([])))
+        assert_that(ts.range(), is_(none()))
+        assert_that(ts.count(), is_(0))
+
+    def test_rows_round_trip_across_segments(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(i) for i in range(6)])
+        ts.append_bulk([row(i) for i in range(6, 10)])
+        assert_that(self.segment_files(), is_(equal_to(['00000000.seg', '00000001.seg', '00000002.seg'])))
+        assert_that(list(self.repo.fetch('brew').rows()), is_(equal_to([row(i) for i in range(10)])))
+        assert_that(ts.count(), is_(10))
+
+    def test_range_reads_first_and_last_records(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(i) for i in range(10)])
+        with patch('brewpi.datalog.segment_store._map', side_effect=AssertionError('segments should not be mapped')):
+            assert_that(ts.range(), is_(equal_to((row(0)[0], row(9)[0]))))
+
+    def test_rows_between(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(i) for i in range(10)])
+        assert_that(list(ts.rows_between(row(3)[0], row(6)[0])), is_(equal_to([row(3), row(4), row(5)])))
+        assert_that(list(ts.rows_between(row(8)[0])), is_(equal_to([row(8), row(9)])))
+        assert_that(list(ts.rows_between(None, row(0)[0])), is_(equal_to([])))
+
+    def test_times_must_ascend(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(5)])
+        with self.assertRaises(ValueError):
+            ts.append_bulk([row(4)])
+        with self.assertRaises(ValueError):
+            ts.append_bulk([row(7), row(6)])
+        assert_that(ts.count(), is_(1))
+
+    def test_partial_record_ignored_and_overwritten(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(0)])
+        with open(os.path.join(self.repo._path('brew'), '00000000.seg'), 'ab') as f:
+            f.write(b'\1\2\3')
+        assert_that(list(ts.rows()), is_(equal_to([row(0)])))
+        ts.append_bulk([row(1)])
+        assert_that(list(ts.rows()), is_(equal_to([row(0), row(1)])))
+
+    def test_strings_appended_by_another_writer_are_read(self):
+        reader = self.repo.create('brew')
+        list(reader.rows())
+        self.repo.fetch('brew').append_bulk([row(1), row(3)])
+        assert_that(list(reader.rows()), is_(equal_to([row(1), row(3)])))
+
+    def test_float32_records(self):
+        repo = SegmentTimeSeriesRepo(self.dir, 'f4')
+        ts = repo.create('small', ['time', 'beerTemp'])
+        ts.append_bulk([[t, 20.5], [t + timedelta(seconds=1), None]])
+        assert_that(ts.dtype.itemsize, is_(12))
+        assert_that(list(ts.rows()), is_(equal_to([[t, 20.5], [t + timedelta(seconds=1), None]])))
+
+    def test_names_and_delete(self):
+        self.repo.create('brew/1')
+        self.repo.create('brew 2')
+        assert_that(self.repo.names(), is_(equal_to(['brew 2', 'brew/1'])))
+        self.repo.delete('brew/1')
+        assert_that(self.repo.names(), is_(equal_to(['brew 2'])))
+        with self.assertRaises(KeyError):
+            self.repo.fetch('brew/1')
+
+    def test_segments_are_views(self):
+        ts = self.repo.create('brew')
+        ts.append_bulk([row(i) for i in range(3)])
+        segment = next(SegmentTimeSeries(self.repo._path('brew')).segments())
+        assert_that(segment.column('beerTemp').base is not None, is_(True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import fs.osfs
+from hamcrest import assert_that, equal_to, is_, none, has_length
+
+from brewpi.datalog.beerlog import ListTimeSeries, v021_columns
+from brewpi.datalog.beerlog_json import BeerlogJsonRepo
+from brewpi.datalog.columnar import ColumnarTimeSeries
+from brewpi.datalog.sidecar import SidecarCache, read_sidecar, write_sidecar
+from brewpi.datalog.tests.beerlog_json_test import build_json_file
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+r1 = [t, 20, 10, "beer me", 5, 1, None, 0, 3.5]
+r2 = [t + timedelta(seconds=30), 21, 10, None, None, 1, "fridge", 1, 4]
+
+
+class SidecarCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = SidecarCache(os.path.join(self.dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write_read_round_trip(self):
+        path = os.path.join(self.dir, 'a.sidecar')
+        write_sidecar(path, ['a', 1, 'x'], ColumnarTimeSeries.from_rows([r1, r2]))
+        ts = read_sidecar(path)
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2])))
+        assert_that(read_sidecar(path, ['a', 2, 'x']), is_(none()))
+
+    def test_empty_series_round_trip(self):
+        path = os.path.join(self.dir, 'a.sidecar')
+        write_sidecar(path, ['a', 1, 'x'], ColumnarTimeSeries.from_rows([]))
+        assert_that(list(read_sidecar(path).rows()), is_(equal_to([])))
+
+    def test_cached_series_reads_source_once(self):
+        source = ListTimeSeries([r1, r2])
+        source.rows = Mock(wraps=source.rows)
+        ts = self.cache.series(lambda: ['a', 1, 'x'], source)
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2])))
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2])))
+        assert_that(source.rows.mock_calls, has_length(1))
+
+    def test_changed_source_invalidates_cache(self):
+        key = ['a', 1, 'x']
+        source = ListTimeSeries([r1])
+        ts = self.cache.series(lambda: key, source)
+        list(ts.rows())
+        source.data.append(r2)
+        key = ['a', 2, 'y']
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2])))
+
+    def test_unordered_source_is_not_cached(self):
+        source = ListTimeSeries([r2, r1])
+        ts = self.cache.series(lambda: ['a', 1, 'x'], source)
+        assert_that(list(ts.rows()), is_(equal_to([r2, r1])))
+        assert_that(os.listdir(self.cache.directory), is_(equal_to([])))
+
+    def test_least_recently_used_evicted(self):
+        for name in 'abc':
+            self.cache.put([name, 1, 'x'], ColumnarTimeSeries.from_rows([r1, r2]))
+            os.utime(self.cache.sidecar_path(name), (0, ord(name)))
+        size = os.path.getsize(self.cache.sidecar_path('a'))
+        self.cache.get(['a', 1, 'x'])      # a is now most recently used
+        self.cache.max_bytes = 2 * size
+        self.cache.evict()
+        assert_that(os.path.exists(self.cache.sidecar_path('a')), is_(True))
+        assert_that(os.path.exists(self.cache.sidecar_path('b')), is_(False))
+        assert_that(os.path.exists(self.cache.sidecar_path('c')), is_(True))
+
+    def test_truncated_sidecar_is_a_miss(self):
+        source = Mock(wraps=ListTimeSeries([r1, r2]))
+        ts = self.cache.series(lambda: ['a', 1, 'x'], source)
+        list(ts.rows())
+        path = self.cache.sidecar_path('a')
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 8)
+        self.assertRaises(ValueError, read_sidecar, path)
+        assert_that(self.cache.get(['a', 1, 'x']), is_(none()))
+        assert_that(os.path.exists(path), is_(False))
+        assert_that(list(ts.rows()), is_(equal_to([r1, r2])))
+        assert_that(source.rows.call_count, is_(equal_to(2)))
+        assert_that(self.cache.total, is_(equal_to(os.path.getsize(path))))
+
+    def test_existing_sidecars_counted(self):
+        self.cache.put(['a', 1, 'x'], ColumnarTimeSeries.from_rows([r1, r2]))
+        cache = SidecarCache(self.cache.directory)
+        assert_that(cache.total, is_(equal_to(os.path.getsize(self.cache.sidecar_path('a')))))
+
+    def test_repo_with_cache(self):
+        root = fs.osfs.OSFS(self.dir)
+        root.makedir('brew')
+        root.setcontents('brew/brew-01.json', build_json_file(v021_columns, [r1, r2]))
+        repo = BeerlogJsonRepo(root, cache=self.cache)
+        assert_that(list(repo.fetch('brew').rows()), is_(equal_to([r1, r2])))
+        assert_that(os.listdir(self.cache.directory), has_length(1))
+        assert_that(list(repo.fetch('brew').rows()), is_(equal_to([r1, r2])))
+
+    def test_cached_rows_keep_their_types(self):
+        rows = [r1, r2, [t + timedelta(minutes=1), 20.5, 10, None, 4.25, 1, None, '0', None],
+                [t + timedelta(minutes=2), None, 10.5, None, 4, 1, None, True, 3]]
+        ts = self.cache.series(lambda: ['a', 1, 'x'], ListTimeSeries(rows))
+        list(ts.rows())
+        for cached in (list(ts.rows()), list(ts.rows_between(t + timedelta(seconds=30)))):
+            expected = rows[-len(cached):]
+            assert_that(cached, is_(equal_to(expected)))
+            assert_that([[type(v) for v in r] for r in cached], is_(equal_to([[type(v) for v in r] for r in expected])))
+
+
+if __name__ == '__main__':
+    unittest.main()
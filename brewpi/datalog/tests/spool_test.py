@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from hamcrest import assert_that, equal_to, is_, has_length
+
+from brewpi.datalog.spool import Spool, ack_file
+
+
+class FailingWriter:
+    """ collects the requests written, failing while offline """
+
+    def __init__(self, online=True):
+        self.online = online
+        self.requests = []
+
+    def __call__(self, requests):
+        if not self.online:
+            raise IOError('offline')
+        self.requests.extend(requests)
+
+
+class GatedWriter(FailingWriter):
+    """ a writer whose first write waits until it is released """
+
+    def __init__(self, online=True):
+        super().__init__(online)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, requests):
+        self.writing.set()
+        self.release.wait()
+        super().__call__(requests)
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spools = []
+
+    def tearDown(self):
+        for s in self.spools:
+            s.close(0)
+        shutil.rmtree(self.dir)
+
+    def spool(self, write, **kwargs):
+        kwargs.setdefault('retry_interval', 0.01)
+        s = Spool(self.dir, write, **kwargs)
+        self.spools.append(s)
+        return s
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.dir) if name.endswith('.seg'))
+
+    def test_requests_written_in_order(self):
+        writer = FailingWriter()
+        s = self.spool(writer, max_batch=3, segment_bytes=50)
+        for i in range(20):
+            s.append({'n': i})
+        assert_that(s.flush(5), is_(True))
+        assert_that([r['n'] for r in writer.requests], is_(equal_to(list(range(20)))))
+
+    def test_written_segments_are_removed(self):
+        s = self.spool(FailingWriter(), segment_bytes=50)
+        for i in range(20):
+            s.append({'n': i})
+        s.flush(5)
+        assert_that(self.segments(), has_length(1))
+        assert_that(s.stats()['pending'], is_(0))
+
+    def test_requests_kept_while_offline(self):
+        writer = FailingWriter(online=False)
+        s = self.spool(writer)
+        for i in range(5):
+            s.append({'n': i})
+        assert_that(s.flush(0.1), is_(False))
+        assert_that(s.stats()['written'], is_(0))
+        writer.online = True
+        assert_that(s.flush(5), is_(True))
+        assert_that([r['n'] for r in writer.requests], is_(equal_to(list(range(5)))))
+
+    def test_unwritten_requests_resume_after_restart(self):
+        first = self.spool(FailingWriter(online=False))
+        for i in range(5):
+            first.append({'n': i})
+        first.close(0)
+        writer = FailingWriter()
+        s = self.spool(writer)
+        s.append({'n': 5})
+        s.flush(5)
+        assert_that([r['n'] for r in writer.requests], is_(equal_to(list(range(6)))))
+
+    def test_acknowledged_requests_not_rewritten_after_restart(self):
+        first = self.spool(FailingWriter())
+        for i in range(3):
+            first.append({'n': i})
+        first.close(5)
+        assert_that(os.path.exists(os.path.join(self.dir, ack_file)), is_(True))
+        writer = FailingWriter()
+        s = self.spool(writer)
+        s.append({'n': 3})
+        s.flush(5)
+        assert_that([r['n'] for r in writer.requests], is_(equal_to([3])))
+
+    def test_incomplete_line_is_ignored(self):
+        first = self.spool(FailingWriter(online=False))
+        first.append({'n': 0})
+        first.close(0)
+        with open(os.path.join(self.dir, self.segments()[-1]), 'ab') as f:
+            f.write(b'{"n":')
+        writer = FailingWriter()
+        s = self.spool(writer)
+        s.append({'n': 1})
+        s.flush(5)
+        assert_that([r['n'] for r in writer.requests], is_(equal_to([0, 1])))
+
+    def test_undecodable_line_is_counted_dropped(self):
+        first = self.spool(FailingWriter(online=False))
+        first.append({'n': 0})
+        with open(os.path.join(self.dir, self.segments()[-1]), 'ab') as f:
+            f.write(b'{"n":\n')
+        first.close(0)
+        writer = FailingWriter()
+        with self.assertLogs('brewpi.datalog.spool', 'WARNING'):
+            s = self.spool(writer)
+            s.append({'n': 1})
+            assert_that(s.flush(5), is_(True))
+        assert_that([r['n'] for r in writer.requests], is_(equal_to([0, 1])))
+        assert_that(s.stats(), is_(equal_to({'pending': 0, 'written': 2, 'dropped': 1})))
+
+    def test_oldest_segments_dropped_when_full(self):
+        writer = GatedWriter(online=False)
+        s = self.spool(writer, segment_bytes=20, max_bytes=50)
+        s.append({'n': 0})
+        writer.writing.wait()       # the drain thread is writing [0]
+        for i in range(1, 10):
+            s.append({'n': i})      # each request is 9 bytes, so each segment holds 3
+        assert_that(s.stats()['dropped'], is_(5))
+        writer.release.set()        # the write of [0] fails, and it is dropped with its segment
+        with s.lock:
+            assert_that(s.lock.wait_for(lambda: s.dropped == 6, 5), is_(True))
+        writer.online = True
+        s.flush(5)
+        assert_that([r['n'] for r in writer.requests], is_(equal_to([6, 7, 8, 9])))
+        assert_that(s.stats()['dropped'], is_(6))
+
+    def test_batch_written_while_its_segment_is_dropped_is_not_counted_dropped(self):
+        writer = GatedWriter()
+        s = self.spool(writer, segment_bytes=20, max_bytes=50)
+        s.append({'n': 0})
+        writer.writing.wait()
+        for i in range(1, 10):
+            s.append({'n': i})
+        writer.release.set()
+        s.flush(5)
+        assert_that([r['n'] for r in writer.requests], is_(equal_to([0, 6, 7, 8, 9])))
+        assert_that(s.stats(), is_(equal_to({'pending': 0, 'written': 5, 'dropped': 5})))
+
+    def test_closed_spool_rejects_appends(self):
+        s = self.spool(FailingWriter())
+        s.close()
+        with self.assertRaises(ValueError):
+            s.append({})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import fs.memoryfs
+import fs.osfs
+import fs.utils
+from hamcrest import assert_that, equal_to, is_, none
+
+from brewpi.datalog.beerlog import ListTimeSeries, TimeSeries, v021_columns
+from brewpi.datalog.beerlog_json import BeerlogJsonRepo
+from brewpi.datalog.stats import SeriesStats, series_stats
+from brewpi.datalog.tests.beerlog_json_test import build_json_file
+
+t = datetime(2015, 6, 1, 12, 0, 0)
+
+
+def row(minutes, beer=20):
+    return [t + timedelta(minutes=minutes), beer, 10, "ann" if minutes == 0 else None, None, 1, None, 0, 3.5]
+
+
+class SeriesStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = fs.memoryfs.MemoryFS()
+        brew = self.root.makeopendir("brew")
+        brew.setcontents("brew-01.json", build_json_file(v021_columns, [row(0, 18), row(1, 19), row(2, 20)]))
+        brew.setcontents("brew-02.json", build_json_file(v021_columns, [row(30, 24), row(31, 21)]))
+        brew.setcontents("brew-03.json", build_json_file(v021_columns, [row(32, 22), row(60, 20)]))
+
+    def series(self):
+        return BeerlogJsonRepo(self.root).fetch('brew')
+
+    def check(self, s):
+        assert_that(s.count, is_(7))
+        assert_that(s.range, is_(equal_to((row(0)[0], row(60)[0]))))
+        assert_that(s.gap_count, is_(2))
+        assert_that(s.gaps, is_(equal_to([(row(2)[0], row(30)[0]), (row(32)[0], row(60)[0])])))
+        beer = s.columns[0]
+        assert_that((beer.min, beer.max, beer.mean), is_(equal_to((18, 24, 144 / 7))))
+        assert_that(s.columns[2].values, is_(1))
+        assert_that(s.columns[3].nulls, is_(7))
+
+    def test_single_pass(self):
+        with patch.object(TimeSeries, 'range', side_effect=AssertionError('range should not be read')):
+            self.check(series_stats(self.series()))
+
+    def test_parallel_files_merged(self):
+        self.check(series_stats(self.series(), workers=2))
+
+    def test_merge_matches_single_pass(self):
+        rows = [row(i) for i in (0, 1, 10, 11, 40, 41)]
+        for split in range(len(rows) + 1):
+            whole, first, second = SeriesStats(), SeriesStats(), SeriesStats()
+            whole.add(rows)
+            first.add(rows[:split])
+            second.add(rows[split:])
+            assert_that(first.merge(second).to_dict(), is_(equal_to(whole.to_dict())))
+
+    def test_longest_gaps_kept(self):
+        s = SeriesStats(gap=timedelta(minutes=1), max_gaps=2)
+        s.add([row(m) for m in (0, 5, 7, 20, 21, 30)])
+        assert_that(s.gap_count, is_(4))
+        assert_that(s.gaps, is_(equal_to([(row(7)[0], row(20)[0]), (row(21)[0], row(30)[0])])))
+
+    def test_out_of_order_rows_counted(self):
+        s = series_stats(ListTimeSeries([row(1), row(0), row(2)]))
+        assert_that(s.out_of_order, is_(1))
+        assert_that(s.range, is_(equal_to((row(0)[0], row(2)[0]))))
+
+    def test_nan_counted_as_null(self):
+        s = series_stats(ListTimeSeries([row(0, 18), row(1, float('nan')), row(2, 20)]))
+        beer = s.columns[0]
+        assert_that((beer.nulls, beer.min, beer.max, beer.mean), is_(equal_to((1, 18, 20, 19.0))))
+
+    def test_parallel_files_on_disk_merged(self):
+        directory = tempfile.mkdtemp()
+        try:
+            fs.utils.copydir((self.root, 'brew'), (fs.osfs.OSFS(directory), 'brew'))
+            self.check(series_stats(BeerlogJsonRepo(fs.osfs.OSFS(directory)).fetch('brew'), workers=2))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_empty(self):
+        s = series_stats(ListTimeSeries([]))
+        assert_that(s.range, is_(none()))
+        assert_that(s.columns[0].mean, is_(none()))
+
+
+if __name__ == '__main__':
+    unittest.main()